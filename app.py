@@ -1,21 +1,41 @@
-import json
+import base64
+import math
+import threading
+import time
 import bugsnag
 import logging
+from typing import List, Optional
 
-from asgiref.sync import async_to_sync
+import anyio
 from bugsnag.handlers import BugsnagHandler
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.datastructures import Headers
 
 from chatbot_api.assistant import AssistantBison
+from chatbot_api.single_flight import TokenBroadcast
+from chatbot_api.token_util import count_tokens
 from pipeline import (
+    ResponseDecision,
+    UserContext,
+    any_action_responded,
     create_all_user_context,
+    fast_json,
     make_all_response_decisions,
+    stream_all_actions,
     take_all_actions,
 )
-from pipeline.config import load_config
+from pipeline.admission import AdmissionRejected, build_admission_controller
+from pipeline.config import LLMProvider, load_config
+from pipeline.idempotency import (
+    IdempotencyRecord,
+    IdempotencyStatus,
+    build_idempotency_store,
+)
+from pipeline.job_queue import Job, JobDeferred, JobFailed, build_job_queue
+from pipeline.metrics import metrics
 
 # NOTE: Load dotenv before importing any code from other files for globals
 # TODO: Probably make this unnecessary with better abstractions
@@ -75,25 +95,232 @@ assistant = AssistantBison(
 )
 
 
+# Deduplicates repeat deliveries of the same webhook
+idempotency = build_idempotency_store(config)
+
+# Limits the generations running at once, and the request rate of each tenant
+admission_controller = build_admission_controller(config)
+
+# The text generation model, used for tokenizing prompts and responses
+textgen_model = (
+    config.openai_textgen_model
+    if config.llm_provider == LLMProvider.OpenAI
+    else config.google_textgen_model
+)
+
+
 @app.get("/chat")
 def index():
     return {"ok": True, "message": "App is running"}
 
 
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render_prometheus())
+
+
+@app.get("/usage")
+def get_usage():
+    return {"ok": True, "usage": assistant.usage_tracker.summary()}
+
+
+def record_persona_metrics(
+    persona: str,
+    context: str,
+    text_response: str,
+    start_time: float,
+    first_token_time: float,
+) -> None:
+    """Record latency and token usage of a single response, labelled by persona"""
+    end_time = time.monotonic()
+    prompt_tokens = count_tokens(context, textgen_model)
+    completion_tokens = count_tokens(text_response, textgen_model)
+
+    metrics.inc("persona_requests_total", persona=persona)
+    metrics.observe(
+        "persona_time_to_first_token_seconds",
+        first_token_time - start_time,
+        persona=persona,
+    )
+    metrics.observe("persona_response_seconds", end_time - start_time, persona=persona)
+    metrics.inc("persona_prompt_tokens_total", prompt_tokens, persona=persona)
+    metrics.inc("persona_completion_tokens_total", completion_tokens, persona=persona)
+    metrics.observe("persona_completion_tokens", completion_tokens, persona=persona)
+
+
+def send_response(
+    response_decision: ResponseDecision,
+    user_context: UserContext,
+    text_response: str,
+    responses_from_vs: str,
+    context: str,
+    start_time: float,
+    first_token_time: float,
+) -> None:
+    """Record the metrics of a finished response, and take action based on it"""
+    record_persona_metrics(
+        persona=user_context.persona,
+        context=context,
+        text_response=text_response,
+        start_time=start_time,
+        first_token_time=first_token_time,
+    )
+    take_all_actions(
+        config=config,
+        conv_info=response_decision.conversation_info,
+        text_response=text_response,
+        responses_from_vs=responses_from_vs,
+        context=context,
+    )
+
+
+def run_queued_response(job: Job) -> None:
+    """Generate and send the response to a webhook that was acknowledged earlier"""
+    start_time = time.monotonic()
+    raw_body = base64.b64decode(job.payload["body"])
+
+    # Decide again from the webhook as it was received, rather than trusting the
+    # queue with the decision
+    response_decision = make_all_response_decisions(
+        config=config,
+        request_body=fast_json.loads(raw_body),
+        request_headers=Headers(job.payload["headers"]),
+        raw_body=raw_body,
+    )
+    if response_decision.should_return_early:
+        logger.warning(f"Dropping queued response: {response_decision.response_dict}")
+        return
+
+    user_context = create_all_user_context(
+        config=config,
+        conv_info=response_decision.conversation_info,
+    )
+
+    generation = None
+    if admission_controller is not None:
+        try:
+            generation = admission_controller.acquire()
+        except AdmissionRejected as e:
+            # Not an attempt, as nothing was generated
+            raise JobDeferred(e.reason, e.retry_after) from e
+
+    stream_threads: List[threading.Thread] = []
+    responded = False
+    try:
+        try:
+            bot_response, responses_from_vs, context = assistant.get_response(
+                user_input=user_context.user_question,
+                persona=user_context.persona,
+                user_context=user_context.context_str,
+                conversation_id=user_context.conversation_id,
+            )
+
+            broadcast = TokenBroadcast(bot_response.response_gen)
+            stream_threads = stream_all_actions(
+                config, response_decision.conversation_info, broadcast.subscribe
+            )
+            first_token_time = None
+            for _ in broadcast.subscribe():
+                if first_token_time is None:
+                    first_token_time = time.monotonic()
+        finally:
+            if generation is not None:
+                generation.release()
+
+        for thread in stream_threads:
+            thread.join()
+        txt_response = broadcast.text
+
+        send_response(
+            response_decision,
+            user_context,
+            txt_response,
+            responses_from_vs,
+            context,
+            start_time,
+            first_token_time or time.monotonic(),
+        )
+        responded = True
+        if idempotency is not None and job.payload["idempotency_key"] is not None:
+            idempotency.complete(job.payload["idempotency_key"], txt_response)
+    except Exception as e:
+        # A retry would generate a different response, and send it all again
+        for thread in stream_threads:
+            thread.join()
+        if responded or any_action_responded(
+            config, response_decision.conversation_info
+        ):
+            raise JobFailed(f"Failed after responding: {e}") from e
+        raise
+
+
+def fail_queued_response(job: Job, error: BaseException) -> None:
+    """Let a redelivery of a webhook respond again once its queued response failed"""
+    if idempotency is not None and job.payload["idempotency_key"] is not None:
+        idempotency.fail(job.payload["idempotency_key"])
+    bugsnag.notify(error)
+
+
+# Sends responses to webhooks after they are acknowledged, when async_responses is set
+job_queue = build_job_queue(config, run_queued_response, fail_queued_response)
+if job_queue is not None:
+    job_queue.start()
+
+
+def reject_request(rejected: AdmissionRejected, idempotency_key: Optional[str]):
+    """Turn away a request that wasn't admitted, until it is retried"""
+    if idempotency_key is not None:
+        idempotency.fail(idempotency_key)
+    return JSONResponse(
+        content={"ok": False, "message": "Too many requests, try again later."},
+        status_code=429,
+        headers={"Retry-After": str(math.ceil(rejected.retry_after))},
+    )
+
+
+def respond_to_duplicate(key: str, record: IdempotencyRecord):
+    """Respond to a repeat delivery with the response to the first delivery"""
+    metrics.inc("duplicate_deliveries_total", status=record.status.value)
+    if record.status == IdempotencyStatus.Completed:
+        return StreamingResponse(
+            iter([record.response]), media_type="text/event-stream", status_code=200
+        )
+
+    # Queued responses are sent by a worker rather than streamed to the request
+    if job_queue is not None:
+        return JSONResponse(
+            content={"ok": True, "message": "Already queued."}, status_code=202
+        )
+
+    # Share the stream of the response if it is in flight in this process
+    tokens = idempotency.subscribe(key)
+    if tokens is not None:
+        return StreamingResponse(
+            tokens, media_type="text/event-stream", status_code=200
+        )
+    return JSONResponse(
+        content={"ok": True, "message": "Already in progress."}, status_code=208
+    )
+
+
 # Intercom posts webhooks to this route when a conversation is created or replied to
 @app.post("/chat")
 def conversations(request: Request):
+    start_time = time.monotonic()
+    idempotency_key = None
+    generation = None
     try:
-        # Process the request body in a synchronous fashion
-        request_body = async_to_sync(request.body)()
-        data_str = request_body.decode("utf-8")
-        request_body = json.loads(data_str)
+        # Read the body on the event loop this worker thread was started from. Keep
+        # the raw bytes to verify webhook signatures, and parse them only once.
+        raw_body = anyio.from_thread.run(request.body)
+        request_body = fast_json.loads(raw_body)
 
         # Based on the body, create a ResponseDecision object
         response_decision = make_all_response_decisions(
             config=config,
             request_body=request_body,
             request_headers=request.headers,
+            raw_body=raw_body,
         )
 
         # Exit early if we don't want to continue on to LLM for response
@@ -103,6 +330,40 @@ def conversations(request: Request):
                 status_code=response_decision.response_code,
             )
 
+        # Respond to repeat deliveries of a message with the first delivery's response
+        if idempotency is not None and response_decision.idempotency_key is not None:
+            record = idempotency.begin(response_decision.idempotency_key)
+            if record is not None:
+                return respond_to_duplicate(response_decision.idempotency_key, record)
+            idempotency_key = response_decision.idempotency_key
+
+        if admission_controller is not None:
+            try:
+                admission_controller.check_tenant(response_decision.tenant)
+            except AdmissionRejected as e:
+                return reject_request(e, idempotency_key)
+
+        # Acknowledge the webhook now, and respond to it from the job queue
+        if job_queue is not None:
+            job_queue.enqueue(
+                {
+                    "body": base64.b64encode(raw_body).decode("ascii"),
+                    "headers": dict(request.headers),
+                    "idempotency_key": idempotency_key,
+                },
+                priority=response_decision.priority,
+            )
+            return JSONResponse(
+                content={"ok": True, "message": "Queued."}, status_code=202
+            )
+
+        # Wait for a turn to generate, or turn the request away if it is a long wait
+        if admission_controller is not None:
+            try:
+                generation = admission_controller.acquire()
+            except AdmissionRejected as e:
+                return reject_request(e, idempotency_key)
+
         # Assemble context for assistant query from relevant sources based on conversation
         user_context = create_all_user_context(
             config=config,
@@ -114,22 +375,72 @@ def conversations(request: Request):
             user_input=user_context.user_question,
             persona=user_context.persona,
             user_context=user_context.context_str,
+            conversation_id=user_context.conversation_id,
         )
 
-        def stream_data():
-            txt_response = ""
-            for text in bot_response.response_gen:
-                txt_response += text
-                yield text
+        first_token_time = None
+        broadcast = TokenBroadcast(bot_response.response_gen)
+
+        def finish_response():
+            # Only act on the response once it has been streamed to the integrations
+            for thread in stream_threads:
+                thread.join()
+            if generation is not None:
+                generation.release()
+            if broadcast.error is not None:
+                if idempotency_key is not None:
+                    idempotency.fail(idempotency_key)
+                return
 
             # Take action based on the response from the bot
-            take_all_actions(
-                config=config,
-                conv_info=response_decision.conversation_info,
-                text_response=txt_response,
-                responses_from_vs=responses_from_vs,
-                context=context,
-            )
+            txt_response = broadcast.text
+            try:
+                send_response(
+                    response_decision,
+                    user_context,
+                    txt_response,
+                    responses_from_vs,
+                    context,
+                    start_time,
+                    first_token_time or time.monotonic(),
+                )
+            except Exception:
+                if idempotency_key is not None:
+                    idempotency.fail(idempotency_key)
+                raise
+
+            if idempotency_key is not None:
+                idempotency.complete(idempotency_key, txt_response)
+
+        if idempotency_key is not None:
+            idempotency.attach(idempotency_key, broadcast)
+        stream_threads = stream_all_actions(
+            config, response_decision.conversation_info, broadcast.subscribe
+        )
+
+        def finish_after_streams():
+            # The last token may be pulled by a stream thread, which can't wait for
+            # itself to end
+            if stream_threads:
+                threading.Thread(target=finish_response, daemon=True).start()
+            else:
+                finish_response()
+
+        # The response is finished by whichever request streams its last token, so a
+        # duplicate delivery sharing the stream finishes it if this request is dropped
+        broadcast.add_done_callback(finish_after_streams)
+
+        def stream_data():
+            nonlocal first_token_time
+            try:
+                for text in broadcast.subscribe():
+                    if first_token_time is None:
+                        first_token_time = time.monotonic()
+                    yield text
+            finally:
+                # Don't hold the turn of a generation the client stopped reading
+                if generation is not None:
+                    generation.release()
 
         return StreamingResponse(
             stream_data(),
@@ -138,6 +449,12 @@ def conversations(request: Request):
         )
 
     except Exception as e:
+        if generation is not None:
+            generation.release()
+        # Let a retry of this delivery respond again
+        if idempotency_key is not None:
+            idempotency.fail(idempotency_key)
+
         # Notify bugsnag if we hit an error
         bugsnag.notify(e)
         e.skip_bugsnag = True
@@ -0,0 +1,237 @@
+"""
+Local stand-ins for the external services used by the chatbot, so that performance can
+be measured offline without any network calls or API keys.
+"""
+import hashlib
+import re
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from langchain.embeddings.base import Embeddings
+from llama_index.llms import (
+    CompletionResponse,
+    CompletionResponseGen,
+    CustomLLM,
+    LLMMetadata,
+)
+from llama_index.llms.base import llm_completion_callback
+from llama_index.schema import BaseNode
+from llama_index.vector_stores.types import (
+    VectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from integrations.openai import OPENAI_EMB_DIM
+
+DEFAULT_RESPONSE = (
+    "Astra DB is a serverless vector database built on Apache Cassandra. "
+    "You can create a database from the Astra Portal, then generate an application "
+    "token to connect to it from your application using one of the drivers."
+)
+
+
+class FakeLLM(CustomLLM):
+    """An LLM that streams a canned response with configurable latencies"""
+
+    response: str = DEFAULT_RESPONSE
+    time_to_first_token: float = 0.0  # Seconds before the first token
+    inter_token_latency: float = 0.01  # Seconds between subsequent tokens
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake-llm")
+
+    def _tokens(self) -> Sequence[str]:
+        words = self.response.split(" ")
+        return [words[0]] + [" " + word for word in words[1:]]
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        tokens = self._tokens()
+        time.sleep(self.time_to_first_token + self.inter_token_latency * len(tokens))
+        return CompletionResponse(text=self.response)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, **kwargs: Any) -> CompletionResponseGen:
+        def gen() -> CompletionResponseGen:
+            time.sleep(self.time_to_first_token)
+            text = ""
+            for i, token in enumerate(self._tokens()):
+                if i > 0:
+                    time.sleep(self.inter_token_latency)
+                text += token
+                yield CompletionResponse(text=text, delta=token)
+
+        return gen()
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings using the hashing trick over words, so texts sharing
+    words get similar vectors, with a configurable latency per call
+    """
+
+    def __init__(self, dimension: int = OPENAI_EMB_DIM, latency: float = 0.0):
+        self.dimension = dimension
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+
+class InMemoryVectorStore(VectorStore):
+    """
+    A stand-in for AstraDBVectorStore, holding nodes in memory with exact cosine
+    search and a configurable latency per query. Accepts (and ignores) the
+    AstraDBVectorStore connection arguments, so it can be patched in its place.
+    """
+
+    stores_text: bool = True
+
+    def __init__(self, latency: float = 0.0, **kwargs: Any):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._nodes: Dict[str, BaseNode] = {}
+        self._ids: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    @property
+    def client(self) -> None:
+        return None
+
+    def add(self, nodes: Sequence[BaseNode], **kwargs: Any) -> List[str]:
+        with self._lock:
+            for node in nodes:
+                self._nodes[node.node_id] = node
+            self._matrix = None
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **kwargs: Any) -> None:
+        with self._lock:
+            self._nodes = {
+                node_id: node
+                for node_id, node in self._nodes.items()
+                if node.ref_doc_id != ref_doc_id
+            }
+            self._matrix = None
+
+    def _get_matrix(self) -> Tuple[List[str], np.ndarray]:
+        with self._lock:
+            if self._matrix is None:
+                self._ids = list(self._nodes)
+                matrix = np.array(
+                    [self._nodes[node_id].get_embedding() for node_id in self._ids],
+                    dtype=np.float32,
+                ).reshape(len(self._ids), -1)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                self._matrix = matrix / np.maximum(norms, 1e-12)
+            return self._ids, self._matrix
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        time.sleep(self.latency)
+        ids, matrix = self._get_matrix()
+        if not ids:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        query_vector = np.asarray(query.query_embedding, dtype=np.float32)
+        scores = matrix @ (query_vector / max(np.linalg.norm(query_vector), 1e-12))
+
+        if query.filters is not None:
+            for f in query.filters.filters:
+                mask = np.array(
+                    [self._nodes[i].metadata.get(f.key) == f.value for i in ids]
+                )
+                scores = np.where(mask, scores, -np.inf)
+
+        top = np.argsort(-scores)[: query.similarity_top_k]
+        top = [i for i in top if np.isfinite(scores[i])]
+        return VectorStoreQueryResult(
+            nodes=[self._nodes[ids[i]] for i in top],
+            similarities=[float(scores[i]) for i in top],
+            ids=[ids[i] for i in top],
+        )
+
+
+def make_stub_integrations_app(latency: float = 0.0) -> FastAPI:
+    """
+    A stub of the Intercom and Slack APIs. Point intercom_api_url at the server root
+    and slack_webhook_url at its /slack route. Received requests are counted in
+    `app.state.request_counts`.
+    """
+    stub_app = FastAPI()
+    stub_app.state.request_counts = {}
+    counts_lock = threading.Lock()
+
+    @stub_app.middleware("http")
+    async def count_requests(request: Request, call_next):
+        route = request.url.path.split("/")[1]
+        with counts_lock:
+            counts = stub_app.state.request_counts
+            counts[route] = counts.get(route, 0) + 1
+        return await call_next(request)
+
+    @stub_app.get("/contacts/{contact_id}")
+    def get_contact(contact_id: str):
+        time.sleep(latency)
+        return {
+            "type": "contact",
+            "id": contact_id,
+            "role": "user",
+            "name": "Fake User",
+            "email": "fake.user@example.com",
+        }
+
+    @stub_app.post("/conversations/{conversation_id}/reply")
+    def reply(conversation_id: str):
+        time.sleep(latency)
+        return {"type": "conversation", "id": conversation_id}
+
+    @stub_app.post("/slack")
+    def slack():
+        time.sleep(latency)
+        return {"ok": True}
+
+    return stub_app
+
+
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(
+    app: FastAPI, port: Optional[int] = None
+) -> Tuple[uvicorn.Server, str]:
+    """Serve `app` from a background thread, returning the server and its base URL"""
+    port = port or get_free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
@@ -0,0 +1,100 @@
+"""
+Benchmark of concurrent generation through the stateless chat path, using a stub LLM
+that streams tokens with a fixed latency.
+
+Every worker runs the same number of requests, so since the path shares no state
+between requests, throughput should scale linearly with the number of workers
+(a scaling efficiency close to 1.0).
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/generation_concurrency.py --concurrency 1 2 4 8 16 32
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from benchmarks.fakes import FakeLLM
+from chatbot_api.generation import build_messages, stream_chat_tokens
+
+PROMPT = "How do I create an Astra DB database?"
+
+
+def run_level(
+    llm: FakeLLM, concurrency: int, requests_per_worker: int
+) -> Dict[str, Any]:
+    """Run `concurrency` workers that each stream `requests_per_worker` responses"""
+
+    def worker() -> int:
+        tokens = 0
+        for _ in range(requests_per_worker):
+            for _ in stream_chat_tokens(llm, build_messages(PROMPT)):
+                tokens += 1
+        return tokens
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(worker) for _ in range(concurrency)]
+        tokens = sum(future.result() for future in futures)
+    elapsed = time.perf_counter() - start
+
+    requests = concurrency * requests_per_worker
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "tokens": tokens,
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed,
+    }
+
+
+def run_benchmark(
+    concurrency_levels: List[int],
+    requests_per_worker: int,
+    inter_token_latency: float,
+) -> List[Dict[str, Any]]:
+    llm = FakeLLM(inter_token_latency=inter_token_latency)
+
+    results = []
+    for concurrency in concurrency_levels:
+        result = run_level(llm, concurrency, requests_per_worker)
+        results.append(result)
+
+    # Scaling efficiency relative to perfectly linear scaling from the first level
+    base = results[0]
+    base_per_worker = base["requests_per_second"] / base["concurrency"]
+    for result in results:
+        result["scaling_efficiency"] = result["requests_per_second"] / (
+            base_per_worker * result["concurrency"]
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    parser.add_argument("--requests-per-worker", type=int, default=5)
+    parser.add_argument("--inter-token-latency", type=float, default=0.005)
+    parser.add_argument("--output", help="Optionally write the results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        args.concurrency, args.requests_per_worker, args.inter_token_latency
+    )
+
+    print(f"{'workers':>8} {'requests':>9} {'req/s':>9} {'efficiency':>11}")
+    for result in results:
+        print(
+            f"{result['concurrency']:>8} {result['requests']:>9} "
+            f"{result['requests_per_second']:>9.1f} "
+            f"{result['scaling_efficiency']:>11.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,260 @@
+"""
+Offline load test of the /chat endpoint.
+
+The app is started in-process with every external service replaced by a local fake
+(see benchmarks/fakes.py): a streaming LLM, hashing embeddings, an in-memory stand-in
+for AstraDBVectorStore and a stub Intercom/Slack server, each with configurable
+latency. Requests are sent at a fixed concurrency, and throughput, time to first token,
+latency percentiles and memory use are reported and optionally saved as JSON.
+
+Given a --baseline results file, exits with a non-zero status if any result regressed
+by more than --tolerance, so CI can catch performance regressions.
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/load_test.py --requests 200 --concurrency 16 \\
+        --output load_test.json
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from unittest.mock import patch
+
+import httpx
+from llama_index.schema import TextNode
+
+from benchmarks.fakes import (
+    FakeEmbeddings,
+    FakeLLM,
+    InMemoryVectorStore,
+    make_stub_integrations_app,
+    start_server,
+)
+from pipeline.config import Config
+from pipeline.metrics import percentile
+
+FAKE_SECRET = "load-test-secret"
+
+# Results where a higher value is a regression, and where a lower value is
+REGRESSION_HIGHER = [
+    "time_to_first_token_p95",
+    "latency_p95",
+    "latency_p99",
+    "peak_rss_mb",
+]
+REGRESSION_LOWER = ["requests_per_second"]
+
+
+def make_config(integration: str, stub_url: str) -> Config:
+    """A config using fake credentials, with integrations pointed at the stub server"""
+    return Config(
+        company="DataStax",
+        company_url="example.com",
+        doc_pages=[],
+        response_decider_cls=[f"{integration}ResponseDecider"],
+        user_context_creator_cls=[f"{integration}UserContextCreator"],
+        response_actor_cls=[f"{integration}ResponseActor"],
+        openai_api_key="fake-openai-key",
+        astra_db_application_token="fake-astra-token",
+        astra_db_api_endpoint="http://localhost",
+        bot_intercom_id="fake-bot-id",
+        intercom_token="fake-intercom-token",
+        intercom_client_secret=FAKE_SECRET,
+        intercom_api_url=stub_url,
+        slack_webhook_url=f"{stub_url}/slack",
+    )
+
+
+def load_app(config: Config, args: argparse.Namespace):
+    """Import the app with the LLM, embeddings and vector store replaced by fakes"""
+    llm = FakeLLM(
+        time_to_first_token=args.llm_ttft,
+        inter_token_latency=args.llm_inter_token_latency,
+    )
+    with patch("pipeline.config.load_config", return_value=config), patch(
+        "chatbot_api.assistant.build_llm", return_value=llm
+    ), patch(
+        "chatbot_api.assistant.OpenAIEmbeddings",
+        lambda **kwargs: FakeEmbeddings(latency=args.embedding_latency),
+    ), patch(
+        "chatbot_api.vector_store.ProjectedAstraDBVectorStore",
+        lambda **kwargs: InMemoryVectorStore(latency=args.vector_store_latency),
+    ):
+        import app as app_module
+
+    # Seed the vector store with synthetic documentation
+    app_module.assistant.index.insert_nodes(
+        [
+            TextNode(
+                text=f"Document {i}: {question} " * 8,
+                metadata={"source": f"https://docs.example.com/page-{i}"},
+            )
+            for i, question in enumerate(load_questions(args.questions) * 10)
+        ]
+    )
+    return app_module.app
+
+
+def load_questions(path: str) -> List[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def make_request(integration: str, question: str, i: int) -> Dict[str, Any]:
+    """Build the body and headers for the i-th request"""
+    if integration == "Example":
+        return {
+            "content": json.dumps({"question": question}).encode("utf-8"),
+            "headers": {"Content-Type": "application/json"},
+        }
+
+    with open(os.path.join("tests", "test_request_intercom.json")) as f:
+        body = json.load(f)
+    body["data"]["item"]["id"] = f"load-test-{i}"
+    body["data"]["item"]["source"]["body"] = question
+    for part in body["data"]["item"]["conversation_parts"]["conversation_parts"]:
+        part["body"] = question
+
+    content = json.dumps(body).encode("utf-8")
+    digest = hmac.new(FAKE_SECRET.encode(), msg=content, digestmod=hashlib.sha1)
+    return {
+        "content": content,
+        "headers": {
+            "Content-Type": "application/json",
+            "X-Hub-Signature": f"sha1={digest.hexdigest()}",
+        },
+    }
+
+
+def send_request(client: httpx.Client, request: Dict[str, Any]) -> Dict[str, Any]:
+    start_time = time.perf_counter()
+    first_token_time = None
+    chunks = 0
+    with client.stream("POST", "/chat", **request) as response:
+        for _ in response.iter_text():
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            chunks += 1
+    end_time = time.perf_counter()
+
+    return {
+        "ok": response.status_code < 300,
+        "time_to_first_token": (first_token_time or end_time) - start_time,
+        "latency": end_time - start_time,
+        "chunks": chunks,
+    }
+
+
+def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    stub_app = make_stub_integrations_app(latency=args.integration_latency)
+    _, stub_url = start_server(stub_app)
+
+    config = make_config(args.integration, stub_url)
+    app = load_app(config, args)
+    _, app_url = start_server(app)
+
+    questions = load_questions(args.questions)
+    requests = [
+        make_request(
+            args.integration,
+            # Make questions unique unless testing how identical questions behave
+            questions[i % len(questions)]
+            + ("" if args.shared_questions else f" (#{i})"),
+            i,
+        )
+        for i in range(args.requests)
+    ]
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    with httpx.Client(base_url=app_url, timeout=600) as client:
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(
+                executor.map(lambda request: send_request(client, request), requests)
+            )
+        elapsed = time.perf_counter() - start_time
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    ok_results = [result for result in results if result["ok"]]
+    ttfts = [result["time_to_first_token"] for result in ok_results]
+    latencies = [result["latency"] for result in ok_results]
+
+    report = {
+        "integration": args.integration,
+        "requests": len(results),
+        "errors": len(results) - len(ok_results),
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "requests_per_second": len(ok_results) / elapsed,
+        "chunks_per_second": sum(r["chunks"] for r in ok_results) / elapsed,
+        "peak_rss_mb": rss_after,
+        "rss_growth_mb": rss_after - rss_before,
+        "stub_requests": dict(stub_app.state.request_counts),
+    }
+    for q in (50, 95, 99):
+        report[f"time_to_first_token_p{q}"] = percentile(ttfts, q / 100)
+        report[f"latency_p{q}"] = percentile(latencies, q / 100)
+
+    return report
+
+
+def find_regressions(
+    report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """Describe every result that is worse than the baseline by more than tolerance"""
+    regressions = []
+    for key in REGRESSION_HIGHER:
+        if key in baseline and report[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {report[key]:.4f} > {baseline[key]:.4f}")
+    for key in REGRESSION_LOWER:
+        if key in baseline and report[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {report[key]:.4f} < {baseline[key]:.4f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--integration", choices=["Example", "Intercom"], default="Example"
+    )
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--questions", default=os.path.join("tests", "test_questions.txt")
+    )
+    parser.add_argument(
+        "--shared-questions",
+        action="store_true",
+        help="Reuse questions verbatim instead of making each one unique",
+    )
+    parser.add_argument("--llm-ttft", type=float, default=0.2)
+    parser.add_argument("--llm-inter-token-latency", type=float, default=0.01)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--vector-store-latency", type=float, default=0.03)
+    parser.add_argument("--integration-latency", type=float, default=0.05)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this results JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = run_load_test(args)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Performance regressions against the baseline:")
+            print("\n".join(f"  {regression}" for regression in regressions))
+            sys.exit(1)
@@ -0,0 +1,129 @@
+"""
+Benchmark of normalizing Intercom message bodies, comparing chatbot_api/normalize.py
+to the previous regex tag stripping.
+
+Bodies are read from a corpus file of Intercom webhook payloads, one JSON payload per
+line (such as exported webhook deliveries), taking the body of the source and of every
+conversation part. Without a corpus, a built-in set of typical Intercom bodies is used.
+The benchmark also checks that normalizing scales linearly with the size of the body.
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/normalize_benchmark.py --corpus deliveries.jsonl
+"""
+import argparse
+import json
+import re
+import time
+from typing import Any, Callable, Dict, List
+
+from chatbot_api.normalize import canonical_question, html_to_text
+
+SAMPLE_BODIES = [
+    "<p>How do I create a vector database?</p>",
+    "<p>Hi,</p><p>I'm getting a timeout when connecting with the Python driver."
+    "</p><p>Any idea what&#39;s wrong?</p>",
+    "<p>What&#x27;s the difference between Astra DB Serverless &amp; Classic?</p>",
+    "<p>Our query fails with:<br><code>InvalidRequest: Error from server: code=2200"
+    "</code><br>Thanks</p>",
+    '<p>I followed <a href="https://docs.datastax.com/en/astra/home/astra.html"'
+    ' target="_blank" rel="nofollow noopener noreferrer">the docs</a> but the '
+    "token&nbsp;doesn't work.</p>",
+    "<ol><li>Create a database</li><li>Create a collection</li><li>Insert vectors"
+    "</li></ol><p>Is step 3 limited to 20 documents per request?</p>",
+    "<p>Is 1 &lt; dimension &lt;= 4096 the supported range?</p>",
+    "<p>   </p><p>Can I   use   LangChain with Astra?</p><p><br></p>",
+]
+
+
+def legacy_html_to_text(body: str) -> str:
+    return re.sub("<[^<]+?>", "", body)
+
+
+def load_corpus(path: str) -> List[str]:
+    """The bodies of every message in a file of Intercom webhook payloads"""
+    bodies = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)["data"]["item"]
+            parts = item["conversation_parts"]["conversation_parts"]
+            for message in [item.get("source") or {}] + parts:
+                if message.get("body"):
+                    bodies.append(message["body"])
+    return bodies
+
+
+def time_per_body(
+    normalize: Callable[[str], str], bodies: List[str], min_seconds: float = 0.5
+) -> float:
+    """The mean seconds to normalize a body, over passes for at least min_seconds"""
+    passes = 0
+    start = time.perf_counter()
+    while passes == 0 or time.perf_counter() - start < min_seconds:
+        for body in bodies:
+            normalize(body)
+        passes += 1
+    return (time.perf_counter() - start) / (passes * len(bodies))
+
+
+def run_benchmark(bodies: List[str]) -> Dict[str, Any]:
+    total_bytes = sum(len(body.encode("utf-8")) for body in bodies)
+    normalizers = {
+        "legacy_regex": legacy_html_to_text,
+        "html_to_text": html_to_text,
+        "canonical_question": lambda body: canonical_question(html_to_text(body)),
+    }
+    report: Dict[str, Any] = {"bodies": len(bodies), "normalizers": {}}
+    for name, normalize in normalizers.items():
+        seconds = time_per_body(normalize, bodies)
+        report["normalizers"][name] = {
+            "microseconds_per_body": seconds * 1e6,
+            "mb_per_second": total_bytes / len(bodies) / seconds / 2**20,
+        }
+
+    # Bodies whose text differs, from decoded entities and line breaks
+    report["changed_bodies"] = sum(
+        legacy_html_to_text(body) != html_to_text(body) for body in bodies
+    )
+
+    # Time per character should stay flat as bodies grow, including adversarial ones
+    report["scaling"] = []
+    for size in [1_000, 10_000, 100_000]:
+        body = ("<p>Question &amp; answer<br>" * size)[:size] + "<a" * (size // 2)
+        seconds = time_per_body(html_to_text, [body])
+        report["scaling"].append(
+            {
+                "characters": len(body),
+                "nanoseconds_per_character": seconds / len(body) * 1e9,
+            }
+        )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", help="A file of Intercom webhook payloads")
+    parser.add_argument("--output", help="Optionally write the results as JSON")
+    args = parser.parse_args()
+
+    bodies = load_corpus(args.corpus) if args.corpus else SAMPLE_BODIES
+    report = run_benchmark(bodies)
+
+    print(f"{report['bodies']} bodies, {report['changed_bodies']} with changed text")
+    print(f"{'normalizer':>20} {'us/body':>9} {'MB/s':>9}")
+    for name, result in report["normalizers"].items():
+        print(
+            f"{name:>20} {result['microseconds_per_body']:>9.2f} "
+            f"{result['mb_per_second']:>9.1f}"
+        )
+    print(f"\n{'characters':>10} {'ns/char':>9}")
+    for result in report["scaling"]:
+        print(
+            f"{result['characters']:>10} {result['nanoseconds_per_character']:>9.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
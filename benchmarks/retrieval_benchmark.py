@@ -0,0 +1,386 @@
+"""
+Benchmark of retrieval quality, context size and latency, without calling the LLM.
+
+Questions are read from either a text file with one question per line (such as
+tests/test_questions.txt), which only measures context size and latency, or a JSON
+lines file where each line has a "question" and a list of "relevant" labels. A
+retrieved chunk is relevant if its source URL or file name equals a label, or if a
+label is a substring of its text. For labelled questions recall@k and MRR are reported.
+
+The "snapshot" command chunks and embeds the scraped documents into a local vector
+store (see chatbot_api/vector_store.py), caching every embedding. The "run" command
+then evaluates retrieval against the snapshot fully offline, as long as the questions'
+embeddings are cached (run it once with --embed-missing to cache them), or against the
+live vector store with --live. With --quantization, the snapshot is also searched with
+int8 or binary quantized embeddings, reporting their overlap with exact search and
+their memory use.
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/retrieval_benchmark.py snapshot --docs output
+    PYTHONPATH=. python benchmarks/retrieval_benchmark.py run \\
+        --questions tests/test_questions.txt --k 1 2 4 8 --quantization int8 binary
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from llama_index import (
+    ServiceContext,
+    SimpleDirectoryReader,
+    StorageContext,
+    VectorStoreIndex,
+)
+from llama_index.embeddings import LangchainEmbedding
+from llama_index.node_parser import SimpleNodeParser
+from llama_index.schema import NodeWithScore
+
+from chatbot_api.assistant import format_relevant_docs
+from chatbot_api.embedding_cache import CachedEmbeddings
+from chatbot_api.token_util import count_tokens
+from chatbot_api.vector_store import (
+    LocalVectorStore,
+    bytes_per_vector,
+    get_embedding_dimension,
+    read_manifest,
+    write_manifest,
+)
+from integrations.google import GECKO_EMB_DIM
+from integrations.openai import OPENAI_EMB_DIM
+from pipeline.config import Quantization
+from pipeline.metrics import percentile
+
+SNAPSHOT_DIR = os.path.join(".benchmark", "retrieval_snapshot")
+EMBEDDING_CACHE_FILE = "embeddings.npz"
+
+QUANTIZATIONS = {
+    "none": None,
+    "int8": Quantization.Int8,
+    "binary": Quantization.Binary,
+}
+
+# Matches the chunking in data/compile_documents.py
+CHUNK_SIZE = 250
+CHUNK_OVERLAP = 125
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """Load questions, with their relevance labels when given as JSON lines"""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                questions.append(json.loads(line))
+            else:
+                questions.append({"question": line})
+    return questions
+
+
+def is_relevant(node: NodeWithScore, labels: List[str]) -> bool:
+    metadata = node.node.metadata
+    sources = {
+        metadata.get(key) for key in ("source", "url", "file_name", "file_path")
+    }
+    text = node.node.get_content()
+    return any(label in sources or label in text for label in labels)
+
+
+def get_embeddings(args: argparse.Namespace, model_name: str) -> CachedEmbeddings:
+    """Cached embeddings, backed by the configured model only if allowed"""
+    embeddings = None
+    if args.embed_missing:
+        from pipeline.config import LLMProvider, load_config
+
+        load_dotenv(".env")
+        config = load_config()
+        args.embedding_dimension = get_embedding_dimension(config)
+        if config.llm_provider == LLMProvider.OpenAI:
+            from langchain.embeddings import OpenAIEmbeddings
+
+            model_name = config.openai_embeddings_model
+            embeddings = OpenAIEmbeddings(model=model_name)
+        else:
+            from langchain.embeddings import VertexAIEmbeddings
+            from integrations.google import init_gcp
+
+            init_gcp(config)
+            model_name = config.google_embeddings_model
+            embeddings = VertexAIEmbeddings(model_name=model_name)
+
+    return CachedEmbeddings(
+        os.path.join(args.snapshot_dir, EMBEDDING_CACHE_FILE),
+        embeddings=embeddings,
+        model_name=model_name,
+    )
+
+
+def build_snapshot(args: argparse.Namespace) -> None:
+    """Chunk and embed the documents into a local vector store snapshot"""
+    args.embed_missing = True
+    embeddings = get_embeddings(args, model_name="")
+    vector_store = LocalVectorStore(args.snapshot_dir, args.embedding_dimension)
+    if vector_store.count:
+        raise ValueError(f"A snapshot already exists in {args.snapshot_dir}")
+
+    service_context = ServiceContext.from_defaults(
+        llm=None,
+        embed_model=LangchainEmbedding(embeddings),
+        node_parser=SimpleNodeParser.from_defaults(
+            chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
+        ),
+    )
+
+    documents = SimpleDirectoryReader(args.docs).load_data()
+    VectorStoreIndex.from_documents(
+        documents=documents,
+        storage_context=StorageContext.from_defaults(vector_store=vector_store),
+        service_context=service_context,
+        show_progress=True,
+    )
+    embeddings.save()
+
+    manifest = read_manifest(args.snapshot_dir)
+    manifest.update(
+        embeddings_model=embeddings.model_name,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        documents=len(documents),
+    )
+    write_manifest(args.snapshot_dir, manifest)
+
+
+def get_snapshot_retriever(
+    args: argparse.Namespace, quantization: Optional[Quantization] = None
+) -> Callable[[str, int], List[NodeWithScore]]:
+    manifest = read_manifest(args.snapshot_dir)
+    if not manifest:
+        raise FileNotFoundError(f"No snapshot in {args.snapshot_dir}, run snapshot")
+
+    embeddings = get_embeddings(args, manifest["embeddings_model"])
+    service_context = ServiceContext.from_defaults(
+        llm=None, embed_model=LangchainEmbedding(embeddings)
+    )
+    vector_store = LocalVectorStore(
+        args.snapshot_dir,
+        manifest["dimension"],
+        quantization=quantization,
+        rescore_factor=args.rescore_factor,
+    )
+    index = VectorStoreIndex.from_vector_store(
+        vector_store=vector_store, service_context=service_context
+    )
+
+    def retrieve(query: str, k: int) -> List[NodeWithScore]:
+        return index.as_retriever(similarity_top_k=k).retrieve(query)
+
+    retrieve.embeddings = embeddings
+    retrieve.vector_store = vector_store
+    return retrieve
+
+
+def get_live_retriever() -> Callable[[str, int], List[NodeWithScore]]:
+    from chatbot_api.assistant import AssistantBison
+    from pipeline.config import load_config
+
+    load_dotenv(".env")
+    assistant = AssistantBison(config=load_config())
+    return assistant.retrieve
+
+
+def evaluate(
+    retrieve: Callable[[str, int], List[NodeWithScore]],
+    questions: List[Dict[str, Any]],
+    ks: List[int],
+    exact_ids: Optional[List[List[str]]] = None,
+) -> Tuple[Dict[str, Any], List[List[str]]]:
+    """
+    Retrieve the top max(ks) chunks per question, and score every k from those. If
+    given the ids retrieved by exact search, also report the overlap with them.
+
+    :returns: A tuple of (the report, the ids retrieved for each question)
+    """
+    max_k = max(ks)
+    latencies = []
+    retrieved_ids = []
+    per_k = {
+        k: {"recall": [], "reciprocal_rank": [], "tokens": [], "overlap": []}
+        for k in ks
+    }
+
+    # Warm up, so one-off loading isn't counted in the latencies
+    if questions:
+        retrieve(questions[0]["question"], max_k)
+
+    for i, question in enumerate(questions):
+        start_time = time.perf_counter()
+        nodes = retrieve(question["question"], max_k)
+        latencies.append(time.perf_counter() - start_time)
+        retrieved_ids.append([node.node.node_id for node in nodes])
+
+        labels = question.get("relevant") or []
+        relevant = [is_relevant(node, labels) for node in nodes]
+        for k in ks:
+            scores = per_k[k]
+            scores["tokens"].append(count_tokens(format_relevant_docs(nodes[:k])))
+            if exact_ids is not None and exact_ids[i][:k]:
+                overlap = set(retrieved_ids[i][:k]) & set(exact_ids[i][:k])
+                scores["overlap"].append(len(overlap) / len(exact_ids[i][:k]))
+            if not labels:
+                continue
+            found = {
+                label
+                for node in nodes[:k]
+                for label in labels
+                if is_relevant(node, [label])
+            }
+            scores["recall"].append(len(found) / len(labels))
+            first_relevant = next(
+                (rank for rank, rel in enumerate(relevant[:k], 1) if rel), None
+            )
+            scores["reciprocal_rank"].append(
+                1 / first_relevant if first_relevant else 0.0
+            )
+
+    def mean(values: List[float]) -> Optional[float]:
+        return sum(values) / len(values) if values else None
+
+    report = {
+        "questions": len(questions),
+        "labelled_questions": sum(1 for q in questions if q.get("relevant")),
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "by_k": {
+            k: {
+                "recall": mean(scores["recall"]),
+                "mrr": mean(scores["reciprocal_rank"]),
+                "overlap_with_exact": mean(scores["overlap"]),
+                "mean_context_tokens": mean(scores["tokens"]),
+            }
+            for k, scores in per_k.items()
+        },
+    }
+    return report, retrieved_ids
+
+
+def fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"{report['questions']} questions ({report['labelled_questions']} labelled), "
+        f"retrieval latency p50={report['latency_p50'] * 1000:.1f}ms "
+        f"p95={report['latency_p95'] * 1000:.1f}ms "
+        f"p99={report['latency_p99'] * 1000:.1f}ms"
+    )
+    print(f"{'k':>4} {'recall@k':>9} {'MRR':>7} {'exact@k':>8} {'tokens':>8}")
+    for k, scores in report["by_k"].items():
+        print(
+            f"{k:>4} {fmt(scores['recall']):>9} {fmt(scores['mrr']):>7} "
+            f"{fmt(scores['overlap_with_exact']):>8} "
+            f"{fmt(scores['mean_context_tokens']):>8}"
+        )
+
+
+def get_memory_report(snapshot_vectors: int) -> Dict[str, Any]:
+    """The in-memory index size per quantization, for each provider's embeddings"""
+    return {
+        name: {
+            quantization_name: {
+                "bytes_per_vector": bytes_per_vector(quantization, dimension),
+                "snapshot_mb": bytes_per_vector(quantization, dimension)
+                * snapshot_vectors
+                / 2**20,
+                "mb_per_million_vectors": bytes_per_vector(quantization, dimension)
+                * 10**6
+                / 2**20,
+            }
+            for quantization_name, quantization in QUANTIZATIONS.items()
+        }
+        for name, dimension in [("openai", OPENAI_EMB_DIM), ("google", GECKO_EMB_DIM)]
+    }
+
+
+def print_memory_report(memory: Dict[str, Any]) -> None:
+    print(
+        f"{'model':>8} {'quantization':>13} {'bytes/vector':>13} "
+        f"{'MB/1M vectors':>14}"
+    )
+    for name, by_quantization in memory.items():
+        for quantization, sizes in by_quantization.items():
+            print(
+                f"{name:>8} {quantization:>13} {sizes['bytes_per_vector']:>13} "
+                f"{sizes['mb_per_million_vectors']:>14.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help=build_snapshot.__doc__)
+    snapshot_parser.add_argument("--docs", default="output")
+    snapshot_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    snapshot_parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+
+    run_parser = subparsers.add_parser("run", help="Evaluate retrieval")
+    run_parser.add_argument(
+        "--questions", default=os.path.join("tests", "test_questions.txt")
+    )
+    run_parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 4, 8])
+    run_parser.add_argument(
+        "--quantization",
+        nargs="+",
+        choices=list(QUANTIZATIONS),
+        default=["none"],
+        help="Compare the accuracy and memory of quantized embeddings to exact search",
+    )
+    run_parser.add_argument("--rescore-factor", type=int, default=4)
+    run_parser.add_argument(
+        "--embed-missing",
+        action="store_true",
+        help="Embed questions missing from the cache with the configured model",
+    )
+    run_parser.add_argument(
+        "--live", action="store_true", help="Use the configured live vector store"
+    )
+    run_parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        build_snapshot(args)
+    elif args.live:
+        questions = load_questions(args.questions)
+        report, _ = evaluate(get_live_retriever(), questions, args.k)
+        print_report(report)
+    else:
+        questions = load_questions(args.questions)
+        report = {"quantization": {}}
+        exact_ids = None
+        # Exact search always runs first, as the reference for quantized search
+        for name in ["none"] + [q for q in args.quantization if q != "none"]:
+            retrieve = get_snapshot_retriever(args, QUANTIZATIONS[name])
+            result, retrieved_ids = evaluate(retrieve, questions, args.k, exact_ids)
+            exact_ids = exact_ids or retrieved_ids
+            retrieve.embeddings.save()
+
+            result["index_mb"] = retrieve.vector_store.index_bytes / 2**20
+            report["quantization"][name] = result
+            print(f"\nQuantization: {name} (index {result['index_mb']:.2f}MB)")
+            print_report(result)
+
+        report["memory"] = get_memory_report(retrieve.vector_store.count)
+        print()
+        print_memory_report(report["memory"])
+
+    if args.command == "run" and args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,70 @@
+"""
+A local stand-in for the Scorecard API, for running and testing run_tests.py offline.
+
+Usage:
+
+    STUB_TESTSET_SIZE=500 uvicorn benchmarks.scorecard_stub:app --port 8100
+    SCORECARD_BASE_URL=http://127.0.0.1:8100/ SCORECARD_API_KEY=stub \\
+        INPUT_TESTSET_ID=1 SCORING_CONFIG_ID=1 python run_tests.py
+"""
+import os
+import threading
+from typing import Any, Dict
+
+from fastapi import FastAPI
+
+DEFAULT_QUESTIONS = [
+    "How do I create an Astra DB database?",
+    "What is a storage-attached index?",
+    "How do I connect to Cassandra from Python?",
+    "What are the benefits of vector search?",
+]
+
+
+def make_stub_scorecard_app(testset_size: int = 500) -> FastAPI:
+    """
+    Serves a synthetic testset of `testset_size` testcases for any testset id, and
+    keeps the runs and testrecords it receives in `app.state`
+    """
+    stub_app = FastAPI()
+    stub_app.state.runs = {}
+    stub_app.state.testrecords = []
+    lock = threading.Lock()
+
+    @stub_app.post("/create-run")
+    def create_run(body: Dict[str, Any]):
+        with lock:
+            run_id = len(stub_app.state.runs) + 1
+            stub_app.state.runs[run_id] = body
+        return {"run_id": run_id}
+
+    @stub_app.get("/testset/{testset_id}")
+    def get_testset(testset_id: int):
+        return {
+            "data": [
+                {
+                    "id": i,
+                    "testset_id": testset_id,
+                    "user_query": f"{DEFAULT_QUESTIONS[i % len(DEFAULT_QUESTIONS)]} "
+                    f"(case {i})",
+                }
+                for i in range(testset_size)
+            ]
+        }
+
+    @stub_app.post("/create-testrecord")
+    def create_testrecord(body: Dict[str, Any]):
+        with lock:
+            stub_app.state.testrecords.append(body)
+        return {"ok": True}
+
+    @stub_app.patch("/update-run/{run_id}")
+    def update_run(run_id: int, status: str):
+        with lock:
+            stub_app.state.runs[run_id]["status"] = status
+        return {"run_id": run_id, "status": status}
+
+    return stub_app
+
+
+app = make_stub_scorecard_app(int(os.getenv("STUB_TESTSET_SIZE", "500")))
@@ -1,20 +1,63 @@
+import logging
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from langchain.embeddings.base import Embeddings
 from langchain.embeddings import OpenAIEmbeddings, VertexAIEmbeddings
-from langchain.llms import VertexAI
 from llama_index import VectorStoreIndex, ServiceContext
-from llama_index.vector_stores import AstraDBVectorStore
 from llama_index.embeddings import LangchainEmbedding
-from llama_index.llms import OpenAI
+from llama_index.indices.query.schema import QueryBundle
+from llama_index.llms import ChatMessage
 from llama_index.response.schema import StreamingResponse
+from llama_index.schema import NodeWithScore
 
+from chatbot_api.citations import SourceIndex, with_citations, without_sources
+from chatbot_api.collection_alias import CollectionAlias, build_collection_alias
+from chatbot_api.faq_index import FaqIndex
+from chatbot_api.memory import (
+    ConversationMemoryStore,
+    ConversationState,
+    SqliteMemoryBackend,
+    make_llm_summarizer,
+)
+from chatbot_api.generation import build_messages
+from chatbot_api.normalize import canonical_question
 from chatbot_api.prompt_util import get_template
-from integrations.google import GECKO_EMB_DIM, init_gcp
-from integrations.openai import OPENAI_EMB_DIM
+from chatbot_api.providers import ProviderPool, build_llm, get_textgen_model
+from chatbot_api.retrieval_router import NO_CONTEXT_TAG, RetrievalRoute, route_question
+from chatbot_api.single_flight import SingleFlight
+from chatbot_api.usage import build_usage_tracker
+from chatbot_api.vector_store import build_vector_store
+from integrations.google import init_gcp
 from pipeline.config import Config, LLMProvider
-from llama_index.chat_engine import SimpleChatEngine
+from pipeline.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def format_relevant_docs(
+    nodes: List[NodeWithScore], sources: Optional[SourceIndex] = None
+) -> str:
+    """
+    Format retrieved nodes into the context string given to the LLM. Nodes are labelled
+    with the citation id of their source, added to `sources`, rather than its URL.
+    """
+    if sources is None:
+        sources = SourceIndex()
+    raw_text = []
+    for doc in nodes:
+        citation_id = sources.add(doc.metadata)
+        if citation_id:
+            raw_text.append(f"[{citation_id}] {doc.get_content()}")
+        else:
+            raw_text.append(doc.get_content())
+    vector_search_results = "- " + "\n\n- ".join(
+        raw_text
+    )  # Prevent any one document from being too long
+
+    return vector_search_results
 
 
 class Assistant(ABC):
@@ -26,58 +69,120 @@ class Assistant(ABC):
         llm=None,
     ):
         self.config = config
+        self.k = k
         self.embedding_model = LangchainEmbedding(embeddings)
         self.llm = llm
 
-        embedding_dimension = (
-            OPENAI_EMB_DIM
-            if self.config.llm_provider == LLMProvider.OpenAI
-            else GECKO_EMB_DIM
-        )
-
-        # Initialize the vector store, which contains the vector embeddings of the data
-        self.vectorstore = AstraDBVectorStore(
-            token=self.config.astra_db_application_token,
-            api_endpoint=self.config.astra_db_api_endpoint,
-            collection_name=self.config.astra_db_table_name,
-            embedding_dimension=embedding_dimension,
-        )
-
         self.service_context = ServiceContext.from_defaults(
             llm=llm, embed_model=self.embedding_model
         )
 
-        self.index = VectorStoreIndex.from_vector_store(
-            vector_store=self.vectorstore, service_context=self.service_context
-        )
+        # Initialize the vector store, which contains the vector embeddings of the
+        # data. With versioned collections, the version the alias points to is
+        # served, and swapped for another whenever the alias changes.
+        self.collection_alias: Optional[CollectionAlias] = None
+        self.version = None
+        if self.config.versioned_collections:
+            self.collection_alias = build_collection_alias(self.config)
+            self.version = self.collection_alias.get()
+        self._load_index(self.version)
+        if self.collection_alias is not None:
+            threading.Thread(target=self._watch_alias, daemon=True).start()
 
-        self.query_engine = self.index.as_query_engine(
-            similarity_top_k=k, streaming=True
+    def _load_index(self, version: Optional[str]) -> None:
+        vectorstore = build_vector_store(self.config, version=version)
+        index = VectorStoreIndex.from_vector_store(
+            vector_store=vectorstore, service_context=self.service_context
         )
+        # Only retrieve the source nodes, the LLM is called separately
+        retriever = index.as_retriever(similarity_top_k=self.k)
 
-        self.chat_engine = SimpleChatEngine.from_defaults(service_context=self.service_context)
+        self.vectorstore = vectorstore
+        self.index = index
+        self.retriever = retriever
+        # Swapped in a single assignment, so each retrieval sees one version
+        self._serving = (index, retriever)
 
-    # Get a response from the vector search, aka the relevant data
-    def find_relevant_docs(self, query: str) -> str:
-        response = self.query_engine.query(
-            query
-        )  # TODO: Retriever (index.as_retriever (returns list of source nodes instead of response object))
-        results = response.source_nodes
-
-        raw_text = []
-        for doc in results:
+    # Serve the version the collection alias points to, if it has changed
+    def refresh_version(self) -> None:
+        version = self.collection_alias.get()
+        if version != self.version:
+            self._load_index(version)
+            self.version = version
+            metrics.inc("collection_swaps_total")
+            logger.info(f"Serving collection version {version}")
+
+    def _watch_alias(self) -> None:
+        while True:
+            time.sleep(self.config.collection_alias_poll_seconds)
             try:
-                raw_text.append(
-                    doc.get_content()
-                    + f"\nPrevious document was from URL link: {doc.metadata['source']}"
-                )
-            except KeyError:
-                raw_text.append(doc.get_content())
-        vector_search_results = "- " + "\n\n- ".join(
-            raw_text
-        )  # Prevent any one document from being too long
+                self.refresh_version()
+            except Exception as e:
+                logger.error(f"Unable to check the collection alias: {e}")
+
+    # Get the nodes most relevant to the query from the vector search, optionally
+    # only among the nodes matching a metadata filter. The query's embedding is
+    # computed unless given.
+    def retrieve(
+        self,
+        query: str,
+        k: Optional[int] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None,
+    ) -> List[NodeWithScore]:
+        index, retriever = self._serving
+        if metadata_filter:
+            retriever = index.as_retriever(
+                similarity_top_k=k or self.k,
+                vector_store_kwargs={"metadata_filter": metadata_filter},
+            )
+        elif k is not None and k != self.k:
+            retriever = index.as_retriever(similarity_top_k=k)
+
+        start_time = time.monotonic()
+        query_bundle = QueryBundle(query_str=query, embedding=query_embedding)
+        nodes = retriever.retrieve(query_bundle)
+        metrics.observe("retrieval_seconds", time.monotonic() - start_time)
+        return nodes
 
-        return vector_search_results
+    # The metadata filter restricting retrieval to the docs for the persona
+    def get_metadata_filter(self, persona: str) -> Dict[str, Any]:
+        return {
+            **self.config.retrieval_filters,
+            **self.config.persona_retrieval_filters.get(persona, {}),
+        }
+
+    # Get a response from the vector search, aka the relevant data
+    def find_relevant_docs(
+        self,
+        query: str,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None,
+        k: Optional[int] = None,
+        sources: Optional[SourceIndex] = None,
+    ) -> str:
+        nodes = self.retrieve(
+            query,
+            k=k,
+            metadata_filter=metadata_filter,
+            query_embedding=query_embedding,
+        )
+        return format_relevant_docs(nodes, sources)
+
+    # The number of documents to retrieve for a question, or 0 to skip retrieval
+    def retrieval_k(self, query: str, in_conversation: bool = False) -> int:
+        if NO_CONTEXT_TAG in query:
+            return 0
+        if not self.config.adaptive_retrieval:
+            return self.k
+
+        route = route_question(query, in_conversation)
+        metrics.inc("retrieval_routes_total", route=route.value)
+        if route == RetrievalRoute.Skip:
+            return 0
+        if route == RetrievalRoute.Small:
+            return self.config.retrieval_small_k
+        return self.config.retrieval_large_k
 
     # Get a response from the chatbot, excluding the responses from the vector search
     @abstractmethod
@@ -87,6 +192,7 @@ class Assistant(ABC):
         persona: str,
         user_context: str = "",
         include_context: bool = True,
+        conversation_id: Optional[str] = None,
     ) -> Tuple[str, str, str]:
         """
         :returns: Should return a tuple of
@@ -107,19 +213,27 @@ class AssistantBison(Assistant):
     ):
         # Choose the embeddings and LLM based on the llm_provider
         if config.llm_provider == LLMProvider.OpenAI:
-            embeddings = OpenAIEmbeddings(model=config.openai_embeddings_model)
-            llm = OpenAI(model=config.openai_textgen_model)
+            self.embeddings_model_name = config.openai_embeddings_model
+            embeddings = OpenAIEmbeddings(model=self.embeddings_model_name)
 
         elif config.llm_provider == LLMProvider.Google:
             init_gcp(config)
-            embeddings = VertexAIEmbeddings(model_name=config.google_embeddings_model)
-            llm = VertexAI(model_name=config.google_textgen_model)
+            self.embeddings_model_name = config.google_embeddings_model
+            embeddings = VertexAIEmbeddings(model_name=self.embeddings_model_name)
 
         else:
             raise AssertionError("LLM Provider must be one of openai or google")
 
+        llm = build_llm(config, config.llm_provider)
+        textgen_model = get_textgen_model(config, config.llm_provider)
+
         super().__init__(config, embeddings, k, llm)
 
+        # Generation goes through a pool of providers, which fails over and hedges
+        # to the fallback_llm_provider if configured. Embeddings stay with the
+        # primary provider, as they must match the vectors in the vector store.
+        self.provider_pool = ProviderPool.from_config(config, llm)
+
         self.parameters = {
             "temperature": temp,  # Temperature controls the degree of randomness in token selection.
             "max_tokens": max_tokens_response,  # Token limit determines the maximum amount of text output.
@@ -128,21 +242,172 @@ class AssistantBison(Assistant):
         self.company = company
         self.custom_rules = custom_rules or []
 
+        # Share one retrieval and generation between concurrent identical questions
+        self.single_flight = (
+            SingleFlight() if config.coalesce_identical_questions else None
+        )
+
+        # Keep a bounded, summarized chat history for each conversation
+        self.memory = None
+        if config.conversation_memory:
+            self.memory = ConversationMemoryStore(
+                token_budget=config.conversation_memory_token_budget,
+                max_conversations=config.conversation_memory_max_conversations,
+                idle_seconds=config.conversation_memory_idle_seconds,
+                summarizer=make_llm_summarizer(self.service_context.llm),
+                backend=(
+                    SqliteMemoryBackend(config.conversation_memory_path)
+                    if config.conversation_memory_path
+                    else None
+                ),
+                model=textgen_model,
+            )
+
+        # Accounts for the tokens and cost of each generation
+        self.usage_tracker = build_usage_tracker(config, textgen_model)
+
+        # Answer frequently asked questions from the reviewed answers in the FAQ index
+        self.faq_index = None
+        if config.faq_index_path:
+            self.faq_index = FaqIndex(
+                config.faq_index_path,
+                threshold=config.faq_similarity_threshold,
+                embeddings_model=self.embeddings_model_name,
+            )
+
     def get_response(
         self,
         user_input: str,
         persona: str,
         user_context: str = "",
         include_context: bool = True,
+        conversation_id: Optional[str] = None,
     ) -> Tuple[StreamingResponse, str, str]:
-        responses_from_vs = self.find_relevant_docs(query=user_input)
+        history = ConversationState()
+        if self.memory is not None and conversation_id is not None:
+            history = self.memory.get_history(conversation_id)
+
+        # FAQ answers stand alone, so only match questions that start a conversation
+        query_embedding = None
+        if (
+            self.faq_index is not None
+            and include_context
+            and not history.turns
+            and NO_CONTEXT_TAG not in user_input
+        ):
+            faq_match = self.faq_index.find(user_input, persona)
+            if faq_match is None:
+                query_embedding = self.embedding_model.get_query_embedding(user_input)
+                faq_match = self.faq_index.match(query_embedding, persona)
+            if faq_match is not None:
+                metrics.inc("faq_answers_total", persona=persona)
+                self.usage_tracker.record(persona, generated=False)
+                response_gen = iter([faq_match.entry.answer])
+                if self.memory is not None and conversation_id is not None:
+                    response_gen = self._remember(
+                        conversation_id, user_input, response_gen
+                    )
+                return StreamingResponse(response_gen), "", user_input
+
+        # Only coalesce when the prompt doesn't depend on a conversation's history
+        if self.single_flight is not None and not history.turns:
+
+            def generate():
+                bot_response, responses_from_vs, context = self._generate_response(
+                    user_input,
+                    persona,
+                    user_context,
+                    include_context,
+                    history,
+                    query_embedding,
+                )
+                return bot_response.response_gen, (responses_from_vs, context)
+
+            key = (canonical_question(user_input), persona, include_context)
+            response_gen, (responses_from_vs, context), shared = self.single_flight.do(
+                key, generate
+            )
+            # The usage of a shared generation is recorded by the request that made it
+            if shared:
+                self.usage_tracker.record(persona, generated=False)
+        else:
+            bot_response, responses_from_vs, context = self._generate_response(
+                user_input,
+                persona,
+                user_context,
+                include_context,
+                history,
+                query_embedding,
+            )
+            response_gen = bot_response.response_gen
+
+        if self.memory is not None and conversation_id is not None:
+            response_gen = self._remember(conversation_id, user_input, response_gen)
+
+        return StreamingResponse(response_gen), responses_from_vs, context
+
+    def _remember(
+        self, conversation_id: str, user_input: str, response_gen: Iterator[str]
+    ) -> Iterator[str]:
+        """Pass the response through, adding it to memory once it is complete"""
+        text_response = ""
+        for text in response_gen:
+            text_response += text
+            yield text
+
+        self.memory.add_turn(
+            conversation_id, user_input, without_sources(text_response)
+        )
+
+    def _track_usage(
+        self,
+        persona: str,
+        messages: List[ChatMessage],
+        responses_from_vs: str,
+        response_gen: Iterator[str],
+    ) -> Iterator[str]:
+        """Pass a generation through, recording its usage once it ends or is stopped"""
+        completion = ""
+        try:
+            for text in response_gen:
+                completion += text
+                yield text
+        finally:
+            self.usage_tracker.record(
+                persona,
+                "\n".join(message.content or "" for message in messages),
+                responses_from_vs,
+                completion,
+            )
+
+    def _generate_response(
+        self,
+        user_input: str,
+        persona: str,
+        user_context: str = "",
+        include_context: bool = True,
+        history: Optional[ConversationState] = None,
+        query_embedding: Optional[List[float]] = None,
+    ) -> Tuple[StreamingResponse, str, str]:
+        # Only search the vector store when the results will be used, for as many
+        # documents as the question needs
+        k = 0
+        if include_context:
+            k = self.retrieval_k(user_input, bool(history and history.turns))
+        responses_from_vs = ""
+        sources = SourceIndex()
+        if k > 0:
+            responses_from_vs = self.find_relevant_docs(
+                query=user_input,
+                metadata_filter=self.get_metadata_filter(persona),
+                query_embedding=query_embedding,
+                k=k,
+                sources=sources,
+            )
+
         # Ensure that we include the prompt context assuming the parameter is provided
         context = user_input
         if include_context:
-            # If we have a special tag, include no further context from the vector DB
-            if "[NO CONTEXT]" in user_input:
-                responses_from_vs = ""
-
             context = get_template(
                 persona,
                 responses_from_vs,
@@ -152,6 +417,17 @@ class AssistantBison(Assistant):
                 self.custom_rules,
             )
 
-        bot_response = self.chat_engine.stream_chat(context)
+        # Call the LLM directly with messages built for this request only, so
+        # concurrent requests share no chat engine state
+        messages = build_messages(context, history)
+        response_gen = self._track_usage(
+            persona,
+            messages,
+            responses_from_vs,
+            self.provider_pool.stream_tokens(messages),
+        )
+        if self.config.citations and sources:
+            response_gen = with_citations(response_gen, sources)
+        bot_response = StreamingResponse(response_gen)
 
         return bot_response, responses_from_vs, context
@@ -0,0 +1,92 @@
+"""
+Source citations for generated responses. Retrieved chunks are given to the LLM with a
+citation id, such as [1], instead of their URL, which is kept in the chunk's metadata
+along with the title and section of the page it is from. Chunks from the same source,
+a page or one of its sections, share an id, and once a response has been generated the
+sources it cited are listed after it, each once. The list is left out of the response
+kept in conversation memory, as the ids are only meaningful for that turn.
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Mapping, Set
+
+_CITATION = re.compile(r"\[(\d{1,3})\]")
+SOURCES_HEADING = "\n\nSources:\n"
+
+
+@dataclass(frozen=True)
+class Source:
+    url: str
+    title: str = ""
+    section: str = ""
+
+    @property
+    def label(self) -> str:
+        """A short name for the source, from its title and section where known"""
+        parts = [part for part in (self.title, self.section) if part]
+        return " - ".join(parts) or self.url
+
+
+class SourceIndex:
+    """The distinct sources of the chunks given to the LLM, numbered as added"""
+
+    def __init__(self):
+        self.sources: List[Source] = []
+        self._ids: Dict[Source, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def add(self, metadata: Mapping[str, Any]) -> int:
+        """The citation id of the source of a chunk, or 0 if it has none"""
+        if not metadata.get("source"):
+            return 0
+        source = Source(
+            url=metadata["source"],
+            title=metadata.get("title") or "",
+            section=metadata.get("section") or "",
+        )
+        if source not in self._ids:
+            self.sources.append(source)
+            self._ids[source] = len(self.sources)
+        return self._ids[source]
+
+    def cited_ids(self, text: str) -> List[int]:
+        """The ids of the sources cited in text, in the order first cited"""
+        cited: List[int] = []
+        seen: Set[int] = set()
+        for match in _CITATION.finditer(text):
+            citation_id = int(match.group(1))
+            if 0 < citation_id <= len(self.sources) and citation_id not in seen:
+                seen.add(citation_id)
+                cited.append(citation_id)
+        return cited
+
+    def render(self, text: str) -> str:
+        """A markdown list of the sources cited in text, or "" if none were"""
+        lines = [
+            f"[{citation_id}] [{self.sources[citation_id - 1].label}]"
+            f"({self.sources[citation_id - 1].url})"
+            for citation_id in self.cited_ids(text)
+        ]
+        if not lines:
+            return ""
+        return SOURCES_HEADING + "\n".join(lines)
+
+
+def with_citations(tokens: Iterator[str], sources: SourceIndex) -> Iterator[str]:
+    """Pass a response's tokens through, followed by the sources it cited"""
+    text = []
+    for token in tokens:
+        text.append(token)
+        yield token
+
+    citations = sources.render("".join(text))
+    if citations:
+        yield citations
+
+
+def without_sources(text: str) -> str:
+    """A response without the sources listed after it by with_citations"""
+    response, heading, _ = text.rpartition(SOURCES_HEADING)
+    return response if heading else text
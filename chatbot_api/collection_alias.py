@@ -0,0 +1,152 @@
+"""
+Versioned vector stores, for re-indexing without downtime. Each re-index is ingested
+into a new version of the vector store, a new Astra DB collection or local folder,
+while the serving alias still points at the previous version. Once the new version
+has been validated the alias is switched to it in a single write, and assistants
+watching the alias start retrieving from it. Old versions are then dropped, keeping
+the newest few to roll back to.
+"""
+import json
+import os
+import shutil
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from chatbot_api.vector_store import (
+    VERSIONS_DIR,
+    versioned_collection_name,
+    versioned_path,
+)
+from pipeline.config import Config, VectorStoreBackend
+
+ALIAS_FILE = "alias.json"
+
+
+def new_version() -> str:
+    """A name for a new version, which sorts after those created before it"""
+    return time.strftime("v%Y%m%d%H%M%S", time.gmtime())
+
+
+class CollectionAlias(ABC):
+    """The version of the vector store being served, and the versions that exist"""
+
+    @abstractmethod
+    def get(self) -> Optional[str]:
+        """The version being served, or None for the unversioned vector store"""
+
+    @abstractmethod
+    def set(self, version: str) -> None:
+        """Serve a version from now on"""
+
+    @abstractmethod
+    def versions(self) -> List[str]:
+        """All existing versions, oldest first"""
+
+    @abstractmethod
+    def drop(self, version: str) -> None:
+        """Delete a version and all its documents"""
+
+
+class LocalCollectionAlias(CollectionAlias):
+    """Versions of the local vector store, in folders next to a small alias file"""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.path = config.local_vector_store_path
+
+    def get(self) -> Optional[str]:
+        alias_path = os.path.join(self.path, ALIAS_FILE)
+        if not os.path.exists(alias_path):
+            return None
+        with open(alias_path) as f:
+            return json.load(f)["version"]
+
+    def set(self, version: str) -> None:
+        # Write then rename, so readers never see a partial alias
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = os.path.join(self.path, ALIAS_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": version, "updated_at": time.time()}, f)
+        os.replace(tmp_path, os.path.join(self.path, ALIAS_FILE))
+
+    def versions(self) -> List[str]:
+        versions_path = os.path.join(self.path, VERSIONS_DIR)
+        if not os.path.isdir(versions_path):
+            return []
+        return sorted(os.listdir(versions_path))
+
+    def drop(self, version: str) -> None:
+        shutil.rmtree(versioned_path(self.config, version), ignore_errors=True)
+
+
+class AstraCollectionAlias(CollectionAlias):
+    """
+    Versions of the vector store in Astra DB collections named after the configured
+    one, with the alias kept in a document of a small collection of its own
+    """
+
+    def __init__(self, config: Config):
+        from astrapy.db import AstraDB
+
+        self.config = config
+        self.prefix = versioned_collection_name(config, "")
+        self._astra_db = AstraDB(
+            token=config.astra_db_application_token,
+            api_endpoint=config.astra_db_api_endpoint,
+        )
+        self._aliases = self._astra_db.create_collection(
+            collection_name=f"{config.astra_db_table_name}_alias"
+        )
+
+    def get(self) -> Optional[str]:
+        response = self._aliases.find_one(
+            filter={"_id": self.config.astra_db_table_name}
+        )
+        document = response["data"]["document"]
+        return document["version"] if document else None
+
+    def set(self, version: str) -> None:
+        self._aliases.upsert(
+            {
+                "_id": self.config.astra_db_table_name,
+                "version": version,
+                "updated_at": time.time(),
+            }
+        )
+
+    def versions(self) -> List[str]:
+        collections = self._astra_db.get_collections()["status"]["collections"]
+        return sorted(
+            name[len(self.prefix) :]
+            for name in collections
+            if name.startswith(self.prefix + "v")
+        )
+
+    def drop(self, version: str) -> None:
+        self._astra_db.delete_collection(
+            versioned_collection_name(self.config, version)
+        )
+
+
+def build_collection_alias(config: Config) -> CollectionAlias:
+    if config.vector_store == VectorStoreBackend.Local:
+        return LocalCollectionAlias(config)
+    return AstraCollectionAlias(config)
+
+
+def collect_old_versions(alias: CollectionAlias, keep: int) -> List[str]:
+    """
+    Drop all but the newest `keep` versions, never dropping the version being served
+
+    :returns: The versions dropped
+    """
+    serving = alias.get()
+    versions = alias.versions()
+    old_versions = versions[: max(len(versions) - keep, 0)]
+    dropped = []
+    for version in old_versions:
+        if version != serving:
+            alias.drop(version)
+            dropped.append(version)
+    return dropped
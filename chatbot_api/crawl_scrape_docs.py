@@ -1,4 +1,7 @@
+import hashlib
+import json
 import os
+import re
 
 import concurrent
 from urllib.parse import urlparse, urljoin
@@ -6,6 +9,11 @@ import requests
 from bs4 import BeautifulSoup
 import tqdm
 from concurrent.futures import ThreadPoolExecutor
+from llama_index import Document
+
+# Marks where each section of a page starts, so its text can be split on them
+SECTION_MARKER = "\x00SECTION\x00"
+SECTION_HEADINGS = ["h1", "h2", "h3"]
 
 
 def is_valid(url):
@@ -19,12 +27,16 @@ def is_valid(url):
 
 def get_all_website_links(url):
     # returns all URLs that is found on `url` in which it belongs to the same website
-    urls = set()
-    domain_name = urlparse(url).netloc
     response = requests.get(url)
     response.encoding = response.apparent_encoding  # Use chardet to guess the encoding
     soup = BeautifulSoup(response.text, "html.parser")
+    return page_links(url, soup)
 
+
+def page_links(url, soup):
+    # returns all URLs linked from the page `soup` at `url` on the same website
+    urls = set()
+    domain_name = urlparse(url).netloc
     for a_tag in soup.findAll("a"):
         href = a_tag.attrs.get("href")
         if href == "" or href is None:
@@ -60,37 +72,114 @@ def clean_html(soup):
     return soup
 
 
-def fetch_url(url):
+def page_title(soup):
+    # the title of a page, from its <title> or else its first <h1>
+    title = soup.find("title") or soup.find("h1")
+    return title.get_text(" ", strip=True) if title is not None else ""
+
+
+def split_sections(url, title, body):
+    # returns a record of each section of `body`, starting at each h1-h3 heading
+    headings = [(None, None)]
+    for heading in body.find_all(SECTION_HEADINGS):
+        headings.append((heading.get_text(" ", strip=True), heading.get("id")))
+        heading.insert_before(SECTION_MARKER)
+
+    records = []
+    for (section, anchor), text in zip(headings, body.get_text().split(SECTION_MARKER)):
+        if not text.strip():
+            continue
+        records.append(
+            {
+                "url": f"{url}#{anchor}" if anchor else url,
+                "title": title,
+                "section": section or "",
+                "text": text.strip(),
+            }
+        )
+    return records
+
+
+def fetch_page(url):
+    # returns the section records of the page at `url`, and the links on it
     response = requests.get(url)
     response.encoding = response.apparent_encoding  # Use chardet to guess the encoding
     soup = BeautifulSoup(response.text, "html.parser")
 
+    links = page_links(url, soup)
+    title = page_title(soup)
     body = soup.find("main")
     if body is not None:
         body = clean_html(body)
-
-    return "Following page's URL link: ~~" + str(url) + "~~\n" + body.get_text()
-
-
-def crawl_website_parallel(url, output_file: str, recursive: bool=False):
-    if recursive:
-        urls = get_all_website_links(url)
     else:
-        urls = [url]
+        body = clean_html(soup)
 
-    raw_texts = []
+    return split_sections(str(url), title, body), links
 
-    # Use ThreadPoolExecutor to parallelize the fetch_url function
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(fetch_url, url) for url in urls}
 
-    for future in tqdm.tqdm(concurrent.futures.as_completed(futures), total=len(urls)):
-        try:
-            data = future.result()
-        except Exception as _:
-            pass
-        else:
-            raw_texts.append(data)
+def fetch_url(url):
+    return fetch_page(url)[0]
+
+
+def record_document(record):
+    # returns a Document of a section record, with its source as metadata
+    return Document(
+        text=record["text"],
+        metadata={
+            "source": record["url"],
+            "title": record.get("title", ""),
+            "section": record.get("section", ""),
+        },
+        # The title and section help to match a chunk, but the LLM is given a
+        # citation id in place of all three
+        excluded_embed_metadata_keys=["source"],
+        excluded_llm_metadata_keys=["source", "title", "section"],
+    )
+
+
+def load_page_records(path):
+    # returns a Document for each section record in the JSON lines file at `path`
+    with open(path, encoding="utf-8") as f_in:
+        return [record_document(json.loads(line)) for line in f_in if line.strip()]
+
+
+def output_file_name(url):
+    # returns a file name for the records of `url`, from its host and path, and a
+    # hash of the whole URL so that no two URLs share one
+    parsed_url = urlparse(url)
+    name = re.sub(r"[^A-Za-z0-9.-]+", "_", parsed_url.netloc + parsed_url.path)
+    digest = hashlib.sha1(url.encode()).hexdigest()[:8]
+    return f"{name.strip('_')}-{digest}.jsonl"
+
+
+def crawl_website_parallel(
+    url, output_file: str, recursive: bool = False, depth=None, max_workers=10
+):
+    # crawls `url` and the pages linked from it, up to `depth` links away (1 if
+    # `recursive`), writing a JSON line of each section of each page to output_file
+    if depth is None:
+        depth = 1 if recursive else 0
+
+    records = []
+    seen = {url}
+    level = [url]
+
+    # Use ThreadPoolExecutor to parallelize the fetch_page function
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for current_depth in range(depth + 1):
+            futures = {executor.submit(fetch_page, url) for url in level}
+            level = []
+            for future in tqdm.tqdm(
+                concurrent.futures.as_completed(futures), total=len(futures)
+            ):
+                try:
+                    data, links = future.result()
+                except Exception as _:
+                    continue
+                records.extend(data)
+                if current_depth < depth:
+                    level.extend(links - seen)
+                    seen.update(links)
 
     # Make directories for file if necessary
     if "/" in output_file:
@@ -99,7 +188,7 @@ def crawl_website_parallel(url, output_file: str, recursive: bool=False):
             exist_ok=True,
         )
 
-    # After all the threads are done, write all the data to the file
+    # After all the threads are done, write a JSON line of each section to the file
     with open(output_file, "w", encoding="utf-8") as f_out:
-        for text in raw_texts:
-            f_out.write(text)
+        for record in records:
+            f_out.write(json.dumps(record) + "\n")
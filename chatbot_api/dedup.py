@@ -0,0 +1,178 @@
+"""
+Near-duplicate detection of chunks at ingestion, so that boilerplate repeated across
+pages, such as admonitions and shared snippets, is embedded and stored once.
+
+Each chunk's word shingles are summarized by a MinHash signature, whose agreement with
+another chunk's estimates the Jaccard similarity of their shingles. Signatures are
+split into bands, and only chunks sharing a band are compared, so finding duplicates
+takes about linear time. A chunk at least `threshold` similar to one already kept is
+dropped, and the sources of both are kept in the metadata of the one kept.
+"""
+import hashlib
+import json
+import re
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+from llama_index.schema import BaseNode
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+NUM_BANDS = 16
+# A prime just above 2**32, so that hashes are permuted without overflowing uint64
+PRIME = (1 << 32) + 15
+
+_WORD = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """The 32 bit hashes of the distinct word shingles of text"""
+    words = _WORD.findall(text.lower())
+    shingles = {
+        " ".join(words[i : i + SHINGLE_WORDS])
+        for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))
+    }
+    return np.array(
+        [
+            int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "big")
+            for s in shingles
+        ],
+        dtype=np.uint64,
+    )
+
+
+class MinHasher:
+    """Computes MinHash signatures with `num_perm` random hash permutations"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingle_hashes(text)
+        permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % PRIME
+        return permuted.min(axis=1)
+
+
+class MinHashIndex:
+    """
+    Finds the signatures added under a key that are at least `threshold` similar to
+    a signature, comparing only those sharing one of `num_bands` bands with it
+    """
+
+    def __init__(self, threshold: float = 0.9, num_bands: int = NUM_BANDS):
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self._buckets: Dict[Tuple[int, bytes], List[Hashable]] = {}
+        self._signatures: Dict[Hashable, np.ndarray] = {}
+        # The order signatures were added in, to prefer the earliest match
+        self._order: Dict[Hashable, int] = {}
+        self._added = 0
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _bands(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        rows = len(signature) // self.num_bands
+        return [
+            (band, signature[band * rows : (band + 1) * rows].tobytes())
+            for band in range(self.num_bands)
+        ]
+
+    def find(self, signature: np.ndarray) -> Optional[Hashable]:
+        """The key of the earliest added signature similar enough, if any"""
+        candidates: Set[Hashable] = set()
+        for band in self._bands(signature):
+            candidates.update(self._buckets.get(band, []))
+        for key in sorted(candidates, key=self._order.__getitem__):
+            if np.mean(self._signatures[key] == signature) >= self.threshold:
+                return key
+        return None
+
+    def add(self, key: Hashable, signature: np.ndarray) -> None:
+        self._signatures[key] = signature
+        self._order[key] = self._added
+        self._added += 1
+        for band in self._bands(signature):
+            self._buckets.setdefault(band, []).append(key)
+
+    def remove(self, key: Hashable) -> None:
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        del self._order[key]
+        for band in self._bands(signature):
+            self._buckets[band].remove(key)
+            if not self._buckets[band]:
+                del self._buckets[band]
+
+
+def node_sources(node: BaseNode) -> List[str]:
+    """The distinct sources of a node and of the duplicates dropped in its place"""
+    # Kept as a JSON string, as vector stores such as Astra DB only accept flat
+    # metadata values
+    return json.loads(node.metadata.get("sources") or "[]")
+
+
+class ChunkDeduplicator:
+    """
+    Keeps the nodes whose text isn't a near-duplicate of a node kept before. The
+    "sources" metadata of each node kept lists the distinct sources of it and its
+    duplicates, see node_sources.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = NUM_PERM,
+        num_bands: int = NUM_BANDS,
+    ):
+        self.threshold = threshold
+        self._hasher = MinHasher(num_perm)
+        self._index = MinHashIndex(threshold, num_bands)
+        self._kept: List[BaseNode] = []
+
+    def add(self, node: BaseNode) -> bool:
+        """Whether to keep node, rather than drop it as a duplicate"""
+        signature = self._hasher.signature(node.get_content())
+        duplicate_of = self._index.find(signature)
+        if duplicate_of is not None:
+            _add_sources(self._kept[duplicate_of], node)
+            return False
+
+        self._index.add(len(self._kept), signature)
+        self._kept.append(node)
+        _add_sources(node, node)
+        return True
+
+
+def dedup_nodes(nodes: List[BaseNode], threshold: float = 0.9) -> List[BaseNode]:
+    """Drop the nodes whose text is a near-duplicate of an earlier node's"""
+    deduplicator = ChunkDeduplicator(threshold)
+    return [node for node in nodes if deduplicator.add(node)]
+
+
+def _add_sources(kept: BaseNode, node: BaseNode) -> None:
+    """Record the source of node in the provenance of the node kept in its place"""
+    sources = node_sources(kept)
+    source = node.metadata.get("source")
+    if source and source not in sources:
+        sources.append(source)
+    set_node_sources(kept, sources)
+
+
+def set_node_sources(node: BaseNode, sources: List[str]) -> None:
+    """Set the sources of a node and of its duplicates, see node_sources"""
+    # Nodes chunked from the same document can share their metadata, so it is
+    # replaced rather than updated in place
+    node.metadata = {**node.metadata, "sources": json.dumps(sources)}
+
+    # Provenance isn't part of the text to embed or to give to the LLM
+    if "sources" not in node.excluded_embed_metadata_keys:
+        node.excluded_embed_metadata_keys = [
+            *node.excluded_embed_metadata_keys,
+            "sources",
+        ]
+    if "sources" not in node.excluded_llm_metadata_keys:
+        node.excluded_llm_metadata_keys = [*node.excluded_llm_metadata_keys, "sources"]
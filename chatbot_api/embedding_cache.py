@@ -0,0 +1,80 @@
+import hashlib
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a cache persisted to a .npz file, keyed on a hash of
+    the model name and text. Without an underlying model, only cached texts can be
+    embedded, which allows running fully offline.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embeddings: Optional[Embeddings] = None,
+        model_name: str = "",
+    ):
+        self.path = path
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._dirty = False
+        if os.path.exists(path):
+            data = np.load(path)
+            self._vectors = dict(zip(data["keys"].tolist(), data["vectors"]))
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            missing = {
+                key: text for key, text in zip(keys, texts) if key not in self._vectors
+            }
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            if self.embeddings is None:
+                raise KeyError(
+                    f"{len(missing)} texts are not in the embedding cache {self.path}"
+                )
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            with self._lock:
+                for key, vector in zip(missing, vectors):
+                    self._vectors[key] = np.asarray(vector, dtype=np.float32)
+                self._dirty = True
+
+        return [self._vectors[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def save(self) -> None:
+        """Persist any newly cached embeddings"""
+        with self._lock:
+            if not self._dirty:
+                return
+            keys = list(self._vectors)
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            np.savez(
+                self.path,
+                keys=np.array(keys),
+                vectors=np.stack([self._vectors[key] for key in keys]),
+            )
+            self._dirty = False
@@ -0,0 +1,205 @@
+"""
+A precomputed index of reviewed answers to frequently asked questions. Questions close
+enough to an FAQ by embedding similarity are answered with the stored answer, without
+retrieval or generation. The index is built offline with data/build_faq_index.py, and
+rebuilt indexes are picked up without a restart.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+from llama_index.embeddings.base import BaseEmbedding
+
+from chatbot_api.normalize import canonical_question
+
+FAQ_ENTRIES_FILE = "entries.json"
+FAQ_VECTORS_FILE = "vectors.npy"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FaqEntry:
+    """A question with its reviewed answer"""
+
+    question: str
+    answer: str
+    # Other phrasings of the question, which are matched too
+    alternates: List[str] = field(default_factory=list)
+    # The personas the answer is for, or empty for every persona
+    personas: List[str] = field(default_factory=list)
+
+    def matches_persona(self, persona: str) -> bool:
+        return not self.personas or persona in self.personas
+
+
+@dataclass
+class FaqMatch:
+    entry: FaqEntry
+    question: str  # The question or alternate phrasing that matched
+    similarity: float
+
+
+@dataclass
+class _LoadedIndex:
+    entries: List[FaqEntry] = field(default_factory=list)
+    # Every phrasing of the entries' questions, with the entry of each in rows
+    questions: List[str] = field(default_factory=list)
+    rows: List[int] = field(default_factory=list)
+    vectors: np.ndarray = field(
+        default_factory=lambda: np.zeros((0, 0), dtype=np.float32)
+    )
+    # The phrasings of each canonical question
+    canonical: Dict[str, List[int]] = field(default_factory=dict)
+
+
+def save_faq_index(
+    path: str,
+    entries: List[FaqEntry],
+    embed_model: BaseEmbedding,
+    embeddings_model: str,
+) -> None:
+    """Embed every phrasing of the entries' questions, and write the index to path"""
+    questions, rows = [], []
+    for i, entry in enumerate(entries):
+        for question in [entry.question] + entry.alternates:
+            questions.append(question)
+            rows.append(i)
+
+    # An index without entries is still written, so that it replaces a previous one
+    vectors = np.zeros((0, 0), dtype=np.float32)
+    if questions:
+        vectors = np.array(
+            embed_model.get_text_embedding_batch(questions), dtype=np.float32
+        ).reshape(len(questions), -1)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    # Replace the files rather than overwriting them, and write the entries last, as
+    # their modification time is what triggers a reload
+    os.makedirs(path, exist_ok=True)
+    vectors_path = os.path.join(path, FAQ_VECTORS_FILE)
+    with open(vectors_path + ".tmp", "wb") as f:
+        np.save(f, vectors)
+    os.replace(vectors_path + ".tmp", vectors_path)
+
+    entries_path = os.path.join(path, FAQ_ENTRIES_FILE)
+    with open(entries_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "embeddings_model": embeddings_model,
+                "entries": [asdict(entry) for entry in entries],
+                "questions": questions,
+                "rows": rows,
+            },
+            f,
+            indent=2,
+        )
+    os.replace(entries_path + ".tmp", entries_path)
+
+
+class FaqIndex:
+    """
+    Matches questions to the FAQ index in `path`, reloading it when it is rebuilt,
+    checking at most every `reload_interval` seconds. Only questions with a cosine
+    similarity of at least `threshold` to a phrasing of an FAQ are matched.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        threshold: float = 0.92,
+        embeddings_model: str = "",
+        reload_interval: float = 5.0,
+    ):
+        self.path = path
+        self.threshold = threshold
+        self.embeddings_model = embeddings_model
+        self.reload_interval = reload_interval
+
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._index = _LoadedIndex()
+        self.reload()
+
+    def __len__(self) -> int:
+        return len(self._index.entries)
+
+    def reload(self) -> None:
+        """Load the index if it was rebuilt since the last load"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            entries_path = os.path.join(self.path, FAQ_ENTRIES_FILE)
+            mtime = None
+            if os.path.exists(entries_path):
+                mtime = os.path.getmtime(entries_path)
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+
+            index = _LoadedIndex()
+            if mtime is not None:
+                try:
+                    with open(entries_path, encoding="utf-8") as f:
+                        data = json.load(f)
+                    if data["embeddings_model"] != self.embeddings_model:
+                        raise ValueError(
+                            f"it was built with {data['embeddings_model']}, but the "
+                            f"embeddings model is {self.embeddings_model}"
+                        )
+                    index = _LoadedIndex(
+                        entries=[FaqEntry(**entry) for entry in data["entries"]],
+                        questions=data["questions"],
+                        rows=data["rows"],
+                        vectors=np.load(os.path.join(self.path, FAQ_VECTORS_FILE)),
+                    )
+                except Exception as e:
+                    logger.error(f"Unable to load the FAQ index {self.path}: {e}")
+                    return
+
+            for i, question in enumerate(index.questions):
+                index.canonical.setdefault(canonical_question(question), []).append(i)
+
+            # Swap in the new index atomically for readers
+            self._index = index
+            logger.info(f"Loaded {len(index.entries)} FAQs from {self.path}")
+
+    def find(self, question: str, persona: str) -> Optional[FaqMatch]:
+        """The FAQ for persona with the same canonical question, without embedding"""
+        if time.monotonic() - self._last_check > self.reload_interval:
+            self.reload()
+
+        index = self._index
+        for i in index.canonical.get(canonical_question(question), []):
+            entry = index.entries[index.rows[i]]
+            if entry.matches_persona(persona):
+                return FaqMatch(entry, index.questions[i], 1.0)
+        return None
+
+    def match(self, query_embedding: List[float], persona: str) -> Optional[FaqMatch]:
+        """The FAQ for persona most similar to the query, if similar enough"""
+        if time.monotonic() - self._last_check > self.reload_interval:
+            self.reload()
+
+        index = self._index
+        if not index.entries:
+            return None
+
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector /= max(np.linalg.norm(query_vector), 1e-12)
+        similarities = index.vectors @ query_vector
+
+        # Check phrasings from most to least similar, until below the threshold
+        for i in np.argsort(-similarities):
+            if similarities[i] < self.threshold:
+                break
+            entry = index.entries[index.rows[i]]
+            if entry.matches_persona(persona):
+                return FaqMatch(entry, index.questions[i], float(similarities[i]))
+
+        return None
@@ -0,0 +1,37 @@
+"""
+Stateless text generation. The messages for each request are built from scratch and
+streamed straight from the LLM, so no state is shared between concurrent requests.
+"""
+from typing import Iterator, List, Optional
+
+from llama_index.llms import LLM, ChatMessage, MessageRole
+
+from chatbot_api.memory import ConversationState
+
+
+def build_messages(
+    prompt: str, history: Optional[ConversationState] = None
+) -> List[ChatMessage]:
+    """Build the chat messages for a prompt, preceded by any conversation history"""
+    messages = []
+    if history is not None:
+        if history.summary:
+            messages.append(
+                ChatMessage(
+                    role=MessageRole.SYSTEM,
+                    content=f"Summary of the conversation so far: {history.summary}",
+                )
+            )
+        for turn in history.turns:
+            role = MessageRole.USER if turn.role == "user" else MessageRole.ASSISTANT
+            messages.append(ChatMessage(role=role, content=turn.content))
+
+    messages.append(ChatMessage(role=MessageRole.USER, content=prompt))
+    return messages
+
+
+def stream_chat_tokens(llm: LLM, messages: List[ChatMessage]) -> Iterator[str]:
+    """Stream the text deltas of a chat completion"""
+    for chunk in llm.stream_chat(messages):
+        if chunk.delta:
+            yield chunk.delta
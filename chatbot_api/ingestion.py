@@ -0,0 +1,501 @@
+"""
+Ingestion of docs sites straight into the vector store, as one streaming pipeline.
+Sites are crawled in parallel, each to its own depth with its own number of concurrent
+fetches. Fetched pages flow through a bounded queue to be chunked, deduplicated (see
+chatbot_api/dedup.py), embedded and upserted in batches, so a large crawl is never
+held in memory or written out first.
+
+Progress is checkpointed to sqlite: each page discovered, and each page whose chunks
+have been upserted, with a hash of its content and the ids of its chunks. A crashed run
+resumes from the pages not yet done, and a page is only fetched again once its site's
+refresh interval has passed, and only re-embedded if its content has changed.
+
+A chunk near-duplicating one already stored, by any page, isn't stored again. Instead
+its page claims the stored chunk, whose "sources" metadata is updated to list the
+sources of every page claiming it. The checkpoint records the MinHash signature of each
+stored chunk and the pages claiming it, and a chunk is only deleted once no page claims
+it anymore.
+"""
+import hashlib
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain.embeddings import OpenAIEmbeddings, VertexAIEmbeddings
+from llama_index.embeddings import LangchainEmbedding
+from llama_index.node_parser import NodeParser
+from llama_index.schema import BaseNode, MetadataMode
+from llama_index.vector_stores.types import VectorStore
+
+from chatbot_api.crawl_scrape_docs import fetch_page, record_document
+from chatbot_api.dedup import MinHasher, MinHashIndex, set_node_sources
+from integrations.google import init_gcp
+from pipeline.config import Config, DocSite, LLMProvider
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+UPSERTING = "upserting"
+DONE = "done"
+
+
+def get_embedding_model(config: Config):
+    """The configured embeddings model and its name, as used by the assistant"""
+    if config.llm_provider == LLMProvider.OpenAI:
+        model_name = config.openai_embeddings_model
+        return LangchainEmbedding(OpenAIEmbeddings(model=model_name)), model_name
+
+    init_gcp(config)
+    model_name = config.google_embeddings_model
+    return LangchainEmbedding(VertexAIEmbeddings(model_name=model_name)), model_name
+
+
+def get_doc_sites(config: Config) -> List[DocSite]:
+    """The sites in doc_sites, and each page in doc_pages as a site of its own"""
+    return config.doc_sites + [DocSite(url=url) for url in config.doc_pages]
+
+
+@dataclass
+class PageState:
+    status: str
+    content_hash: Optional[str]
+    node_ids: List[str]
+
+
+class IngestCheckpoint:
+    """The ingestion progress of each page discovered, in a local sqlite database"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "url TEXT PRIMARY KEY, site TEXT, depth INTEGER, status TEXT, "
+                "content_hash TEXT, node_ids TEXT, updated_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS pages_site ON pages (site)")
+            # The chunks in the vector store, and the pages and sources claiming them
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (node_id TEXT PRIMARY KEY, "
+                "signature BLOB)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_sources (node_id TEXT, url TEXT, "
+                "source TEXT)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS chunk_sources_node ON chunk_sources "
+                "(node_id)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS chunk_sources_url ON chunk_sources (url)"
+            )
+
+    def discover(self, site: str, url: str, depth: int) -> bool:
+        """Record a page to ingest, returning whether it is new"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO pages VALUES (?, ?, ?, ?, NULL, '[]', 0)",
+                (url, site, depth, PENDING),
+            )
+            return cursor.rowcount == 1
+
+    def due(self, site: str, refresh_seconds: Optional[float]) -> List[Tuple[str, int]]:
+        """The pages of a site not yet done, or done longer than refresh_seconds ago"""
+        if refresh_seconds is None:
+            refreshed_before = float("-inf")
+        else:
+            refreshed_before = time.time() - refresh_seconds
+        with self._lock:
+            return self._conn.execute(
+                "SELECT url, depth FROM pages WHERE site = ? "
+                "AND (status != ? OR updated_at <= ?) ORDER BY depth",
+                (site, DONE, refreshed_before),
+            ).fetchall()
+
+    def get(self, url: str) -> Optional[PageState]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, content_hash, node_ids FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        return PageState(
+            status=row[0], content_hash=row[1], node_ids=json.loads(row[2])
+        )
+
+    def _update(self, url: str, status: str, **values: Any) -> None:
+        assignments = "".join(f", {column} = ?" for column in values)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE pages SET status = ?, updated_at = ?{assignments} "
+                "WHERE url = ?",
+                (status, time.time(), *values.values(), url),
+            )
+
+    def start_upsert(self, url: str, node_ids: List[str]) -> None:
+        """Record the chunks of a page before upserting them, to clean up on resume"""
+        self._update(url, UPSERTING, node_ids=json.dumps(node_ids))
+
+    def finish(
+        self, url: str, content_hash: str, node_ids: Optional[List[str]] = None
+    ) -> None:
+        """Record that a page is done, until it is next due for a refresh"""
+        if node_ids is None:
+            self._update(url, DONE, content_hash=content_hash)
+        else:
+            self._update(
+                url, DONE, content_hash=content_hash, node_ids=json.dumps(node_ids)
+            )
+
+    def chunks(self) -> List[Tuple[str, Optional[bytes]]]:
+        """The id and MinHash signature, if computed, of each stored chunk"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT node_id, signature FROM chunks"
+            ).fetchall()
+
+    def claim(
+        self,
+        url: str,
+        new_chunks: List[Tuple[str, Optional[bytes]]],
+        claims: List[Tuple[str, str]],
+    ) -> None:
+        """
+        Record the new chunks stored for a page, and replace the chunks it claims
+
+        :param claims: The id and source of each chunk of the page
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?)", new_chunks
+            )
+            self._conn.execute("DELETE FROM chunk_sources WHERE url = ?", (url,))
+            self._conn.executemany(
+                "INSERT INTO chunk_sources VALUES (?, ?, ?)",
+                [(node_id, url, source) for node_id, source in claims],
+            )
+
+    def release(self, url: str) -> List[str]:
+        """Drop all the claims of a page, returning the ids of the chunks it claimed"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT DISTINCT node_id FROM chunk_sources WHERE url = ?", (url,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM chunk_sources WHERE url = ?", (url,))
+        return [row[0] for row in rows]
+
+    def unclaimed(self, node_ids: List[str]) -> List[str]:
+        """The chunks of node_ids that no page claims, forgetting them"""
+        unclaimed = []
+        with self._lock, self._conn:
+            for node_id in node_ids:
+                claimed = self._conn.execute(
+                    "SELECT 1 FROM chunk_sources WHERE node_id = ? LIMIT 1", (node_id,)
+                ).fetchone()
+                if claimed is None:
+                    unclaimed.append(node_id)
+                    self._conn.execute(
+                        "DELETE FROM chunks WHERE node_id = ?", (node_id,)
+                    )
+        return unclaimed
+
+    def sources(self, node_ids: List[str]) -> Dict[str, List[str]]:
+        """The distinct sources of the pages claiming each chunk, in claim order"""
+        sources: Dict[str, List[str]] = {}
+        with self._lock:
+            for node_id in node_ids:
+                rows = self._conn.execute(
+                    "SELECT source FROM chunk_sources WHERE node_id = ? ORDER BY rowid",
+                    (node_id,),
+                ).fetchall()
+                sources[node_id] = list(dict.fromkeys(row[0] for row in rows))
+        return sources
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+@dataclass
+class IngestStats:
+    pages_fetched: int = 0
+    pages_unchanged: int = 0
+    chunks: int = 0
+    duplicate_chunks: int = 0
+    failed_urls: List[str] = field(default_factory=list)
+
+
+class IngestPipeline:
+    """Crawls sites into a vector store, see the module docstring"""
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        embed_model: LangchainEmbedding,
+        node_parser: NodeParser,
+        checkpoint: IngestCheckpoint,
+        site_concurrency: int = 4,
+        batch_size: int = 64,
+        dedup_threshold: Optional[float] = 0.9,
+        queue_size: int = 100,
+    ):
+        self.vector_store = vector_store
+        self.embed_model = embed_model
+        self.node_parser = node_parser
+        self.checkpoint = checkpoint
+        self.site_concurrency = site_concurrency
+        self.batch_size = batch_size
+        self.dedup_threshold = dedup_threshold
+        self.queue_size = queue_size
+        self._hasher = MinHasher()
+        self._index: Optional[MinHashIndex] = None
+
+    def _load_index(self) -> None:
+        """Index the signatures of the stored chunks, to find duplicates of them"""
+        if self.dedup_threshold is None:
+            return
+        self._index = MinHashIndex(self.dedup_threshold)
+        for node_id, signature in self.checkpoint.chunks():
+            if signature is not None:
+                self._index.add(node_id, np.frombuffer(signature, dtype=np.uint64))
+
+    def run(self, sites: List[DocSite]) -> IngestStats:
+        """Ingest the pages of each site that are due, as one pass over the sites"""
+        stats = IngestStats()
+        pages: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        # Reloaded from the checkpoint, in case a previous run failed mid-batch
+        self._load_index()
+        stopped = threading.Event()
+
+        def crawl_sites() -> None:
+            try:
+                with ThreadPoolExecutor(max_workers=self.site_concurrency) as executor:
+                    futures = {
+                        executor.submit(
+                            self._crawl_site, site, pages, stopped, stats
+                        ): site
+                        for site in sites
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception as e:
+                            logger.error(f"Unable to crawl {futures[future].url}: {e}")
+            finally:
+                pages.put(None)
+
+        crawler = threading.Thread(target=crawl_sites, daemon=True)
+        crawler.start()
+        try:
+            self._ingest(pages, stats)
+        finally:
+            # Unblock the crawlers if ingestion failed
+            stopped.set()
+        crawler.join()
+        return stats
+
+    def _crawl_site(
+        self,
+        site: DocSite,
+        pages: "queue.Queue",
+        stopped: threading.Event,
+        stats: IngestStats,
+    ) -> None:
+        refresh_seconds = None
+        if site.refresh_hours is not None:
+            refresh_seconds = site.refresh_hours * 3600
+
+        self.checkpoint.discover(site.url, site.url, 0)
+        level = self.checkpoint.due(site.url, refresh_seconds)
+        with ThreadPoolExecutor(max_workers=site.concurrency) as executor:
+            while level and not stopped.is_set():
+                futures = {
+                    executor.submit(fetch_page, url): (url, depth)
+                    for url, depth in level
+                }
+                level = []
+                for future in as_completed(futures):
+                    url, depth = futures[future]
+                    try:
+                        records, links = future.result()
+                    except Exception as e:
+                        # Left pending, so it is fetched again by the next run
+                        logger.error(f"Unable to fetch {url}: {e}")
+                        stats.failed_urls.append(url)
+                        continue
+
+                    if depth < site.depth:
+                        for link in sorted(links):
+                            if self.checkpoint.discover(site.url, link, depth + 1):
+                                level.append((link, depth + 1))
+                    # Wait for room in the queue, unless ingestion has stopped
+                    while not stopped.is_set():
+                        try:
+                            pages.put((url, records), timeout=1)
+                            break
+                        except queue.Full:
+                            continue
+
+    def _ingest(self, pages: "queue.Queue", stats: IngestStats) -> None:
+        batch: List[Tuple[str, str, List[BaseNode]]] = []
+        batch_chunks = 0
+        while True:
+            page = pages.get()
+            if page is None:
+                break
+            url, records = page
+            stats.pages_fetched += 1
+
+            content_hash = hashlib.sha256(
+                json.dumps(records, sort_keys=True).encode()
+            ).hexdigest()
+            state = self.checkpoint.get(url)
+            if state and state.status == DONE and state.content_hash == content_hash:
+                stats.pages_unchanged += 1
+                self.checkpoint.finish(url, content_hash)
+                continue
+
+            nodes = self.node_parser.get_nodes_from_documents(
+                [record_document(record) for record in records]
+            )
+            stats.chunks += len(nodes)
+            batch.append((url, content_hash, nodes))
+            batch_chunks += len(nodes)
+            if batch_chunks >= self.batch_size:
+                self._upsert(batch, stats)
+                batch, batch_chunks = [], 0
+
+        self._upsert(batch, stats)
+
+    def _upsert(
+        self, batch: List[Tuple[str, str, List[BaseNode]]], stats: IngestStats
+    ) -> None:
+        """Replace the chunks each page claims with its new ones"""
+        if not batch:
+            return
+
+        # Find the chunks of each page already stored, by it or any other page
+        planned = []
+        new_nodes: List[BaseNode] = []
+        signatures: Dict[str, Optional[bytes]] = {}
+        for url, content_hash, nodes in batch:
+            state = self.checkpoint.get(url)
+            old_ids = state.node_ids if state else []
+            if state and state.status == UPSERTING:
+                # An interrupted upsert may have stored chunks it didn't record
+                self._release(url, old_ids)
+                old_ids = []
+
+            page_new_ids = []
+            claims = []
+            for node in nodes:
+                duplicate_of = None
+                signature = None
+                if self._index is not None:
+                    signature = self._hasher.signature(node.get_content())
+                    duplicate_of = self._index.find(signature)
+                if duplicate_of is None:
+                    if self._index is not None:
+                        self._index.add(node.node_id, signature)
+                    signatures[node.node_id] = (
+                        signature.tobytes() if signature is not None else None
+                    )
+                    new_nodes.append(node)
+                    page_new_ids.append(node.node_id)
+                    duplicate_of = node.node_id
+                else:
+                    stats.duplicate_chunks += 1
+                claims.append((duplicate_of, node.metadata.get("source") or url))
+
+            self.checkpoint.start_upsert(url, old_ids + page_new_ids)
+            planned.append((url, content_hash, old_ids, page_new_ids, claims))
+
+        # New chunks are only claimed by pages of this batch so far
+        new_sources: Dict[str, List[str]] = {node.node_id: [] for node in new_nodes}
+        for _, _, _, _, claims in planned:
+            for node_id, source in claims:
+                if node_id in new_sources and source not in new_sources[node_id]:
+                    new_sources[node_id].append(source)
+        if new_nodes:
+            embeddings = self.embed_model.get_text_embedding_batch(
+                [node.get_content(MetadataMode.EMBED) for node in new_nodes]
+            )
+            for node, embedding in zip(new_nodes, embeddings):
+                node.embedding = embedding
+                set_node_sources(node, new_sources[node.node_id])
+            self.vector_store.add(new_nodes)
+
+        # Record every claim before releasing chunks, so that a chunk claimed by
+        # another page of the batch isn't deleted
+        for url, _, _, page_new_ids, claims in planned:
+            self.checkpoint.claim(
+                url,
+                [(node_id, signatures[node_id]) for node_id in page_new_ids],
+                claims,
+            )
+        changed: Set[str] = set()
+        for url, content_hash, old_ids, _, claims in planned:
+            claimed = list(dict.fromkeys(node_id for node_id, _ in claims))
+            changed.update(self._delete_unclaimed(set(old_ids) - set(claimed)))
+            changed.update(node_id for node_id in claimed if node_id not in new_sources)
+        self._update_sources(changed)
+
+        for url, content_hash, _, _, claims in planned:
+            claimed = list(dict.fromkeys(node_id for node_id, _ in claims))
+            self.checkpoint.finish(url, content_hash, claimed)
+        logger.info(f"Upserted {len(new_nodes)} chunks of {len(batch)} pages")
+
+    def _release(self, url: str, node_ids: List[str]) -> None:
+        """Drop all the claims of a page, deleting the chunks no other page claims"""
+        claimed = set(self.checkpoint.release(url)) | set(node_ids)
+        self._update_sources(self._delete_unclaimed(claimed))
+
+    def _delete_unclaimed(self, node_ids: Set[str]) -> Set[str]:
+        """Delete the chunks of node_ids no page claims, returning the others"""
+        unclaimed = self.checkpoint.unclaimed(sorted(node_ids))
+        if unclaimed:
+            self.vector_store.delete_nodes(unclaimed)
+            if self._index is not None:
+                for node_id in unclaimed:
+                    self._index.remove(node_id)
+        return node_ids - set(unclaimed)
+
+    def _update_sources(self, node_ids: Set[str]) -> None:
+        """Write the sources of the pages claiming each chunk to its metadata"""
+        if not node_ids:
+            return
+        sources = self.checkpoint.sources(sorted(node_ids))
+        self.vector_store.update_metadata(
+            {
+                node_id: {"sources": json.dumps(node_sources)}
+                for node_id, node_sources in sources.items()
+            }
+        )
+
+
+def build_ingest_pipeline(
+    config: Config,
+    vector_store: VectorStore,
+    embed_model: LangchainEmbedding,
+    node_parser: NodeParser,
+    checkpoint_path: Optional[str] = None,
+) -> IngestPipeline:
+    return IngestPipeline(
+        vector_store,
+        embed_model,
+        node_parser,
+        IngestCheckpoint(checkpoint_path or config.ingest_checkpoint_path),
+        site_concurrency=config.ingest_site_concurrency,
+        batch_size=config.ingest_batch_size,
+        dedup_threshold=config.chunk_dedup_threshold,
+    )
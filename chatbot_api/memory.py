@@ -0,0 +1,263 @@
+"""
+Per-conversation chat memory. Each conversation keeps its recent turns within a token
+budget, and older turns are folded into a rolling summary. Idle conversations are
+evicted in least-recently-used order, so memory use is bounded by
+`max_conversations * token_budget` however many conversations the process has served.
+Conversations can optionally be persisted to an external store, so they survive
+eviction and restarts.
+"""
+import abc
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from chatbot_api.token_util import count_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "Progressively summarize the conversation between a user and an assistant below, "
+    "adding onto the previous summary. Keep the summary concise and keep any details "
+    "the assistant may need to answer follow-up questions.\n\n"
+    "PREVIOUS SUMMARY:\n{summary}\n\n"
+    "NEW LINES OF CONVERSATION:\n{lines}\n\n"
+    "NEW SUMMARY:"
+)
+
+
+@dataclass
+class ConversationTurn:
+    """A single message in a conversation"""
+
+    role: str  # Either "user" or "assistant"
+    content: str
+    tokens: int = 0
+
+
+@dataclass
+class ConversationState:
+    """The remembered state of one conversation"""
+
+    summary: str = ""
+    turns: List[ConversationTurn] = field(default_factory=list)
+    last_used: float = field(default_factory=time.time)
+
+    @property
+    def turn_tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns)
+
+    def copy(self) -> "ConversationState":
+        return ConversationState(self.summary, list(self.turns), self.last_used)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data: str) -> "ConversationState":
+        state = json.loads(data)
+        state["turns"] = [ConversationTurn(**turn) for turn in state["turns"]]
+        return cls(**state)
+
+
+Summarizer = Callable[[str, List[ConversationTurn]], str]
+
+
+def make_llm_summarizer(llm) -> Summarizer:
+    """Return a Summarizer that folds turns into the summary using `llm`"""
+
+    def summarize(summary: str, turns: List[ConversationTurn]) -> str:
+        lines = "\n".join(f"{turn.role}: {turn.content}" for turn in turns)
+        prompt = SUMMARY_PROMPT.format(summary=summary or "None", lines=lines)
+        return llm.complete(prompt).text.strip()
+
+    return summarize
+
+
+class MemoryBackend(metaclass=abc.ABCMeta):
+    """An external store for conversation state"""
+
+    @abc.abstractmethod
+    def get(self, conversation_id: str) -> Optional[ConversationState]:
+        pass
+
+    @abc.abstractmethod
+    def put(self, conversation_id: str, state: ConversationState) -> None:
+        pass
+
+    @abc.abstractmethod
+    def prune(self, older_than: float) -> None:
+        """Delete conversations last used before the `older_than` timestamp"""
+
+
+class SqliteMemoryBackend(MemoryBackend):
+    """Stores conversation state in a local sqlite database"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_memory ("
+                "conversation_id TEXT PRIMARY KEY, state TEXT, last_used REAL)"
+            )
+
+    def get(self, conversation_id: str) -> Optional[ConversationState]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM conversation_memory WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+        return ConversationState.from_json(row[0]) if row else None
+
+    def put(self, conversation_id: str, state: ConversationState) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversation_memory VALUES (?, ?, ?)",
+                (conversation_id, state.to_json(), state.last_used),
+            )
+
+    def prune(self, older_than: float) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM conversation_memory WHERE last_used < ?", (older_than,)
+            )
+
+
+class ConversationMemoryStore:
+    """Bounded, summarized chat history keyed on conversation id"""
+
+    def __init__(
+        self,
+        token_budget: int = 1024,
+        max_conversations: int = 1000,
+        idle_seconds: float = 3600.0,
+        summarizer: Optional[Summarizer] = None,
+        backend: Optional[MemoryBackend] = None,
+        model: Optional[str] = None,
+    ):
+        self.token_budget = token_budget
+        self.max_conversations = max_conversations
+        self.idle_seconds = idle_seconds
+        self.summarizer = summarizer
+        self.backend = backend
+        self.model = model
+
+        self._lock = threading.Lock()
+        self._conversations: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._summarizing: Dict[str, bool] = {}
+        self._last_prune = time.time()
+        # Summarize in the background, so the end of a response isn't held up
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._conversations)
+
+    def _evict(self, now: float) -> None:
+        # NOTE: Must be called with the lock held. Least recently used come first.
+        while self._conversations:
+            state = next(iter(self._conversations.values()))
+            is_idle = now - state.last_used > self.idle_seconds
+            if not is_idle and len(self._conversations) <= self.max_conversations:
+                break
+            self._conversations.popitem(last=False)
+
+    def _load(self, conversation_id: str, now: float) -> ConversationState:
+        # NOTE: Must be called with the lock held
+        state = self._conversations.get(conversation_id)
+        if state is None and self.backend is not None:
+            state = self.backend.get(conversation_id)
+            if state is not None and now - state.last_used > self.idle_seconds:
+                state = None
+        if state is None:
+            state = ConversationState(last_used=now)
+
+        self._conversations[conversation_id] = state
+        self._conversations.move_to_end(conversation_id)
+        self._evict(now)
+        return state
+
+    def get_history(self, conversation_id: str) -> ConversationState:
+        """Return a copy of the remembered state of a conversation"""
+        now = time.time()
+        with self._lock:
+            return self._load(conversation_id, now).copy()
+
+    def add_turn(
+        self, conversation_id: str, user_message: str, assistant_message: str
+    ) -> None:
+        """Remember a question and its answer, summarizing if over the token budget"""
+        now = time.time()
+        turns = [
+            ConversationTurn(
+                "user", user_message, count_tokens(user_message, self.model)
+            ),
+            ConversationTurn(
+                "assistant",
+                assistant_message,
+                count_tokens(assistant_message, self.model),
+            ),
+        ]
+        with self._lock:
+            state = self._load(conversation_id, now)
+            state.turns.extend(turns)
+            state.last_used = now
+            needs_compaction = (
+                state.turn_tokens > self.token_budget
+                and not self._summarizing.get(conversation_id)
+            )
+            if needs_compaction:
+                self._summarizing[conversation_id] = True
+            snapshot = state.copy()
+
+        if needs_compaction:
+            self._executor.submit(self._compact, conversation_id)
+        elif self.backend is not None:
+            self.backend.put(conversation_id, snapshot)
+            self._prune_backend(now)
+
+    def _compact(self, conversation_id: str) -> None:
+        """Fold the oldest turns into the summary until under half the token budget"""
+        try:
+            with self._lock:
+                state = self._conversations.get(conversation_id)
+                if state is None:
+                    return
+                summary = state.summary
+                to_fold, remaining = [], state.turn_tokens
+                for turn in state.turns:
+                    if remaining <= self.token_budget // 2:
+                        break
+                    to_fold.append(turn)
+                    remaining -= turn.tokens
+
+            if self.summarizer is not None:
+                try:
+                    summary = self.summarizer(summary, to_fold)
+                except Exception as e:
+                    # Fall back to dropping the oldest turns
+                    logger.error(f"Unable to summarize conversation: {e}")
+
+            with self._lock:
+                # Only turns are appended while summarizing, so the oldest are unchanged
+                state.summary = summary
+                del state.turns[: len(to_fold)]
+                snapshot = state.copy()
+
+            if self.backend is not None:
+                self.backend.put(conversation_id, snapshot)
+        finally:
+            with self._lock:
+                self._summarizing.pop(conversation_id, None)
+
+    def _prune_backend(self, now: float) -> None:
+        """Remove idle conversations from the external store, once per idle period"""
+        if now - self._last_prune > self.idle_seconds:
+            self._last_prune = now
+            self.backend.prune(now - self.idle_seconds)
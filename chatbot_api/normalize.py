@@ -0,0 +1,46 @@
+"""
+Normalization of user input. html_to_text converts the HTML bodies of messages, such
+as Intercom conversation parts, to plain text. canonical_question reduces a question to
+a canonical form, so that trivially different phrasings of the same question share
+cache and deduplication keys.
+
+Every pattern is compiled once, and none of them can backtrack, so normalizing runs in
+linear time in the length of the input.
+"""
+import html
+import re
+import unicodedata
+
+# Tags that separate blocks of text, which are replaced by a line break
+_BLOCK_TAG = re.compile(
+    r"</?(?:br|p|div|li|ul|ol|tr|h[1-6]|blockquote|pre|hr)\b[^<>]*>", re.IGNORECASE
+)
+# As in HTML, a "<" only starts a tag when followed by a name, "/" or "!"
+_TAG = re.compile(r"<[a-zA-Z/!][^<>]*>")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def html_to_text(body: str) -> str:
+    """
+    Convert an HTML message body to plain text: block tags and <br> become line
+    breaks, other tags are removed, entities are decoded and whitespace is collapsed
+    """
+    text = body
+    if "<" in text:
+        text = _BLOCK_TAG.sub("\n", text)
+        text = _TAG.sub("", text)
+    # Decode entities after removing tags, so that escaped markup stays as text
+    text = html.unescape(text)
+    text = "\n".join(" ".join(line.split()) for line in text.split("\n"))
+    if "\n\n\n" in text:
+        text = _BLANK_LINES.sub("\n\n", text)
+    return text.strip()
+
+
+def canonical_question(text: str) -> str:
+    """
+    The canonical form of a plain text question, ignoring case, Unicode compatibility
+    forms, whitespace and trailing punctuation
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(text.split()).rstrip("?!. ")
@@ -0,0 +1,140 @@
+"""
+Routes users to persona prompt variants based on their contact attributes.
+
+Rules are read from a YAML file (see `persona_rules.yml.example`) and compiled into
+hash tables keyed on attribute values, so classifying a contact costs one dictionary
+lookup per attribute referenced by the rules, regardless of how many rules exist. The
+first rule (in file order) whose conditions all match decides the persona.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import yaml
+
+from chatbot_api.prompt_util import DEFAULT_PERSONA
+
+PERSONA_RULES_PATH = "persona_rules.yml"
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value: Any) -> str:
+    return str(value).strip().lower()
+
+
+def _lookup(contact: Mapping[str, Any], path: Tuple[str, ...]) -> Any:
+    value: Any = contact
+    for part in path:
+        if not isinstance(value, Mapping):
+            return None
+        value = value.get(part)
+    return value
+
+
+class CompiledRules:
+    """A rule table compiled into per-attribute value -> matching-rules bitmasks"""
+
+    def __init__(self, rules: List[Mapping[str, Any]], default: str = DEFAULT_PERSONA):
+        self.default = default
+        self.personas: List[str] = []
+        # attribute path -> bitmask of rules with a condition on that attribute
+        self.conditioned: Dict[Tuple[str, ...], int] = {}
+        # attribute path -> normalized value -> bitmask of rules satisfied by it
+        self.tables: Dict[Tuple[str, ...], Dict[str, int]] = {}
+
+        for index, rule in enumerate(rules):
+            bit = 1 << index
+            self.personas.append(rule["persona"])
+            for attribute, allowed in (rule.get("match") or {}).items():
+                path = tuple(attribute.split("."))
+                self.conditioned[path] = self.conditioned.get(path, 0) | bit
+                table = self.tables.setdefault(path, {})
+                if not isinstance(allowed, list):
+                    allowed = [allowed]
+                for value in allowed:
+                    key = _normalize(value)
+                    table[key] = table.get(key, 0) | bit
+
+        self.all_rules = (1 << len(self.personas)) - 1
+
+    def classify(self, contact: Optional[Mapping[str, Any]]) -> str:
+        if not contact or not self.all_rules:
+            return self.default
+
+        candidates = self.all_rules
+        for path, conditioned in self.conditioned.items():
+            value = _lookup(contact, path)
+            satisfied = (
+                0 if value is None else self.tables[path].get(_normalize(value), 0)
+            )
+            # Drop every rule that has a condition on this attribute it doesn't satisfy
+            candidates &= ~conditioned | satisfied
+            if not candidates:
+                return self.default
+
+        # The lowest set bit is the first matching rule
+        return self.personas[(candidates & -candidates).bit_length() - 1]
+
+
+class PersonaRouter:
+    """
+    Classifies contacts into personas using a rules file, which is recompiled without
+    a restart when it changes on disk (checked at most every `reload_interval` seconds).
+    """
+
+    def __init__(
+        self, rules_path: str = PERSONA_RULES_PATH, reload_interval: float = 5.0
+    ):
+        self.rules_path = rules_path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._compiled = CompiledRules([])
+        self.reload()
+
+    def reload(self) -> None:
+        with self._lock:
+            self._last_check = time.monotonic()
+            mtime = (
+                os.path.getmtime(self.rules_path)
+                if os.path.exists(self.rules_path)
+                else None
+            )
+            if mtime == self._mtime:
+                return
+
+            try:
+                rules_config = {}
+                if mtime is not None:
+                    with open(self.rules_path) as rules_file:
+                        rules_config = yaml.safe_load(rules_file) or {}
+                self._compiled = CompiledRules(
+                    rules_config.get("rules") or [],
+                    default=rules_config.get("default", DEFAULT_PERSONA),
+                )
+            except Exception as e:
+                # Keep routing with the last good rules
+                logger.error(f"Unable to load persona rules {self.rules_path}: {e}")
+
+            self._mtime = mtime
+
+    def get_persona(self, contact: Optional[Mapping[str, Any]]) -> str:
+        if time.monotonic() - self._last_check > self.reload_interval:
+            self.reload()
+        return self._compiled.classify(contact)
+
+
+_routers: Dict[str, PersonaRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def get_persona_router(rules_path: str = PERSONA_RULES_PATH) -> PersonaRouter:
+    """Return the shared PersonaRouter for a rules file, creating it if needed"""
+    with _routers_lock:
+        if rules_path not in _routers:
+            _routers[rules_path] = PersonaRouter(rules_path)
+        return _routers[rules_path]
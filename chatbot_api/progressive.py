@@ -0,0 +1,66 @@
+"""
+Splitting of a streamed response into parts that can be sent as they are generated,
+for integrations that can't stream token by token. Parts end on a sentence or paragraph
+boundary, and are sent at most every `min_interval` seconds so that a fast stream
+doesn't become a flood of messages.
+"""
+import re
+import time
+from typing import Iterable, Iterator, List
+
+from pipeline.config import ReplyBoundary
+
+_PARAGRAPH_END = re.compile(r"\n\s*\n")
+# The end of a sentence, optionally closing a quote or bracket, followed by whitespace
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s|\n")
+_CODE_FENCE = "```"
+
+
+def _last_boundary(text: str, boundary: ReplyBoundary) -> int:
+    """The index just past the last boundary in text, or 0 if there is none"""
+    pattern = _SENTENCE_END if boundary == ReplyBoundary.Sentence else _PARAGRAPH_END
+    end = 0
+    for match in pattern.finditer(text):
+        # Never split a code block across parts
+        if text.count(_CODE_FENCE, 0, match.end()) % 2 == 0:
+            end = match.end()
+    return end
+
+
+def split_on_boundaries(
+    tokens: Iterable[str],
+    boundary: ReplyBoundary = ReplyBoundary.Paragraph,
+    min_interval: float = 2.0,
+) -> Iterator[str]:
+    """
+    Join tokens into parts ending on a boundary. The first part is yielded as soon as
+    it is complete, the following ones no sooner than `min_interval` seconds after the
+    previous part, and the rest of the stream once it ends.
+    """
+    buffer = ""
+    last_part_time = None
+    for token in tokens:
+        buffer += token
+        if (
+            last_part_time is not None
+            and time.monotonic() - last_part_time < min_interval
+        ):
+            continue
+
+        end = _last_boundary(buffer, boundary)
+        part = buffer[:end].strip()
+        if part:
+            buffer = buffer[end:]
+            last_part_time = time.monotonic()
+            yield part
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def remaining_text(text: str, parts: List[str]) -> str:
+    """The rest of text after the first parts split from it by split_on_boundaries"""
+    end = 0
+    for part in parts:
+        end = text.index(part, end) + len(part)
+    return text[end:].strip()
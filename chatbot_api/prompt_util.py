@@ -1,7 +1,96 @@
+import glob
+import logging
 import os
-from typing import List
+import threading
+import time
+from typing import Dict, List, Optional
 
 from langchain.prompts import load_prompt
+from langchain.prompts.base import BasePromptTemplate
+
+PROMPTS_DIR = "prompts"
+DEFAULT_PERSONA = "default"
+
+logger = logging.getLogger(__name__)
+
+
+class PromptRegistry:
+    """
+    Loads and compiles every persona prompt in a directory once, so selecting a prompt
+    variant is a dictionary lookup. Prompts that are added, changed or removed on disk
+    are picked up without a restart, checking at most every `reload_interval` seconds.
+    """
+
+    def __init__(self, prompts_dir: str = PROMPTS_DIR, reload_interval: float = 5.0):
+        self.prompts_dir = prompts_dir
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtimes: Dict[str, float] = {}
+        self._templates: Dict[str, BasePromptTemplate] = {}
+        self._last_check = 0.0
+        self.reload()
+
+    @property
+    def personas(self) -> List[str]:
+        return sorted(self._templates)
+
+    def reload(self) -> None:
+        """Recompile any prompt files that changed since the last load"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            mtimes = {
+                path: os.path.getmtime(path)
+                for path in glob.glob(os.path.join(self.prompts_dir, "*.yaml"))
+            }
+            if mtimes == self._mtimes:
+                return
+
+            templates = {}
+            for path, mtime in mtimes.items():
+                persona = os.path.splitext(os.path.basename(path))[0]
+                if self._mtimes.get(path) == mtime and persona in self._templates:
+                    templates[persona] = self._templates[persona]
+                    continue
+                try:
+                    templates[persona] = load_prompt(path)
+                except Exception as e:
+                    logger.error(f"Unable to load prompt {path}: {e}")
+                    # Keep serving the last good version of the prompt
+                    if persona in self._templates:
+                        templates[persona] = self._templates[persona]
+
+            # Swap in the new mapping atomically for readers
+            self._templates = templates
+            self._mtimes = mtimes
+
+    def get(self, persona: str) -> BasePromptTemplate:
+        """Return the compiled prompt for `persona`, falling back to the default"""
+        if time.monotonic() - self._last_check > self.reload_interval:
+            self.reload()
+
+        templates = self._templates
+        if persona in templates:
+            return templates[persona]
+
+        logger.warning(f"No prompt for persona {persona}, using {DEFAULT_PERSONA}")
+        return templates[DEFAULT_PERSONA]
+
+
+_registries: Dict[str, PromptRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_prompt_registry(prompts_dir: Optional[str] = None) -> PromptRegistry:
+    """Return the shared PromptRegistry for a directory, creating it if needed"""
+    if prompts_dir is None:
+        prompts_dir = PROMPTS_DIR
+        if not os.path.isdir(prompts_dir):
+            prompts_dir = os.path.join("..", PROMPTS_DIR)
+
+    with _registries_lock:
+        if prompts_dir not in _registries:
+            _registries[prompts_dir] = PromptRegistry(prompts_dir)
+        return _registries[prompts_dir]
 
 
 def get_template(
@@ -12,11 +101,7 @@ def get_template(
     company: str,
     custom_rules: List[str],
 ) -> str:
-    persona_path = f"prompts/{persona}.yaml"
-    if not os.path.exists(persona_path):
-        persona_path = f"../prompts/{persona}.yaml"
-
-    prompt = load_prompt(persona_path)
+    prompt = get_prompt_registry().get(persona)
     input_txt = prompt.format(
         **{
             "vector_search_results": vector_search_results,
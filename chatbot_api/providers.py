@@ -0,0 +1,294 @@
+"""
+A pool of LLM providers with health tracking, circuit breakers and hedged requests.
+
+Requests go to the first provider whose circuit is closed. If that provider fails
+before producing its first token, the request fails over to the next provider. With
+hedging enabled, a request whose time to first token exceeds the provider's recent
+p95 (by default) is also sent to the next provider; whichever stream produces a token
+first is kept and the other is cancelled.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Iterator, List, Optional, Set
+
+from langchain.llms import VertexAI
+from llama_index.llms import LLM, ChatMessage, LangChainLLM, OpenAI
+
+from chatbot_api.generation import stream_chat_tokens
+from integrations.google import init_gcp
+from pipeline.config import Config, LLMProvider
+from pipeline.metrics import Summary, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def get_textgen_model(config: Config, provider: LLMProvider) -> str:
+    """Return the name of the text generation model used for a provider"""
+    if provider == LLMProvider.OpenAI:
+        return config.openai_textgen_model
+    return config.google_textgen_model
+
+
+def build_llm(config: Config, provider: LLMProvider) -> LLM:
+    """Build the text generation LLM for a provider"""
+    if provider == LLMProvider.OpenAI:
+        return OpenAI(model=config.openai_textgen_model)
+
+    elif provider == LLMProvider.Google:
+        init_gcp(config)
+        return LangChainLLM(llm=VertexAI(model_name=config.google_textgen_model))
+
+    raise AssertionError("LLM Provider must be one of openai or google")
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a provider after `failure_threshold` consecutive
+    failures. After `reset_seconds`, a single trial request is let through, and its
+    outcome decides whether the circuit closes again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (
+                self.state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_seconds
+            ):
+                self.state = self.HALF_OPEN
+                return True
+            # Only one trial request at a time while half open
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Give back a half-open trial that ended without a success or failure"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+
+class Provider:
+    """An LLM along with its health"""
+
+    def __init__(self, name: str, llm: LLM, breaker: CircuitBreaker):
+        self.name = name
+        self.llm = llm
+        self.breaker = breaker
+        self.time_to_first_token = Summary(window=512)
+
+
+# Kinds of events sent from the streaming threads
+_TOKEN, _DONE, _ERROR = range(3)
+
+
+class ProviderPool:
+    """Streams chat completions from the healthiest of several LLM providers"""
+
+    def __init__(
+        self,
+        providers: List[Provider],
+        hedge: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 1.0,
+        hedge_min_samples: int = 20,
+    ):
+        assert providers, "At least one LLM provider is required"
+        self.providers = providers
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+
+    @classmethod
+    def from_config(cls, config: Config, primary_llm: LLM) -> "ProviderPool":
+        """Build the pool for the configured primary and fallback providers"""
+
+        def make_breaker() -> CircuitBreaker:
+            return CircuitBreaker(
+                failure_threshold=config.circuit_breaker_failures,
+                reset_seconds=config.circuit_breaker_reset_seconds,
+            )
+
+        providers = [Provider(config.llm_provider.value, primary_llm, make_breaker())]
+        if config.fallback_llm_provider is not None:
+            providers.append(
+                Provider(
+                    config.fallback_llm_provider.value,
+                    build_llm(config, config.fallback_llm_provider),
+                    make_breaker(),
+                )
+            )
+
+        return cls(
+            providers,
+            hedge=config.hedge_requests,
+            hedge_percentile=config.hedge_percentile,
+            hedge_min_delay=config.hedge_min_delay,
+        )
+
+    def hedge_delay(self, provider: Provider) -> float:
+        """Seconds to wait for a first token from `provider` before hedging"""
+        samples = provider.time_to_first_token
+        if samples.count < self.hedge_min_samples:
+            return self.hedge_min_delay
+        return max(self.hedge_min_delay, samples.quantile(self.hedge_percentile))
+
+    def _stream_into(
+        self,
+        provider: Provider,
+        messages: List[ChatMessage],
+        index: int,
+        events: queue.Queue,
+        cancel: threading.Event,
+    ) -> None:
+        """Stream a provider's response into `events`, run in its own thread"""
+        start_time = time.monotonic()
+        first_token = True
+        token_gen = stream_chat_tokens(provider.llm, messages)
+        try:
+            for token in token_gen:
+                # Recorded even if another attempt won, so that the slow first tokens
+                # that caused hedging are sampled too
+                if first_token:
+                    first_token = False
+                    ttft = time.monotonic() - start_time
+                    provider.time_to_first_token.observe(ttft)
+                    metrics.observe(
+                        "llm_provider_time_to_first_token_seconds",
+                        ttft,
+                        provider=provider.name,
+                    )
+                if cancel.is_set():
+                    provider.breaker.release()
+                    metrics.inc(
+                        "llm_provider_requests_total",
+                        provider=provider.name,
+                        outcome="cancelled",
+                    )
+                    return
+                events.put((index, _TOKEN, token))
+
+            provider.breaker.record_success()
+            metrics.inc(
+                "llm_provider_requests_total",
+                provider=provider.name,
+                outcome="success",
+            )
+            events.put((index, _DONE, None))
+        except Exception as e:
+            logger.error(f"LLM provider {provider.name} failed: {e}")
+            provider.breaker.record_failure()
+            metrics.inc(
+                "llm_provider_requests_total",
+                provider=provider.name,
+                outcome="failure",
+            )
+            events.put((index, _ERROR, e))
+        finally:
+            token_gen.close()
+            metrics.set(
+                "llm_provider_circuit_open",
+                float(provider.breaker.state != CircuitBreaker.CLOSED),
+                provider=provider.name,
+            )
+
+    def stream_tokens(self, messages: List[ChatMessage]) -> Iterator[str]:
+        """Stream the response to `messages`, failing over and hedging as needed"""
+        events: queue.Queue = queue.Queue()
+        cancels: List[threading.Event] = []
+        started: List[Provider] = []
+        running: Set[int] = set()
+        winner: Optional[int] = None
+        hedge_deadline: Optional[float] = None
+
+        def start_next() -> bool:
+            nonlocal hedge_deadline
+            for provider in self.providers:
+                if provider in started or not provider.breaker.allow_request():
+                    continue
+                index = len(started)
+                started.append(provider)
+                cancels.append(threading.Event())
+                running.add(index)
+                threading.Thread(
+                    target=self._stream_into,
+                    args=(provider, messages, index, events, cancels[index]),
+                    daemon=True,
+                ).start()
+                hedge_deadline = time.monotonic() + self.hedge_delay(provider)
+                return True
+            return False
+
+        if not start_next():
+            raise RuntimeError("All LLM providers are unavailable")
+
+        try:
+            while True:
+                timeout = None
+                if self.hedge and winner is None and hedge_deadline is not None:
+                    timeout = max(0.0, hedge_deadline - time.monotonic())
+
+                try:
+                    index, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    # The first token is slower than usual, so also ask another provider
+                    if start_next():
+                        metrics.inc(
+                            "llm_hedged_requests_total", provider=started[-1].name
+                        )
+                    else:
+                        hedge_deadline = None
+                    continue
+
+                # Ignore anything from streams that lost the race
+                if winner is not None and index != winner:
+                    continue
+
+                if kind == _ERROR:
+                    running.discard(index)
+                    # Can't fail over once tokens have been sent to the caller
+                    if index == winner:
+                        raise payload
+                    if not running and not start_next():
+                        raise payload
+                    continue
+
+                if winner is None:
+                    winner = index
+                    for other, cancel in enumerate(cancels):
+                        if other != winner:
+                            cancel.set()
+
+                if kind == _DONE:
+                    return
+                yield payload
+        finally:
+            for cancel in cancels:
+                cancel.set()
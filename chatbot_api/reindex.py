@@ -0,0 +1,72 @@
+"""
+Publishing of a new version of the vector store, see collection_alias.py. Before the
+alias is switched to it, the new version's retrieval recall on the labelled questions
+in reindex_questions is checked against that of the version being served.
+"""
+from typing import Any, Dict, List
+
+from llama_index import ServiceContext, VectorStoreIndex
+from llama_index.vector_stores.types import VectorStore
+
+from benchmarks.retrieval_benchmark import evaluate, load_questions
+from chatbot_api.collection_alias import build_collection_alias, collect_old_versions
+from chatbot_api.vector_store import build_vector_store
+from pipeline.config import Config
+
+
+def get_recall(
+    vector_store: VectorStore,
+    service_context: ServiceContext,
+    questions: List[Dict[str, Any]],
+    k: int,
+) -> float:
+    """The recall@k of a version of the vector store on the labelled questions"""
+    index = VectorStoreIndex.from_vector_store(
+        vector_store=vector_store, service_context=service_context
+    )
+
+    def retrieve(query, k):
+        return index.as_retriever(similarity_top_k=k).retrieve(query)
+
+    report, _ = evaluate(retrieve, questions, [k])
+    return report["by_k"][k]["recall"]
+
+
+def publish_version(
+    config: Config,
+    version: str,
+    vector_store: VectorStore,
+    service_context: ServiceContext,
+) -> None:
+    """
+    Validate a new version of the vector store with the retrieval benchmark, then
+    switch the collection alias to it and drop old versions
+
+    :raises ValueError: If the recall of the new version is too low
+    """
+    alias = build_collection_alias(config)
+    serving = alias.get()
+
+    if config.reindex_questions:
+        questions = [
+            q for q in load_questions(config.reindex_questions) if q.get("relevant")
+        ]
+        if not questions:
+            raise ValueError(f"{config.reindex_questions} has no labelled questions")
+        k = config.reindex_k
+        recall = get_recall(vector_store, service_context, questions, k)
+        serving_recall = get_recall(
+            build_vector_store(config, version=serving), service_context, questions, k
+        )
+        print(f"recall@{k}: {recall:.3f} for {version}, {serving_recall:.3f} served")
+        if recall < serving_recall - config.reindex_max_recall_drop:
+            raise ValueError(
+                f"Not publishing {version}, its recall@{k} of {recall:.3f} is worse "
+                f"than the {serving_recall:.3f} of the version being served"
+            )
+
+    alias.set(version)
+    print(f"Serving {version}, previously {serving or 'unversioned'}")
+    dropped = collect_old_versions(alias, config.collection_versions_kept)
+    if dropped:
+        print(f"Dropped old versions {', '.join(dropped)}")
@@ -0,0 +1,105 @@
+"""
+Routes each question to the amount of retrieval it needs, before any vector search is
+run. Small talk, and requests to rephrase the previous answer of a conversation, need no
+documents at all. Other questions get a small or large number of documents, depending
+on how complex a tiny linear classifier over features of the question scores them.
+
+Routing is a handful of compiled pattern matches over the question, so costs far less
+than the embedding and vector search it can save.
+"""
+import math
+import re
+from enum import Enum
+from typing import Dict
+
+from chatbot_api.normalize import canonical_question
+
+NO_CONTEXT_TAG = "[NO CONTEXT]"
+
+
+class RetrievalRoute(str, Enum):
+    Skip = "skip"
+    Small = "small"
+    Large = "large"
+
+
+# Greetings, thanks and acknowledgements, which make up the whole message
+_SMALL_TALK_PHRASE = (
+    r"(?:hi|hello|hey|yo|good (?:morning|afternoon|evening)|thanks?(?: you)?|thx|ty"
+    r"|cheers|ok(?:ay)?|cool|great|awesome|perfect|got it|bye|goodbye|see you"
+    r"|have a (?:good|nice) (?:day|one)|there|again|so much|a lot|very much|all|bot)"
+)
+_SMALL_TALK = re.compile(f"{_SMALL_TALK_PHRASE}(?:[\\s,!.]+{_SMALL_TALK_PHRASE})*")
+# Requests to change the previous answer rather than asking anything new
+_REPHRASE = re.compile(
+    r"\b(?:rephrase|reword|simpler|simplify|shorter|more concise"
+    r"|summari[sz]e (?:that|it)|explain (?:that|it) (?:again|differently|more simply)"
+    r"|in other words|tl;?dr|what do you mean|i don'?t understand)\b"
+)
+# Signs of a technical question that needs more context
+_CODE = re.compile(r"`|\b\w+\(\)|\b[a-z]+_[a-z_]+\b|\b[a-z]+[A-Z]\w*\b|\{|\}|=>|::")
+_ERROR = re.compile(
+    r"\b(?:error|exception|traceback|failed|failing|fails|timeout|crash\w*|denied"
+    r"|not working|doesn'?t work|broken)\b"
+)
+_VERSION = re.compile(r"\bv?\d+\.\d+(?:\.\d+)?\b")
+_COMPARISON = re.compile(
+    r"\b(?:vs\.?|versus|compare|comparison|difference|differences|better|instead of)\b"
+)
+_MULTI_PART = re.compile(r"\?.+\?|\b(?:and also|as well as|additionally)\b")
+
+# The weights of the complexity classifier. A question scoring at least 0.5 gets the
+# large number of documents.
+_WEIGHTS: Dict[str, float] = {
+    "bias": -2.0,
+    "log_words": 0.6,
+    "code": 1.2,
+    "error": 1.0,
+    "version": 0.5,
+    "comparison": 1.5,
+    "multi_part": 1.2,
+    "lines": 0.4,
+}
+
+
+def question_features(question: str) -> Dict[str, float]:
+    """The features of a question the complexity classifier scores"""
+    lowered = question.lower()
+    return {
+        "bias": 1.0,
+        "log_words": math.log1p(len(question.split())),
+        "code": float(bool(_CODE.search(question))),
+        "error": float(bool(_ERROR.search(lowered))),
+        "version": float(bool(_VERSION.search(lowered))),
+        "comparison": float(bool(_COMPARISON.search(lowered))),
+        "multi_part": float(bool(_MULTI_PART.search(lowered))),
+        "lines": float(min(question.count("\n"), 5)),
+    }
+
+
+def complexity(question: str) -> float:
+    """The probability that a question needs the large number of documents"""
+    features = question_features(question)
+    score = sum(_WEIGHTS[name] * value for name, value in features.items())
+    return 1 / (1 + math.exp(-score))
+
+
+def route_question(question: str, in_conversation: bool = False) -> RetrievalRoute:
+    """
+    Decide how much retrieval a question needs.
+
+    :param in_conversation: Whether the question follows earlier turns of the same
+                            conversation, so can refer to the previous answer
+    """
+    if NO_CONTEXT_TAG in question:
+        return RetrievalRoute.Skip
+
+    canonical = canonical_question(question)
+    if not canonical or (len(canonical) < 80 and _SMALL_TALK.fullmatch(canonical)):
+        return RetrievalRoute.Skip
+    if in_conversation and len(canonical) < 120 and _REPHRASE.search(canonical):
+        return RetrievalRoute.Skip
+
+    if complexity(question) >= 0.5:
+        return RetrievalRoute.Large
+    return RetrievalRoute.Small
@@ -0,0 +1,180 @@
+"""
+Coalescing of concurrent identical requests. The first caller for a key (the leader)
+performs the upstream work, and any caller arriving while that work is still in
+flight shares its result, including the streamed tokens.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+
+class TokenBroadcast:
+    """
+    Fans a single token stream out to any number of subscribers. Tokens are pulled
+    from the source lazily by whichever subscriber needs the next one, and buffered so
+    that late subscribers replay the stream from the beginning. The source is pulled
+    outside the lock, so other subscribers can read the buffer while it is waited on.
+    """
+
+    def __init__(self, source: Iterator[str]):
+        self._source = source
+        self._tokens: List[str] = []
+        self._lock = threading.Lock()
+        # Notified when a token is added or the stream ends
+        self._changed = threading.Condition(self._lock)
+        # Whether a subscriber is pulling the next token from the source
+        self._producing = False
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._done_callbacks: List[Callable[[], None]] = []
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        """The error the source stream failed with, if any"""
+        return self._error
+
+    @property
+    def text(self) -> str:
+        """The tokens streamed so far, joined"""
+        with self._lock:
+            return "".join(self._tokens)
+
+    def add_done_callback(self, callback: Callable[[], None]) -> None:
+        """Register a callback run once the source stream is exhausted or fails"""
+        with self._lock:
+            if not self._done:
+                self._done_callbacks.append(callback)
+                return
+        callback()
+
+    def _finish(self) -> List[Callable[[], None]]:
+        # NOTE: Must be called with the lock held, callbacks are run after releasing it
+        self._done = True
+        self._producing = False
+        self._changed.notify_all()
+        callbacks, self._done_callbacks = self._done_callbacks, []
+        return callbacks
+
+    def _token_at(self, index: int) -> Optional[str]:
+        with self._lock:
+            # Wait for the subscriber pulling the next token, unless it is buffered
+            while True:
+                if index < len(self._tokens):
+                    return self._tokens[index]
+                if self._error is not None:
+                    raise self._error
+                if self._done:
+                    return None
+                if not self._producing:
+                    break
+                self._changed.wait()
+            self._producing = True
+
+        callbacks: List[Callable[[], None]] = []
+        try:
+            try:
+                token = next(self._source)
+            except StopIteration:
+                with self._lock:
+                    callbacks = self._finish()
+                return None
+            except BaseException as e:
+                with self._lock:
+                    self._error = e
+                    callbacks = self._finish()
+                raise
+
+            with self._lock:
+                self._tokens.append(token)
+                self._producing = False
+                self._changed.notify_all()
+            return token
+        finally:
+            for callback in callbacks:
+                callback()
+
+    def subscribe(self) -> Iterator[str]:
+        """Return a new iterator over the full token stream"""
+        index = 0
+        while True:
+            token = self._token_at(index)
+            if token is None:
+                return
+            index += 1
+            yield token
+
+
+class _Call:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.ready = threading.Event()
+        self.broadcast: Optional[TokenBroadcast] = None
+        self.extra: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Tracks in-flight streamed calls by key. A call stays in flight until its token
+    stream is exhausted, so requests arriving mid-stream join it and replay the tokens
+    already produced. Calls older than `max_age` seconds are never joined, which guards
+    against streams that were abandoned before being fully consumed.
+    """
+
+    def __init__(self, max_age: float = 300.0):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Tuple[Iterator[str], Any]],
+    ) -> Tuple[Iterator[str], Any, bool]:
+        """
+        Run `fn` unless an identical call is already in flight.
+
+        :param fn: Returns a tuple of (token stream, extra result data)
+        :returns: A tuple of (token stream for this caller, extra result data, whether
+                  the result was shared from another caller's call)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = (
+                call is None or time.monotonic() - call.started_at > self.max_age
+            )
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.ready.wait()
+            if call.error is not None:
+                raise call.error
+            return call.broadcast.subscribe(), call.extra, True
+
+        try:
+            token_stream, call.extra = fn()
+            call.broadcast = TokenBroadcast(token_stream)
+            call.broadcast.add_done_callback(lambda: self._forget(key, call))
+        except BaseException as e:
+            call.error = e
+            self._forget(key, call)
+            raise
+        finally:
+            call.ready.set()
+
+        return call.broadcast.subscribe(), call.extra, False
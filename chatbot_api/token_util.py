@@ -0,0 +1,37 @@
+import logging
+from functools import lru_cache
+from typing import Optional
+
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: Optional[str]) -> Optional["tiktoken.Encoding"]:
+    try:
+        if model is not None:
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                pass
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        # tiktoken downloads its vocabularies on first use, which can fail offline
+        logger.warning(f"Unable to load tiktoken encoding, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Count the tokens in `text` using the tokenizer of `model` where known"""
+    if not text:
+        return 0
+
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # Tokens are ~4 characters on average for English text
+        return max(1, len(text) // 4)
+
+    return len(encoding.encode(text, disallowed_special=()))
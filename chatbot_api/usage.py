@@ -0,0 +1,176 @@
+"""
+Token usage and estimated cost accounting. The tokens of each generation's prompt
+messages, of the retrieved documents within them and of its completion are counted with
+the tokenizer of the text generation model, and priced with the configured cost of the
+model. Responses that didn't call the LLM, FAQ answers and responses shared with a
+concurrent identical request, are recorded as not generated, at no cost.
+
+Usage is totalled in memory by persona, integration and model, exported as metrics, and
+optionally appended to a rolling log with one compact JSON line per response.
+"""
+import json
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional, Tuple
+
+from chatbot_api.token_util import count_tokens
+from pipeline.config import Config, ModelCost
+from pipeline.metrics import metrics
+
+
+@dataclass
+class RequestUsage:
+    """The tokens used to generate one response, and their estimated cost in USD"""
+
+    persona: str
+    integration: str
+    model: str
+    # The whole prompt, including the retrieved documents counted in context_tokens
+    prompt_tokens: int
+    context_tokens: int
+    completion_tokens: int
+    cost: float
+    timestamp: float
+    # Whether the LLM was called for this response
+    generated: bool = True
+
+
+@dataclass
+class UsageTotals:
+    requests: int = 0
+    generations: int = 0
+    prompt_tokens: int = 0
+    context_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+
+class UsageTracker:
+    """
+    Accounts for the usage of responses generated by `model` for `integration`, priced
+    with `model_costs` in USD per 1000 tokens. The cost of models without a price is
+    estimated as 0.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        integration: str = "None",
+        model_costs: Optional[Dict[str, ModelCost]] = None,
+        log_path: Optional[str] = None,
+        log_max_bytes: int = 10_000_000,
+        log_backups: int = 5,
+    ):
+        self.model = model
+        self.integration = integration
+        self.model_costs = model_costs or {}
+
+        self._lock = threading.Lock()
+        self._totals: Dict[Tuple[str, str, str], UsageTotals] = {}
+
+        self._log = None
+        if log_path:
+            handler = RotatingFileHandler(
+                log_path, maxBytes=log_max_bytes, backupCount=log_backups
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._log = logging.getLogger(f"{__name__}.{log_path}")
+            self._log.setLevel(logging.INFO)
+            self._log.propagate = False
+            self._log.addHandler(handler)
+
+    def estimate_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        cost = self.model_costs.get(self.model)
+        if cost is None:
+            return 0.0
+        prompt_cost = prompt_tokens * cost.prompt / 1000
+        return prompt_cost + completion_tokens * cost.completion / 1000
+
+    def record(
+        self,
+        persona: str,
+        prompt: str = "",
+        retrieved_context: str = "",
+        completion: str = "",
+        generated: bool = True,
+    ) -> RequestUsage:
+        """
+        Count the usage of a response, adding it to the totals. Responses that weren't
+        generated are counted as requests only.
+        """
+        prompt_tokens = count_tokens(prompt, self.model) if generated else 0
+        completion_tokens = count_tokens(completion, self.model) if generated else 0
+        usage = RequestUsage(
+            persona=persona,
+            integration=self.integration,
+            model=self.model,
+            prompt_tokens=prompt_tokens,
+            context_tokens=(
+                count_tokens(retrieved_context, self.model) if generated else 0
+            ),
+            completion_tokens=completion_tokens,
+            cost=self.estimate_cost(prompt_tokens, completion_tokens),
+            timestamp=time.time(),
+            generated=generated,
+        )
+
+        with self._lock:
+            totals = self._totals.setdefault(
+                (persona, self.integration, self.model), UsageTotals()
+            )
+            totals.requests += 1
+            totals.generations += int(generated)
+            totals.prompt_tokens += usage.prompt_tokens
+            totals.context_tokens += usage.context_tokens
+            totals.completion_tokens += usage.completion_tokens
+            totals.cost += usage.cost
+
+        labels = {
+            "persona": persona,
+            "integration": self.integration,
+            "model": self.model,
+        }
+        metrics.inc("usage_requests_total", generated=str(generated).lower(), **labels)
+        for kind in ["prompt", "context", "completion"]:
+            metrics.inc(
+                "usage_tokens_total",
+                getattr(usage, f"{kind}_tokens"),
+                kind=kind,
+                **labels,
+            )
+        metrics.inc("usage_cost_usd_total", usage.cost, **labels)
+        metrics.observe("usage_request_cost_usd", usage.cost, **labels)
+
+        if self._log is not None:
+            self._log.info(json.dumps(asdict(usage), separators=(",", ":")))
+        return usage
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """The usage totals of each persona, integration and model"""
+        with self._lock:
+            return [
+                {"persona": persona, "integration": integration, "model": model}
+                | asdict(totals)
+                for (persona, integration, model), totals in self._totals.items()
+            ]
+
+
+def get_integration_name(config: Config) -> str:
+    """The integration responses are for, labelling their usage"""
+    if not config.response_decider_cls:
+        return "None"
+    return config.response_decider_cls[0].removesuffix("ResponseDecider")
+
+
+def build_usage_tracker(config: Config, model: str) -> UsageTracker:
+    return UsageTracker(
+        model,
+        integration=get_integration_name(config),
+        model_costs=config.model_costs,
+        log_path=config.usage_log_path,
+        log_max_bytes=config.usage_log_max_bytes,
+        log_backups=config.usage_log_backups,
+    )
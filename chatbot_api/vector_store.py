@@ -0,0 +1,566 @@
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.schema import BaseNode, TextNode
+from llama_index.vector_stores import AstraDBVectorStore
+from llama_index.vector_stores.types import (
+    FilterOperator,
+    MetadataFilters,
+    VectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+from integrations.google import GECKO_EMB_DIM
+from integrations.openai import OPENAI_EMB_DIM
+from pipeline.config import Config, LLMProvider, Quantization, VectorStoreBackend
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.f32"
+NODES_FILE = "nodes.jsonl"
+HNSW_FILE = "hnsw.bin"
+INT8_FILE = "vectors.i8"
+INT8_SCALES_FILE = "scales.f32"
+BINARY_FILE = "vectors.bin"
+VERSIONS_DIR = "versions"
+
+# Bits set in each byte value, for Hamming distances between packed binary codes
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+# Rows scored at a time by the quantized first pass, bounding its temporary memory
+QUANTIZED_BLOCK_SIZE = 4096
+NO_ROWS = np.zeros(0, dtype=np.int64)
+# The most values the Astra DB Data API accepts in an $in filter
+ASTRA_MAX_IN_VALUES = 100
+
+
+def get_embedding_dimension(config: Config) -> int:
+    """The dimension of the embeddings of the configured llm_provider"""
+    if config.llm_provider == LLMProvider.OpenAI:
+        return OPENAI_EMB_DIM
+    return GECKO_EMB_DIM
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    # Write then rename, so readers never see a partial manifest
+    tmp_path = os.path.join(path, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_FILE))
+
+
+def bytes_per_vector(quantization: Optional[Quantization], dimension: int) -> int:
+    """The memory used by each vector of the in-memory index"""
+    if quantization == Quantization.Int8:
+        return dimension + 4  # One byte per dimension and a float32 scale
+    if quantization == Quantization.Binary:
+        return (dimension + 7) // 8  # One bit per dimension
+    return dimension * 4
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize each vector to int8 codes with its own scale"""
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """Quantize vectors to their packed sign bits"""
+    return np.packbits(vectors > 0, axis=1)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """The indices of the k highest finite scores, highest first"""
+    if k < len(scores):
+        top = np.argpartition(-scores, k)[:k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top])]
+    return top[np.isfinite(scores[top])]
+
+
+def combine_filters(
+    filters: Optional[MetadataFilters], metadata_filter: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Merge llama_index exact match filters into a metadata filter, which maps each
+    metadata key to a value, or a list of values of which any may match
+    """
+    combined = {}
+    if filters is not None:
+        for f in filters.filters:
+            if getattr(f, "operator", FilterOperator.EQ) != FilterOperator.EQ:
+                raise NotImplementedError("Only exact match filters are supported")
+            combined[f.key] = f.value
+    combined.update(metadata_filter or {})
+    return combined
+
+
+def to_astra_filter(metadata_filter: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate a metadata filter to an Astra DB Data API filter"""
+    return {
+        f"metadata.{key}": {"$in": value} if isinstance(value, list) else value
+        for key, value in metadata_filter.items()
+    }
+
+
+class LocalVectorStore(VectorStore):
+    """
+    A vector store kept on local disk, for small doc sets and running without Astra.
+
+    Normalized float32 embeddings are appended to a flat file that is memory-mapped
+    for queries, so cosine top-k is a single matrix-vector product. Nodes are stored
+    as JSON lines alongside, and the ingestion manifest records the dimension and
+    count. With hnsw=True (requires hnswlib), unfiltered queries use an HNSW index,
+    which is rebuilt when the vectors change.
+
+    With quantization, exact search is done in two passes: the candidates are
+    selected by scoring compact int8 (4x smaller) or binary (32x smaller) codes held
+    in memory, then only the top k * rescore_factor are rescored exactly from the
+    float32 embeddings on disk.
+    """
+
+    stores_text: bool = True
+
+    def __init__(
+        self,
+        path: str,
+        embedding_dimension: int,
+        hnsw: bool = False,
+        quantization: Optional[Quantization] = None,
+        rescore_factor: int = 4,
+    ):
+        if hnsw and hnswlib is None:
+            raise ImportError("hnswlib must be installed to use an HNSW index")
+
+        self.path = path
+        self.embedding_dimension = embedding_dimension
+        self.hnsw = hnsw
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        os.makedirs(path, exist_ok=True)
+
+        manifest = read_manifest(path)
+        dimension = manifest.get("dimension", embedding_dimension)
+        if dimension != embedding_dimension:
+            raise ValueError(
+                f"The vector store at {path} has dimension {dimension}, "
+                f"expected {embedding_dimension}"
+            )
+
+        self._lock = threading.Lock()
+        self._nodes: List[BaseNode] = []
+        nodes_path = os.path.join(path, NODES_FILE)
+        if os.path.exists(nodes_path):
+            with open(nodes_path, encoding="utf-8") as f:
+                self._nodes = [metadata_dict_to_node(json.loads(line)) for line in f]
+        self._matrix: Optional[np.ndarray] = None
+        self._quantized: Optional[Tuple[np.ndarray, ...]] = None
+        self._metadata_index: Dict[str, Dict[Any, np.ndarray]] = {}
+        self._hnsw_index = None
+
+    @property
+    def client(self) -> None:
+        return None
+
+    # Not __len__, as an empty vector store would be falsy, which llama_index
+    # treats as no vector store
+    @property
+    def count(self) -> int:
+        return len(self._nodes)
+
+    @property
+    def index_bytes(self) -> int:
+        """The memory used by the in-memory index used for exact search"""
+        return len(self._nodes) * bytes_per_vector(
+            self.quantization, self.embedding_dimension
+        )
+
+    def _update_manifest(self) -> None:
+        manifest = read_manifest(self.path)
+        manifest.update(dimension=self.embedding_dimension, count=len(self._nodes))
+        write_manifest(self.path, manifest)
+
+    def _invalidate(self) -> None:
+        self._matrix = None
+        self._quantized = None
+        self._metadata_index = {}
+        self._hnsw_index = None
+        for derived_file in [HNSW_FILE, INT8_FILE, INT8_SCALES_FILE, BINARY_FILE]:
+            derived_path = os.path.join(self.path, derived_file)
+            if os.path.exists(derived_path):
+                os.remove(derived_path)
+
+    def add(self, nodes: Sequence[BaseNode], **kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+
+        vectors = np.array(
+            [node.get_embedding() for node in nodes], dtype=np.float32
+        ).reshape(len(nodes), self.embedding_dimension)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        with self._lock:
+            with open(os.path.join(self.path, VECTORS_FILE), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(os.path.join(self.path, NODES_FILE), "a", encoding="utf-8") as f:
+                for node in nodes:
+                    record = node_to_metadata_dict(
+                        node, remove_text=False, flat_metadata=False
+                    )
+                    f.write(json.dumps(record) + "\n")
+            self._nodes.extend(nodes)
+            self._update_manifest()
+            self._invalidate()
+
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **kwargs: Any) -> None:
+        self._delete_where(lambda node: node.ref_doc_id == ref_doc_id)
+
+    def delete_nodes(self, node_ids: List[str]) -> None:
+        node_ids = set(node_ids)
+        self._delete_where(lambda node: node.node_id in node_ids)
+
+    def _delete_where(self, should_delete: Callable[[BaseNode], bool]) -> None:
+        with self._lock:
+            keep = [i for i, n in enumerate(self._nodes) if not should_delete(n)]
+            if len(keep) == len(self._nodes):
+                return
+
+            vectors = np.array(self._get_matrix()[keep])
+            self._nodes = [self._nodes[i] for i in keep]
+
+            # Replace rather than truncate the files, as in-flight queries may
+            # still be reading the previous memory map
+            vectors_path = os.path.join(self.path, VECTORS_FILE)
+            with open(vectors_path + ".tmp", "wb") as f:
+                f.write(vectors.tobytes())
+            os.replace(vectors_path + ".tmp", vectors_path)
+            self._write_nodes()
+            self._update_manifest()
+            self._invalidate()
+
+    def update_metadata(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        """Update the metadata of nodes by id, leaving their embeddings as they are"""
+        with self._lock:
+            for node in self._nodes:
+                if node.node_id in updates:
+                    node.metadata = {**node.metadata, **updates[node.node_id]}
+            self._write_nodes()
+            self._metadata_index = {}
+
+    def _write_nodes(self) -> None:
+        """Replace the nodes file with the nodes, call with the lock held"""
+        nodes_path = os.path.join(self.path, NODES_FILE)
+        with open(nodes_path + ".tmp", "w", encoding="utf-8") as f:
+            for node in self._nodes:
+                record = node_to_metadata_dict(
+                    node, remove_text=False, flat_metadata=False
+                )
+                f.write(json.dumps(record) + "\n")
+        os.replace(nodes_path + ".tmp", nodes_path)
+
+    def _get_matrix(self) -> np.ndarray:
+        """The memory-mapped embeddings, call with the lock held"""
+        if self._matrix is None:
+            if not self._nodes:
+                return np.zeros((0, self.embedding_dimension), dtype=np.float32)
+            self._matrix = np.memmap(
+                os.path.join(self.path, VECTORS_FILE),
+                dtype=np.float32,
+                mode="r",
+                shape=(len(self._nodes), self.embedding_dimension),
+            )
+        return self._matrix
+
+    def _get_quantized(self, matrix: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """The quantized embeddings, call with the lock held"""
+        if self._quantized is None:
+            shape = (len(matrix), self.embedding_dimension)
+            # Quantize in blocks, to avoid loading all embeddings into memory at once
+            blocks = (
+                np.asarray(matrix[i : i + QUANTIZED_BLOCK_SIZE])
+                for i in range(0, len(matrix), QUANTIZED_BLOCK_SIZE)
+            )
+
+            if self.quantization == Quantization.Int8:
+                codes_path = os.path.join(self.path, INT8_FILE)
+                scales_path = os.path.join(self.path, INT8_SCALES_FILE)
+                if os.path.exists(codes_path):
+                    codes = np.fromfile(codes_path, dtype=np.int8).reshape(shape)
+                    scales = np.fromfile(scales_path, dtype=np.float32)
+                else:
+                    quantized = [quantize_int8(block) for block in blocks]
+                    codes = np.concatenate([q[0] for q in quantized])
+                    scales = np.concatenate([q[1] for q in quantized])
+                    codes.tofile(codes_path)
+                    scales.tofile(scales_path)
+                self._quantized = (codes, scales)
+            else:
+                bits_path = os.path.join(self.path, BINARY_FILE)
+                if os.path.exists(bits_path):
+                    bits = np.fromfile(bits_path, dtype=np.uint8)
+                    bits = bits.reshape(shape[0], (shape[1] + 7) // 8)
+                else:
+                    bits = np.concatenate([quantize_binary(block) for block in blocks])
+                    bits.tofile(bits_path)
+                self._quantized = (bits,)
+        return self._quantized
+
+    def _approximate_scores(
+        self, quantized: Tuple[np.ndarray, ...], query_vector: np.ndarray
+    ) -> np.ndarray:
+        """Score the quantized embeddings against the query, ranked like cosine"""
+        scores = []
+        if self.quantization == Quantization.Int8:
+            codes, scales = quantized
+            for i in range(0, len(codes), QUANTIZED_BLOCK_SIZE):
+                block = codes[i : i + QUANTIZED_BLOCK_SIZE].astype(np.float32)
+                scores.append((block @ query_vector) * scales[i : i + len(block)])
+        else:
+            (bits,) = quantized
+            query_bits = quantize_binary(query_vector[None, :])
+            for i in range(0, len(bits), QUANTIZED_BLOCK_SIZE):
+                block = np.bitwise_xor(bits[i : i + QUANTIZED_BLOCK_SIZE], query_bits)
+                # Fewer differing bits is more similar
+                scores.append(-POPCOUNT[block].sum(axis=1, dtype=np.float32))
+        if not scores:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(scores)
+
+    def _get_hnsw_index(self, matrix: np.ndarray):
+        """The HNSW index over the embeddings, call with the lock held"""
+        if self._hnsw_index is None:
+            index = hnswlib.Index(space="ip", dim=self.embedding_dimension)
+            hnsw_path = os.path.join(self.path, HNSW_FILE)
+            if os.path.exists(hnsw_path):
+                index.load_index(hnsw_path, max_elements=len(matrix))
+            else:
+                index.init_index(max_elements=len(matrix), ef_construction=200, M=16)
+                index.add_items(matrix, np.arange(len(matrix)))
+                index.save_index(hnsw_path)
+            self._hnsw_index = index
+        return self._hnsw_index
+
+    def _filter_rows(self, metadata_filter: Dict[str, Any]) -> np.ndarray:
+        """The sorted rows matching the metadata filter, call with the lock held"""
+        rows = None
+        for key, value in metadata_filter.items():
+            if key not in self._metadata_index:
+                # An inverted index of the rows having each value of the key
+                index: Dict[Any, List[int]] = {}
+                for i, node in enumerate(self._nodes):
+                    node_value = node.metadata.get(key)
+                    if isinstance(node_value, (str, int, float, bool)):
+                        index.setdefault(node_value, []).append(i)
+                self._metadata_index[key] = {
+                    node_value: np.array(node_rows)
+                    for node_value, node_rows in index.items()
+                }
+
+            values = value if isinstance(value, list) else [value]
+            key_rows = [self._metadata_index[key].get(v) for v in values]
+            key_rows = np.unique(
+                np.concatenate([r for r in key_rows if r is not None] + [NO_ROWS])
+            )
+            rows = key_rows if rows is None else np.intersect1d(rows, key_rows)
+        return rows
+
+    def query(
+        self,
+        query: VectorStoreQuery,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> VectorStoreQueryResult:
+        """
+        Find the top k nodes most similar to the query, optionally only among those
+        matching `metadata_filter`, see combine_filters
+        """
+        query_vector = np.asarray(query.query_embedding, dtype=np.float32)
+        query_vector /= max(np.linalg.norm(query_vector), 1e-12)
+        k = query.similarity_top_k
+        metadata_filter = combine_filters(query.filters, metadata_filter)
+
+        with self._lock:
+            nodes = self._nodes
+            if not nodes:
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+            matrix = self._get_matrix()
+            if self.hnsw and not metadata_filter and len(nodes) > k:
+                index = self._get_hnsw_index(matrix)
+                index.set_ef(max(k * 4, 64))
+                labels, distances = index.knn_query(query_vector, k=k)
+                top = labels[0].tolist()
+                similarities = (1 - distances[0]).tolist()
+                return VectorStoreQueryResult(
+                    nodes=[nodes[i] for i in top],
+                    similarities=similarities,
+                    ids=[nodes[i].node_id for i in top],
+                )
+
+            quantized = self._get_quantized(matrix) if self.quantization else None
+            # Only the rows matching the filter are scored
+            rows = self._filter_rows(metadata_filter) if metadata_filter else None
+
+        if quantized is None:
+            vectors = matrix if rows is None else matrix[rows]
+            scores = np.asarray(vectors) @ query_vector
+            top = top_k_indices(scores, k)
+            similarities = scores[top]
+            if rows is not None:
+                top = rows[top]
+        else:
+            # Select candidates with the quantized codes, then rescore them exactly
+            if rows is not None:
+                quantized = tuple(codes[rows] for codes in quantized)
+            approximate_scores = self._approximate_scores(quantized, query_vector)
+            candidates = top_k_indices(approximate_scores, k * self.rescore_factor)
+            if rows is not None:
+                candidates = rows[candidates]
+            candidates = np.sort(candidates)
+            exact_scores = np.asarray(matrix[candidates]) @ query_vector
+            rescored = top_k_indices(exact_scores, k)
+            top = candidates[rescored]
+            similarities = exact_scores[rescored]
+
+        return VectorStoreQueryResult(
+            nodes=[nodes[i] for i in top],
+            similarities=similarities.tolist(),
+            ids=[nodes[i].node_id for i in top],
+        )
+
+
+class ProjectedAstraDBVectorStore(AstraDBVectorStore):
+    """
+    An AstraDBVectorStore that only fetches the text and the given metadata fields of
+    the matches, rather than whole documents, and pushes metadata filters down to the
+    vector search (see combine_filters)
+    """
+
+    def __init__(self, *, metadata_fields: List[str], **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.metadata_fields = metadata_fields
+        self._fields = ["content"] + [f"metadata.{field}" for field in metadata_fields]
+
+    def query(
+        self,
+        query: VectorStoreQuery,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            # MMR needs the full documents, including their vectors
+            if metadata_filter:
+                raise NotImplementedError(f"metadata_filter with {query.mode} queries")
+            return super().query(query, **kwargs)
+
+        matches = self._astra_db_collection.vector_find(
+            vector=query.query_embedding,
+            limit=query.similarity_top_k,
+            filter=to_astra_filter(combine_filters(query.filters, metadata_filter)),
+            fields=self._fields,
+        )
+
+        nodes = []
+        for match in matches:
+            metadata = match.get("metadata", {})
+            nodes.append(
+                TextNode(
+                    id_=match["_id"],
+                    text=match["content"],
+                    metadata={
+                        field: metadata[field]
+                        for field in self.metadata_fields
+                        if field in metadata
+                    },
+                )
+            )
+
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=[match["$similarity"] for match in matches],
+            ids=[match["_id"] for match in matches],
+        )
+
+    def delete_nodes(self, node_ids: List[str]) -> None:
+        for start in range(0, len(node_ids), ASTRA_MAX_IN_VALUES):
+            batch = node_ids[start : start + ASTRA_MAX_IN_VALUES]
+            # Each request only deletes some of the matches, and says if there are more
+            while True:
+                response = self._astra_db_collection.delete_many(
+                    filter={"_id": {"$in": batch}}
+                )
+                if not response.get("status", {}).get("moreData"):
+                    break
+
+    def update_metadata(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        """Update the metadata of nodes by id, leaving their embeddings as they are"""
+        for node_id, metadata in updates.items():
+            self._astra_db_collection.update_one(
+                filter={"_id": node_id},
+                update={"$set": {f"metadata.{k}": v for k, v in metadata.items()}},
+            )
+
+
+def versioned_path(config: Config, version: Optional[str]) -> str:
+    """The folder of a version of the local vector store, see collection_alias.py"""
+    if version is None:
+        return config.local_vector_store_path
+    return os.path.join(config.local_vector_store_path, VERSIONS_DIR, version)
+
+
+def versioned_collection_name(config: Config, version: Optional[str]) -> str:
+    """The Astra DB collection of a version of the vector store"""
+    if version is None:
+        return config.astra_db_table_name
+    return f"{config.astra_db_table_name}_{version}"
+
+
+def build_vector_store(
+    config: Config,
+    embedding_dimension: Optional[int] = None,
+    version: Optional[str] = None,
+) -> VectorStore:
+    """
+    Create the vector store configured by `vector_store`, or the given version of it
+    when versioned_collections is set
+    """
+    if embedding_dimension is None:
+        embedding_dimension = get_embedding_dimension(config)
+
+    if config.vector_store == VectorStoreBackend.Local:
+        return LocalVectorStore(
+            path=versioned_path(config, version),
+            embedding_dimension=embedding_dimension,
+            hnsw=config.local_vector_store_hnsw,
+            quantization=config.local_vector_store_quantization,
+            rescore_factor=config.local_vector_store_rescore_factor,
+        )
+
+    return ProjectedAstraDBVectorStore(
+        metadata_fields=config.retrieval_metadata_fields,
+        token=config.astra_db_application_token,
+        api_endpoint=config.astra_db_api_endpoint,
+        collection_name=versioned_collection_name(config, version),
+        embedding_dimension=embedding_dimension,
+    )
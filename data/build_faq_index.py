@@ -0,0 +1,231 @@
+"""
+Build the FAQ index answering frequently asked questions without retrieval or
+generation (see chatbot_api/faq_index.py).
+
+FAQs are curated in a YAML review file (faq.yml by default), a list of entries with a
+"question", its "alternates" phrasings, the "personas" it is for (empty for every
+persona), its "answer" and whether the answer is "approved". Entries can be written by
+hand, or mined from historical questions and answered by the assistant:
+
+    # Add the questions asked at least 5 times, clustering similar phrasings
+    PYTHONPATH=. python data/build_faq_index.py mine --questions questions.txt
+    # Generate answers for new entries, and for entries whose docs have changed
+    PYTHONPATH=. python data/build_faq_index.py generate
+    # Review faq.yml, set "approved: true" on good answers, then build the index
+    PYTHONPATH=. python data/build_faq_index.py build
+
+Each generated answer records a fingerprint of the docs it was generated from. When
+the docs change, its entry is stale: run "generate" again to regenerate and review it.
+Stale entries are left out of the index unless built with --allow-stale, while answers
+written by hand are never stale. The running
+service picks up the rebuilt index at config.faq_index_path without a restart.
+"""
+import argparse
+import hashlib
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+import yaml
+from dotenv import load_dotenv
+
+from chatbot_api.faq_index import FaqEntry, save_faq_index
+from chatbot_api.ingestion import get_embedding_model
+from chatbot_api.normalize import canonical_question
+from chatbot_api.prompt_util import DEFAULT_PERSONA
+from pipeline.config import Config, load_config
+
+FAQ_FILE = "faq.yml"
+
+
+def get_docs_fingerprint(docs_path: str) -> str:
+    """A hash of every file in the docs folder, which changes when the docs do"""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(docs_path):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, docs_path).encode())
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def is_stale(entry: Dict[str, Any], fingerprint: str) -> bool:
+    """Whether the entry's answer was generated from different docs"""
+    generated_from = entry.get("docs_fingerprint")
+    return bool(generated_from) and generated_from != fingerprint
+
+
+def load_faq_file(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return yaml.safe_load(f) or []
+
+
+def save_faq_file(path: str, entries: List[Dict[str, Any]]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(entries, f, sort_keys=False, allow_unicode=True, width=88)
+
+
+def cluster_questions(
+    questions: List[str], vectors: np.ndarray, threshold: float
+) -> List[List[int]]:
+    """
+    Greedily group questions with a cosine similarity of at least threshold to the
+    first question of a group, most frequent questions first
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.maximum(norms, 1e-12)
+    clusters: List[List[int]] = []
+    assigned = np.zeros(len(questions), dtype=bool)
+    for i in range(len(questions)):
+        if assigned[i]:
+            continue
+        members = np.flatnonzero(~assigned & (vectors @ vectors[i] >= threshold))
+        assigned[members] = True
+        clusters.append(members.tolist())
+    return clusters
+
+
+def mine(args: argparse.Namespace, config: Config) -> None:
+    """Add the most frequently asked questions to the review file"""
+    with open(args.questions, encoding="utf-8") as f:
+        asked = [" ".join(line.split()) for line in f if line.strip()]
+
+    # Count repeats of the same canonical question first, so that only distinct
+    # questions are embedded, keeping the first phrasing of each
+    counts: Dict[str, int] = {}
+    phrasing: Dict[str, str] = {}
+    for question in asked:
+        key = canonical_question(question)
+        counts[key] = counts.get(key, 0) + 1
+        phrasing.setdefault(key, question)
+    questions = [phrasing[key] for key in sorted(counts, key=counts.get, reverse=True)]
+
+    embed_model, _ = get_embedding_model(config)
+    entries = load_faq_file(args.faq)
+    known = [
+        question
+        for entry in entries
+        for question in [entry["question"]] + (entry.get("alternates") or [])
+    ]
+    vectors = np.array(
+        embed_model.get_text_embedding_batch(known + questions), dtype=np.float32
+    )
+
+    # Clusters with a known question are already covered by an entry
+    added = 0
+    for cluster in cluster_questions(known + questions, vectors, args.threshold):
+        if cluster[0] < len(known):
+            continue
+        phrasings = [questions[i - len(known)] for i in cluster]
+        count = sum(counts[canonical_question(question)] for question in phrasings)
+        if count < args.min_count:
+            continue
+        entries.append(
+            {
+                "question": phrasings[0],
+                "alternates": phrasings[1 : args.max_alternates + 1],
+                "personas": [],
+                "answer": "",
+                "approved": False,
+                "count": count,
+                "docs_fingerprint": "",
+            }
+        )
+        added += 1
+
+    save_faq_file(args.faq, entries)
+    print(f"Added {added} questions to {args.faq} for review")
+
+
+def generate(args: argparse.Namespace, config: Config) -> None:
+    """Generate answers for new entries and for entries whose docs have changed"""
+    from chatbot_api.assistant import AssistantBison
+
+    # Answers come from retrieval and generation, never from a previous FAQ index
+    config = config.model_copy(update={"faq_index_path": None})
+    assistant = AssistantBison(
+        config=config,
+        max_tokens_response=1024,
+        company=config.company,
+        custom_rules=config.custom_rules,
+    )
+
+    fingerprint = get_docs_fingerprint(args.docs)
+    entries = load_faq_file(args.faq)
+    generated = 0
+    for entry in entries:
+        if entry.get("answer") and not is_stale(entry, fingerprint):
+            continue
+        persona = (entry.get("personas") or [DEFAULT_PERSONA])[0]
+        bot_response, _, _ = assistant.get_response(entry["question"], persona)
+        entry["answer"] = "".join(bot_response.response_gen).strip()
+        entry["approved"] = False
+        entry["docs_fingerprint"] = fingerprint
+        generated += 1
+        print(f"Generated an answer to: {entry['question']}")
+
+    save_faq_file(args.faq, entries)
+    print(f"Generated {generated} answers in {args.faq}, ready for review")
+
+
+def build(args: argparse.Namespace, config: Config) -> None:
+    """Build the FAQ index from the approved entries"""
+    fingerprint = get_docs_fingerprint(args.docs)
+    entries = []
+    for entry in load_faq_file(args.faq):
+        if not entry.get("approved") or not entry.get("answer"):
+            continue
+        if is_stale(entry, fingerprint) and not args.allow_stale:
+            print(f"Skipping stale answer to: {entry['question']}")
+            continue
+        entries.append(
+            FaqEntry(
+                question=entry["question"],
+                answer=entry["answer"],
+                alternates=entry.get("alternates") or [],
+                personas=entry.get("personas") or [],
+            )
+        )
+
+    if not entries:
+        print(f"No approved, up to date answers in {args.faq}, no FAQs will be served")
+    embed_model, model_name = get_embedding_model(config)
+    save_faq_index(args.output, entries, embed_model, model_name)
+    print(f"Built the FAQ index {args.output} with {len(entries)} entries")
+
+
+if __name__ == "__main__":
+    load_dotenv(".env")
+    config = load_config("config.yml")
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--faq", default=FAQ_FILE, help="The YAML review file")
+    parser.add_argument("--docs", default="output", help="The scraped docs folder")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    mine_parser = subparsers.add_parser("mine", help=mine.__doc__)
+    mine_parser.add_argument(
+        "--questions", required=True, help="A file of asked questions, one per line"
+    )
+    mine_parser.add_argument("--min-count", type=int, default=5)
+    mine_parser.add_argument("--max-alternates", type=int, default=5)
+    mine_parser.add_argument(
+        "--threshold", type=float, default=config.faq_similarity_threshold
+    )
+
+    subparsers.add_parser("generate", help=generate.__doc__)
+
+    build_parser = subparsers.add_parser("build", help=build.__doc__)
+    build_parser.add_argument("--output", default=config.faq_index_path or "faq_index")
+    build_parser.add_argument(
+        "--allow-stale",
+        action="store_true",
+        help="Include approved answers generated from previous docs",
+    )
+    args = parser.parse_args()
+
+    {"mine": mine, "generate": generate, "build": build}[args.command](args, config)
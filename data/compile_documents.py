@@ -1,4 +1,7 @@
 # Add documents to the vectorstore, which is on the database, through an embeddings model
+import os
+import time
+
 from dotenv import load_dotenv
 from langchain.embeddings import OpenAIEmbeddings, VertexAIEmbeddings
 from llama_index import (
@@ -9,37 +12,42 @@ from llama_index import (
 )
 from llama_index.embeddings import LangchainEmbedding
 from llama_index.node_parser import SimpleNodeParser
-from llama_index.vector_stores import AstraDBVectorStore
 
-from integrations.google import init_gcp, GECKO_EMB_DIM
-from integrations.openai import OPENAI_EMB_DIM
+from chatbot_api.collection_alias import new_version
+from chatbot_api.crawl_scrape_docs import load_page_records
+from chatbot_api.dedup import dedup_nodes
+from chatbot_api.reindex import publish_version
+from chatbot_api.vector_store import (
+    LocalVectorStore,
+    build_vector_store,
+    read_manifest,
+    write_manifest,
+)
+from integrations.google import init_gcp
 from pipeline.config import LLMProvider, load_config
 
 dotenv_path = ".env"
 load_dotenv(dotenv_path)
 config = load_config("config.yml")
 
+CHUNK_SIZE = 250
+CHUNK_OVERLAP = 125
+
 # Provider for LLM
 if config.llm_provider == LLMProvider.OpenAI:
-    embedding_model = LangchainEmbedding(
-        OpenAIEmbeddings(model=config.openai_embeddings_model)
-    )
+    embeddings_model_name = config.openai_embeddings_model
+    embedding_model = LangchainEmbedding(OpenAIEmbeddings(model=embeddings_model_name))
 else:
     init_gcp(config)
+    embeddings_model_name = config.google_embeddings_model
     embedding_model = LangchainEmbedding(
-        VertexAIEmbeddings(model_name=config.google_embeddings_model)
+        VertexAIEmbeddings(model_name=embeddings_model_name)
     )
 
-embedding_dimension = (
-    OPENAI_EMB_DIM if config.llm_provider == LLMProvider.OpenAI else GECKO_EMB_DIM
-)
-
-vectorstore = AstraDBVectorStore(
-    token=config.astra_db_application_token,
-    api_endpoint=config.astra_db_api_endpoint,
-    collection_name=config.astra_db_table_name,
-    embedding_dimension=embedding_dimension,
-)
+# With versioned collections, documents are added to a new version of the vector
+# store, which is only served once it is published
+version = new_version() if config.versioned_collections else None
+vectorstore = build_vector_store(config, version=version)
 
 storage_context = StorageContext.from_defaults(vector_store=vectorstore)
 service_context = ServiceContext.from_defaults(
@@ -48,22 +56,68 @@ service_context = ServiceContext.from_defaults(
     node_parser=SimpleNodeParser.from_defaults(
         # According to https://genai.stackexchange.com/questions/317/does-the-length-of-a-token-give-llms-a-preference-for-words-of-certain-lengths
         # tokens are ~4 chars on average, so estimating 1,000 char chunk_size & 500 char overlap as previously used
-        chunk_size=250,
-        chunk_overlap=125,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
     ),
 )
 
 
 # Perform embedding and add to vectorstore
-def add_documents(folder_path):
-    documents = SimpleDirectoryReader(folder_path).load_data()
-    VectorStoreIndex.from_documents(
-        documents=documents,
+def add_documents(folder_path, metadata=None):
+    """
+    Embed the documents in folder_path into the vector store, tagged with any
+    metadata given, such as {"product": "astra"}, to filter retrieval on
+    """
+    # Scraped pages are JSON lines of sections, with their URL, title and section
+    # kept as metadata, while any other files are read as they are
+    documents = []
+    other_files = []
+    for name in sorted(os.listdir(folder_path)):
+        path = os.path.join(folder_path, name)
+        if name.endswith(".jsonl"):
+            documents.extend(load_page_records(path))
+        elif os.path.isfile(path):
+            other_files.append(path)
+    if other_files:
+        documents.extend(SimpleDirectoryReader(input_files=other_files).load_data())
+
+    for document in documents:
+        document.metadata.update(metadata or {})
+        # Filter tags aren't part of the text to embed or to give to the LLM
+        document.excluded_embed_metadata_keys.extend(metadata or {})
+        document.excluded_llm_metadata_keys.extend(metadata or {})
+
+    nodes = service_context.node_parser.get_nodes_from_documents(
+        documents, show_progress=True
+    )
+    chunks = len(nodes)
+    # Boilerplate repeated across pages is only embedded and stored once
+    if config.chunk_dedup_threshold is not None:
+        nodes = dedup_nodes(nodes, threshold=config.chunk_dedup_threshold)
+        print(f"Dropped {chunks - len(nodes)} of {chunks} chunks as near-duplicates")
+
+    VectorStoreIndex(
+        nodes,
         storage_context=storage_context,
         service_context=service_context,
         show_progress=True,
     )
 
+    # Record what the local vector store was built from in its manifest
+    if isinstance(vectorstore, LocalVectorStore):
+        manifest = read_manifest(vectorstore.path)
+        manifest.update(
+            embeddings_model=embeddings_model_name,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            documents=manifest.get("documents", 0) + len(documents),
+            duplicate_chunks=manifest.get("duplicate_chunks", 0) + chunks - len(nodes),
+            updated_at=time.time(),
+        )
+        write_manifest(vectorstore.path, manifest)
+
 
 if __name__ == "__main__":
     add_documents("output")
+    if version is not None:
+        publish_version(config, version, vectorstore, service_context)
@@ -1,18 +1,145 @@
-import os
+"""
+Crawl the docs sites in doc_sites and the pages in doc_pages, several sites at once.
+
+By default the sections of each site's pages are written to a JSON lines file in
+output, to be added to the vector store by data/compile_documents.py. With --ingest
+they are instead chunked, embedded and upserted as they are crawled, checkpointing
+progress so that an interrupted run resumes where it stopped (see
+chatbot_api/ingestion.py). With --loop, sites are crawled again as their pages become
+due for a refresh.
 
-from urllib.parse import urlparse
+With versioned_collections, each pass of --ingest crawls the sites into a new version
+of the vector store instead, which is published once complete as by
+data/compile_documents.py, so the version being served is never written to.
+
+    PYTHONPATH=. python data/scrape_site.py
+    PYTHONPATH=. python data/scrape_site.py --ingest --loop
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
+from llama_index import ServiceContext
+from llama_index.node_parser import SimpleNodeParser
 
-from chatbot_api.crawl_scrape_docs import crawl_website_parallel
+from chatbot_api.collection_alias import new_version
+from chatbot_api.crawl_scrape_docs import crawl_website_parallel, output_file_name
+from chatbot_api.ingestion import (
+    build_ingest_pipeline,
+    get_doc_sites,
+    get_embedding_model,
+)
+from chatbot_api.reindex import publish_version
+from chatbot_api.vector_store import build_vector_store
 from pipeline.config import load_config
 
-load_dotenv(".env")
-config = load_config("config.yml")
+OUTPUT_DIR = "output"
+
+# Matches the chunking in data/compile_documents.py
+CHUNK_SIZE = 250
+CHUNK_OVERLAP = 125
+
+
+def scrape(config, sites):
+    """Write the sections of each site's pages to a file of its own"""
+    with ThreadPoolExecutor(max_workers=config.ingest_site_concurrency) as executor:
+        futures = [
+            executor.submit(
+                crawl_website_parallel,
+                site.url,
+                os.path.join(OUTPUT_DIR, output_file_name(site.url)),
+                depth=site.depth,
+                max_workers=site.concurrency,
+            )
+            for site in sites
+        ]
+    for future in futures:
+        future.result()
+
+
+def print_stats(stats):
+    print(
+        f"Fetched {stats.pages_fetched} pages ({stats.pages_unchanged} unchanged, "
+        f"{len(stats.failed_urls)} failed), ingested {stats.chunks} chunks "
+        f"({stats.duplicate_chunks} duplicates dropped)"
+    )
+
+
+def ingest_version(config, sites, embed_model, node_parser):
+    """Crawl the sites into a new version of the vector store, then publish it"""
+    # The version being built is recorded, so that an interrupted run resumes it
+    version_path = config.ingest_checkpoint_path + ".version"
+    if os.path.exists(version_path):
+        with open(version_path) as f:
+            version = f.read().strip()
+    else:
+        version = new_version()
+        with open(version_path, "w") as f:
+            f.write(version)
+
+    vector_store = build_vector_store(config, version=version)
+    checkpoint_path = f"{config.ingest_checkpoint_path}.{version}"
+    pipeline = build_ingest_pipeline(
+        config, vector_store, embed_model, node_parser, checkpoint_path
+    )
+    print_stats(pipeline.run(sites))
+
+    service_context = ServiceContext.from_defaults(
+        llm=None, embed_model=embed_model, node_parser=node_parser
+    )
+    try:
+        publish_version(config, version, vector_store, service_context)
+    except ValueError as e:
+        print(e)
+    # Published or rejected, the next pass starts a new version
+    os.remove(version_path)
+    pipeline.checkpoint.close()
+    os.remove(checkpoint_path)
+
+
+def ingest(config, sites, loop=False):
+    """Crawl the sites straight into the vector store, or into new versions of it"""
+    embed_model, _ = get_embedding_model(config)
+    node_parser = SimpleNodeParser.from_defaults(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    )
+    pipeline = None
+    if not config.versioned_collections:
+        pipeline = build_ingest_pipeline(
+            config, build_vector_store(config), embed_model, node_parser
+        )
+
+    refresh_hours = [s.refresh_hours for s in sites if s.refresh_hours is not None]
+    while True:
+        if pipeline is None:
+            ingest_version(config, sites, embed_model, node_parser)
+        else:
+            print_stats(pipeline.run(sites))
+        if not loop or not refresh_hours:
+            break
+        time.sleep(min(refresh_hours) * 3600)
+
 
-# Astra docs
-for website in config.doc_pages:
-    parsed_website = urlparse(website)
-    basename_website = os.path.basename(parsed_website.path)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--ingest",
+        action="store_true",
+        help="Chunk, embed and upsert the pages as they are crawled",
+    )
+    parser.add_argument(
+        "--loop",
+        action="store_true",
+        help="With --ingest, keep crawling the sites as their pages are due",
+    )
+    args = parser.parse_args()
 
-    crawl_website_parallel(website, os.path.join("output", f"{basename_website}.txt"), recursive=False)
+    load_dotenv(".env")
+    config = load_config("config.yml")
+    sites = get_doc_sites(config)
+    if args.ingest:
+        ingest(config, sites, loop=args.loop)
+    else:
+        scrape(config, sites)
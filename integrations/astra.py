@@ -1,8 +1,10 @@
 from typing import Any, Dict
 
+from chatbot_api.persona_router import PERSONA_RULES_PATH, get_persona_router
 
-def get_persona(contact: Dict[str, Any]) -> str:
-    """Given information about the user, choose a persona and associated prompt"""
-    # TODO: Only a single prompt here, extend as needed!
 
-    return "default"
+def get_persona(contact: Dict[str, Any], rules_path: str = PERSONA_RULES_PATH) -> str:
+    """Given information about the user, choose a persona and associated prompt"""
+    # NOTE: Uses the default persona if there is no rules file,
+    #       see persona_rules.yml.example
+    return get_persona_router(rules_path).get_persona(contact)
@@ -0,0 +1,162 @@
+"""
+A cache of contact profiles fetched from a support platform's API, so that repeat
+messages from a contact don't each wait on an API round trip.
+
+Contacts are fresh for `ttl` seconds. For a further `stale_ttl` seconds the cached
+profile is still returned immediately, while it is refreshed in the background
+(stale-while-revalidate). Contacts that don't exist are cached for `negative_ttl`
+seconds, and other errors are never cached. At most `max_entries` contacts are kept,
+evicting the least recently used.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from pipeline.config import Config
+from pipeline.metrics import metrics
+
+# Fetches a contact, returning its JSON and the HTTP status code of the response
+ContactFetcher = Callable[[str], Tuple[Dict[str, Any], int]]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CachedContact:
+    contact: Dict[str, Any]
+    found: bool
+    fetched_at: float
+
+
+class ContactCache:
+    """A thread-safe TTL and LRU cache of contacts, keyed on contact id"""
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float = 300.0,
+        stale_ttl: float = 3600.0,
+        negative_ttl: float = 60.0,
+        max_entries: int = 10000,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._contacts: "OrderedDict[str, _CachedContact]" = OrderedDict()
+        # Fetches in progress, shared by concurrent requests for the same contact
+        self._fetches: Dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._hits = 0
+        self._requests = 0
+
+    def __len__(self) -> int:
+        return len(self._contacts)
+
+    @property
+    def hit_rate(self) -> float:
+        return self._hits / self._requests if self._requests else 0.0
+
+    def get(self, contact_id: str, fetch: ContactFetcher) -> Dict[str, Any]:
+        """Return the contact, fetching it with `fetch` unless it is cached"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._contacts.get(contact_id)
+            if cached is not None:
+                self._contacts.move_to_end(contact_id)
+                age = now - cached.fetched_at
+                if not cached.found:
+                    result = "negative_hit" if age < self.negative_ttl else "miss"
+                elif age < self.ttl:
+                    result = "hit"
+                elif age < self.ttl + self.stale_ttl:
+                    result = "stale_hit"
+                else:
+                    result = "miss"
+            else:
+                result = "miss"
+
+            self._requests += 1
+            if result != "miss":
+                self._hits += 1
+            fetch_future = None
+            should_fetch = False
+            if result in ("miss", "stale_hit"):
+                fetch_future = self._fetches.get(contact_id)
+                if fetch_future is None:
+                    fetch_future = Future()
+                    self._fetches[contact_id] = fetch_future
+                    should_fetch = True
+
+        metrics.inc("contact_cache_requests_total", cache=self.name, result=result)
+        metrics.set("contact_cache_hit_rate", self.hit_rate, cache=self.name)
+        metrics.set("contact_cache_size", len(self._contacts), cache=self.name)
+
+        if result != "miss":
+            if should_fetch:
+                # Serve the stale contact now and refresh it for later requests
+                self._executor.submit(self._fetch, contact_id, fetch, fetch_future)
+            return cached.contact
+
+        # Missing contacts are fetched in this thread, or by the concurrent request
+        # already fetching them
+        if should_fetch:
+            self._fetch(contact_id, fetch, fetch_future)
+        return fetch_future.result()
+
+    def _fetch(self, contact_id: str, fetch: ContactFetcher, future: Future) -> None:
+        try:
+            contact, status_code = fetch(contact_id)
+        except BaseException as e:
+            logger.error(f"Unable to fetch contact {contact_id}: {e}")
+            with self._lock:
+                self._fetches.pop(contact_id, None)
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            # Only cache contacts that exist or don't, not errors such as rate limits
+            if status_code < 400 or status_code == 404:
+                self._contacts[contact_id] = _CachedContact(
+                    contact, status_code != 404, time.monotonic()
+                )
+                self._contacts.move_to_end(contact_id)
+                while len(self._contacts) > self.max_entries:
+                    self._contacts.popitem(last=False)
+            self._fetches.pop(contact_id, None)
+        future.set_result(contact)
+
+    def invalidate(self, contact_id: str) -> None:
+        """Forget a contact, for example when it is known to have changed"""
+        with self._lock:
+            self._contacts.pop(contact_id, None)
+
+
+_caches: Dict[Tuple[str, str], ContactCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_contact_cache(
+    name: str, api_url: str, config: Config
+) -> Optional[ContactCache]:
+    """The shared contact cache for an API, or None if caching is disabled"""
+    if not config.contact_cache:
+        return None
+
+    with _caches_lock:
+        if (name, api_url) not in _caches:
+            _caches[(name, api_url)] = ContactCache(
+                name,
+                ttl=config.contact_cache_ttl_seconds,
+                stale_ttl=config.contact_cache_stale_seconds,
+                negative_ttl=config.contact_cache_negative_ttl_seconds,
+                max_entries=config.contact_cache_max_entries,
+            )
+        return _caches[(name, api_url)]
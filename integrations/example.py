@@ -29,6 +29,7 @@ class ExampleResponseDecider(ExampleMixin, ResponseDecider):
         self,
         request_body: Mapping[str, Any],
         request_headers: Mapping[str, str],
+        raw_body: bytes = b"",
     ) -> ResponseDecision:
         assert (
             "question" in request_body
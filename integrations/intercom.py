@@ -1,12 +1,14 @@
 import hashlib
 import hmac
-import re
-import json
+import threading
 import bugsnag
 import requests
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from chatbot_api.normalize import html_to_text
+from chatbot_api.progressive import remaining_text, split_on_boundaries
 from integrations.astra import get_persona
+from integrations.contact_cache import get_contact_cache
 from pipeline import (
     BaseIntegration,
     ResponseActor,
@@ -15,7 +17,9 @@ from pipeline import (
     UserContext,
     UserContextCreator,
 )
-from typing import Any, Dict, List, Optional, Mapping, Union
+from pipeline.config import RateLimitScope
+from pipeline.idempotency import has_shared_idempotency
+from typing import Any, Dict, Iterator, List, Optional, Mapping, Tuple, Union
 
 # Pulled from https://developers.intercom.com/docs/references/rest-api/api.intercom.io/Conversations/conversation/
 DEFAULT_ALLOWED_DELIVERED_AS = [
@@ -27,26 +31,31 @@ DEFAULT_ALLOWED_DELIVERED_AS = [
 ]
 
 
-# Validate the webhook actually comes from Intercom servers
-def validate_signature(
-    header: Mapping[str, str], body: Mapping[str, Any], secret: str
-) -> bool:
-    # Get the signature from the payload
-    signature_header = header["X-Hub-Signature"]
-    sha_name, signature = signature_header.split("=")
-    if sha_name != "sha1":
-        print("ERROR: X-Hub-Signature in payload headers was not sha1=****")
-        return False
-    # Convert the dictionary to a JSON string
-    data_str = json.dumps(body)
-    data_bytes = data_str.encode("utf-8")
+# The signature headers Intercom may sign webhooks with, and their digest, strongest
+# first
+SIGNATURE_HEADERS = [
+    ("X-Hub-Signature-256", "sha256", hashlib.sha256),
+    ("X-Hub-Signature", "sha256", hashlib.sha256),
+    ("X-Hub-Signature", "sha1", hashlib.sha1),
+]
+
 
-    local_signature = hmac.new(
-        secret.encode("utf-8"), msg=data_bytes, digestmod=hashlib.sha1
-    )
+# Validate the webhook actually comes from Intercom servers, by checking the signature
+# of the raw request body, exactly as it was sent
+def validate_signature(header: Mapping[str, str], body: bytes, secret: str) -> bool:
+    for header_name, sha_name, digestmod in SIGNATURE_HEADERS:
+        signature_header = header.get(header_name)
+        if not signature_header or not signature_header.startswith(f"{sha_name}="):
+            continue
+        signature = signature_header[len(sha_name) + 1 :]
+        local_signature = hmac.new(
+            secret.encode("utf-8"), msg=body, digestmod=digestmod
+        )
+        # See if they match
+        return hmac.compare_digest(local_signature.hexdigest(), signature)
 
-    # See if they match
-    return hmac.compare_digest(local_signature.hexdigest(), signature)
+    print("ERROR: No X-Hub-Signature of sha1=**** or sha256=**** in payload headers")
+    return False
 
 
 class IntercomIntegrationMixin(BaseIntegration):
@@ -54,9 +63,17 @@ class IntercomIntegrationMixin(BaseIntegration):
 
     # Get an Intercom contact/lead using the Intercom UUID
     def get_intercom_contact_by_id(self, _id: Union[int, str]) -> Dict[str, Any]:
+        cache = get_contact_cache("intercom", self.config.intercom_api_url, self.config)
+        if cache is None:
+            return self.fetch_intercom_contact(str(_id))[0]
+        return cache.get(str(_id), self.fetch_intercom_contact)
+
+    def fetch_intercom_contact(self, _id: str) -> Tuple[Dict[str, Any], int]:
         headers = {"Authorization": f"Bearer {self.config.intercom_token}"}
-        res = requests.get(f"https://api.intercom.io/contacts/{_id}", headers=headers)
-        return res.json()
+        res = requests.get(
+            f"{self.config.intercom_api_url}/contacts/{_id}", headers=headers
+        )
+        return res.json(), res.status_code
 
     def add_comment_to_intercom_conversation(
         self,
@@ -65,7 +82,7 @@ class IntercomIntegrationMixin(BaseIntegration):
     ) -> Dict[str, Any]:
         headers = {"Authorization": f"Bearer {self.config.intercom_token}"}
         res = requests.post(
-            f"https://api.intercom.io/conversations/{conversation_id}/reply",
+            f"{self.config.intercom_api_url}/conversations/{conversation_id}/reply",
             headers=headers,
             json={
                 "message_type": "note",
@@ -88,7 +105,7 @@ class IntercomIntegrationMixin(BaseIntegration):
             "body": message,
         }
         res = requests.post(
-            f"https://api.intercom.io/conversations/{conversation_id}/reply",
+            f"{self.config.intercom_api_url}/conversations/{conversation_id}/reply",
             json=payload,
             headers=headers,
         )
@@ -105,6 +122,9 @@ class IntercomConversationInfo:
     is_user: bool
     debug_mode: bool
     source_url: str
+    # The parts of the reply sent while it was streamed, and whether all were sent
+    sent_parts: List[str] = field(default_factory=list)
+    stream_finished: bool = False
 
 
 class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
@@ -116,6 +136,7 @@ class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
         self,
         request_body: Mapping[str, Any],
         request_headers: Mapping[str, str],
+        raw_body: bytes = b"",
         allowed_delivered_as: Optional[List[str]] = None,
     ) -> ResponseDecision:
         """Set properties based on each of the logical branches we can take"""
@@ -124,15 +145,20 @@ class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
 
         # Don't allow invalid signatures
         if not validate_signature(
-            request_headers, request_body, self.config.intercom_client_secret
+            request_headers, raw_body, self.config.intercom_client_secret
         ):
             return ResponseDecision(
                 should_return_early=True,
                 response_dict={"ok": False, "message": "Invalid signature."},
                 response_code=401,
             )
-        # Ignore repeat deliveries
-        if request_body["delivery_attempts"] > 1:
+        # Ignore repeat deliveries, unless they are deduplicated by an idempotency
+        # store shared by every process, which lets the retry of a failed delivery
+        # through. One in memory misses a redelivery to a restarted or other process.
+        if (
+            not has_shared_idempotency(self.config)
+            and request_body["delivery_attempts"] > 1
+        ):
             return ResponseDecision(
                 should_return_early=True,
                 response_dict={"ok": True, "message": "Already reported."},
@@ -196,7 +222,7 @@ class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
                 response_code=403,
             )
 
-        user_question = re.sub("<[^<]+?>", "", str(conversation_text))
+        user_question = html_to_text(str(conversation_text))
         # Reject request if empty question
         if not user_question:
             return ResponseDecision(
@@ -205,12 +231,32 @@ class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
                 response_code=400,
             )
 
+        # Deliveries are for the same message if they have the same part, or the same
+        # source for a new conversation
+        part_id = (
+            conv_item.get("id")
+            or hashlib.sha256(str(conversation_text).encode("utf-8")).hexdigest()
+        )
+
+        contact = self.get_intercom_contact_by_id(author["id"])
+        priority = 0
+        if self.config.job_queue_persona_priorities:
+            persona = get_persona(contact, self.config.persona_rules_path)
+            priority = self.config.job_queue_persona_priorities.get(persona, 0)
+
         # If we passed every check above, should proceed with querying the LLM
         return ResponseDecision(
             should_return_early=False,
+            idempotency_key=f"intercom:{data['item']['id']}:{part_id}",
+            priority=priority,
+            tenant=(
+                f"intercom:workspace:{request_body.get('app_id')}"
+                if self.config.tenant_rate_limit_scope == RateLimitScope.Workspace
+                else f"intercom:contact:{author['id']}"
+            ),
             conversation_info=IntercomConversationInfo(
                 conversation_id=data["item"]["id"],
-                contact=self.get_intercom_contact_by_id(author["id"]),
+                contact=contact,
                 user_question=user_question,
                 is_user=f"@{self.config.company_url}" in author["email"]
                 and self.config.company_url != "",
@@ -249,12 +295,63 @@ class IntercomUserContextCreator(IntercomIntegrationMixin, UserContextCreator):
 
         return UserContext(
             user_question=conv_info.user_question,
-            persona=get_persona(conv_info.contact),
+            persona=get_persona(
+                conv_info.contact, self.config.persona_rules_path
+            ),
             context_str=context_str,
+            conversation_id=conversation_id,
         )
 
 
 class IntercomResponseActor(IntercomIntegrationMixin, ResponseActor):
+    def streams_response(self, conv_info: IntercomConversationInfo) -> bool:
+        # Suggested responses are left for admins as a single note
+        return self.config.intercom_progressive_replies and conv_info.is_user
+
+    def stream_action(
+        self, conv_info: IntercomConversationInfo, tokens: Iterator[str]
+    ) -> None:
+        """
+        Reply with each part of the response as soon as it is generated, recording the
+        parts sent in conv_info
+        """
+        lock = threading.Lock()
+        replied = False
+
+        def send_thinking_message():
+            with lock:
+                if not replied:
+                    self.send_intercom_message(
+                        conv_info.conversation_id, self.config.intercom_thinking_message
+                    )
+
+        thinking_timer = None
+        if self.config.intercom_thinking_message:
+            thinking_timer = threading.Timer(
+                self.config.intercom_thinking_seconds, send_thinking_message
+            )
+            thinking_timer.daemon = True
+            thinking_timer.start()
+
+        try:
+            for part in split_on_boundaries(
+                tokens,
+                self.config.intercom_progressive_boundary,
+                self.config.intercom_progressive_interval_seconds,
+            ):
+                # Waits for a thinking message being sent, so that it comes first
+                with lock:
+                    replied = True
+                self.send_intercom_message(conv_info.conversation_id, part)
+                conv_info.sent_parts.append(part)
+            conv_info.stream_finished = True
+        finally:
+            if thinking_timer is not None:
+                thinking_timer.cancel()
+
+    def has_responded(self, conv_info: IntercomConversationInfo) -> bool:
+        return bool(conv_info.sent_parts)
+
     def take_action(
         self,
         conv_info: IntercomConversationInfo,
@@ -268,9 +365,16 @@ class IntercomResponseActor(IntercomIntegrationMixin, ResponseActor):
                 conv_info.conversation_id, "\nDocuments retrieved: " + responses_from_vs
             )
 
-        # Either comment or message based on whether its a current user
+        # Either comment or message based on whether its a current user. A message
+        # being sent in parts only needs the parts that weren't, if streaming failed
         if conv_info.is_user:
-            self.send_intercom_message(conv_info.conversation_id, text_response)
+            unsent = text_response
+            if self.streams_response(conv_info):
+                unsent = ""
+                if not conv_info.stream_finished:
+                    unsent = remaining_text(text_response, conv_info.sent_parts)
+            if unsent:
+                self.send_intercom_message(conv_info.conversation_id, unsent)
         else:
             self.add_comment_to_intercom_conversation(
                 conv_info.conversation_id,
@@ -1,5 +1,10 @@
 from .base_integration import BaseIntegration
-from .response_action import ResponseActor, take_all_actions
+from .response_action import (
+    ResponseActor,
+    any_action_responded,
+    stream_all_actions,
+    take_all_actions,
+)
 from .response_decision import (
     ResponseDecider,
     ResponseDecision,
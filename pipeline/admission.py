@@ -0,0 +1,182 @@
+"""
+Admission control of response generations, so that a burst of requests queues or is
+turned away instead of exhausting the LLM provider's rate limits and failing every
+request.
+
+At most `max_concurrent` generations run at once, if set. Up to `max_waiting` more wait
+their turn, each for up to `wait_timeout` seconds, and further requests are rejected
+straight away. Each tenant, such as an Intercom contact or workspace, can also be
+limited to a rate of requests by a token bucket.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .config import Config
+from .metrics import metrics
+
+
+class AdmissionRejected(Exception):
+    """A request was not admitted, and may be retried after `retry_after` seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request not admitted: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `burst` requests at once, refilled at `rate` requests per second"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token, returning 0 or how many seconds until one is available"""
+        # NOTE: Not thread-safe, the AdmissionController holds its lock
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class Admission:
+    """A running generation, which must be released once it is done"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        """Let another generation run. Only the first call has any effect."""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._controller._release()
+
+
+class AdmissionController:
+    """Limits the generations running at once, and the request rate of each tenant"""
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = 16,
+        max_waiting: int = 64,
+        wait_timeout: float = 10.0,
+        tenant_rate: Optional[float] = None,
+        tenant_burst: int = 5,
+        max_tenants: int = 10000,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self.max_tenants = max_tenants
+
+        self._lock = threading.Lock()
+        self._turn = threading.Condition(self._lock)
+        self._running = 0
+        self._waiting = 0
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+        metrics.inc("admission_rejections_total", reason=reason)
+        return AdmissionRejected(reason, retry_after)
+
+    def check_tenant(self, tenant: Optional[str]) -> None:
+        """Count a request against the rate limit of its tenant, if any"""
+        if tenant is None or self.tenant_rate is None:
+            return
+
+        with self._lock:
+            bucket = self._buckets.get(tenant)
+            if bucket is None:
+                bucket = TokenBucket(self.tenant_rate, self.tenant_burst)
+                self._buckets[tenant] = bucket
+                # Tenants idle for longest have refilled buckets, so are safe to drop
+                while len(self._buckets) > self.max_tenants:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(tenant)
+            retry_after = bucket.take()
+
+        if retry_after > 0:
+            raise self._reject("rate_limited", retry_after)
+
+    def _is_full(self) -> bool:
+        # NOTE: Must be called with the lock held
+        if self.max_concurrent is None:
+            return False
+        return self._running >= self.max_concurrent
+
+    def acquire(self) -> Admission:
+        """Wait for a generation to be admitted, or raise AdmissionRejected"""
+        start_time = time.monotonic()
+        with self._turn:
+            if self._is_full():
+                if self._waiting >= self.max_waiting:
+                    raise self._reject("queue_full", self.wait_timeout)
+
+                self._waiting += 1
+                metrics.set("admission_waiting", self._waiting)
+                try:
+                    admitted = self._turn.wait_for(
+                        lambda: not self._is_full(), self.wait_timeout
+                    )
+                finally:
+                    self._waiting -= 1
+                    metrics.set("admission_waiting", self._waiting)
+                if not admitted:
+                    raise self._reject("timeout", self.wait_timeout)
+
+            self._running += 1
+            metrics.set("admission_running", self._running)
+
+        metrics.observe("admission_wait_seconds", time.monotonic() - start_time)
+        return Admission(self)
+
+    def _release(self) -> None:
+        with self._turn:
+            self._running -= 1
+            metrics.set("admission_running", self._running)
+            self._turn.notify()
+
+
+def build_admission_controller(config: Config) -> Optional[AdmissionController]:
+    """The admission controller configured, or None if there are no limits"""
+    if (
+        config.max_concurrent_generations is None
+        and config.tenant_rate_limit_per_minute is None
+    ):
+        return None
+
+    return AdmissionController(
+        max_concurrent=config.max_concurrent_generations,
+        max_waiting=config.max_waiting_generations,
+        wait_timeout=config.admission_wait_seconds,
+        tenant_rate=(
+            config.tenant_rate_limit_per_minute / 60
+            if config.tenant_rate_limit_per_minute is not None
+            else None
+        ),
+        tenant_burst=config.tenant_rate_limit_burst,
+    )
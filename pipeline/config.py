@@ -1,6 +1,6 @@
 import os
 from enum import Enum
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, model_validator
 import yaml
@@ -27,17 +27,150 @@ class LLMProvider(str, Enum):
     Google = "google"
 
 
+class VectorStoreBackend(str, Enum):
+    Astra = "astra"
+    Local = "local"
+
+
+class Quantization(str, Enum):
+    Int8 = "int8"
+    Binary = "binary"
+
+
+class RateLimitScope(str, Enum):
+    Contact = "contact"
+    Workspace = "workspace"
+
+
+class ReplyBoundary(str, Enum):
+    Sentence = "sentence"
+    Paragraph = "paragraph"
+
+
+class ModelCost(BaseModel):
+    """The cost of a text generation model, in USD per 1000 tokens"""
+
+    prompt: float
+    completion: float
+
+
+class DocSite(BaseModel):
+    """A docs site to crawl and ingest, see chatbot_api/ingestion.py"""
+
+    url: str
+    # How many links away from url to crawl, 0 for only the page itself
+    depth: int = 0
+    # The pages of the site fetched at once
+    concurrency: int = 4
+    # Fetch pages again once they are this many hours old, or never if None
+    refresh_hours: Optional[float] = None
+
+
 class Config(BaseModel):
     """The allowed configuration options for this application"""
 
     # Base config options
     llm_provider: LLMProvider = LLMProvider.OpenAI
+    # A second text generation provider, used when the primary fails, is unhealthy
+    # or (with hedge_requests) is slower than usual to produce its first token
+    fallback_llm_provider: Optional[LLMProvider] = None
     company: str
     company_url: str = ""
     custom_rules: Optional[List[str]] = None
     doc_pages: List[str]
+    # Docs sites crawled by data/scrape_site.py, as well as the pages in doc_pages.
+    # ingest_site_concurrency sites are crawled at once, and with --ingest their
+    # progress is checkpointed to ingest_checkpoint_path, while chunks are embedded
+    # and upserted ingest_batch_size at a time.
+    doc_sites: List[DocSite] = []
+    ingest_site_concurrency: int = 4
+    ingest_checkpoint_path: str = "ingest_checkpoint.sqlite"
+    ingest_batch_size: int = 64
     mode: str = "Development"
 
+    # Share one retrieval and generation between concurrent requests asking the same
+    # question with the same persona. Coalesced requests receive the answer generated
+    # for the first request, including its user context, so only enable this when the
+    # prompts don't personalize answers.
+    coalesce_identical_questions: bool = False
+
+    # Rules used to route users to persona prompts, see persona_rules.yml.example
+    persona_rules_path: str = "persona_rules.yml"
+
+    # Per-conversation chat history. Older turns are summarized to stay within the
+    # token budget, and idle conversations are evicted. Set conversation_memory_path
+    # to a sqlite file to persist conversations beyond eviction and restarts.
+    conversation_memory: bool = True
+    conversation_memory_token_budget: int = 1024
+    conversation_memory_max_conversations: int = 1000
+    conversation_memory_idle_seconds: float = 3600.0
+    conversation_memory_path: Optional[str] = None
+
+    # Deduplication of webhook deliveries for the same message, which share the
+    # response to the first delivery instead of generating again. Responses are kept
+    # for idempotency_ttl_seconds, in memory unless idempotency_path is set to a
+    # sqlite file or idempotency_redis_url to a Redis-compatible server. Without
+    # either, Intercom's redeliveries are ignored outright, as they may reach another
+    # process or one restarted since the first delivery.
+    idempotency: bool = True
+    idempotency_ttl_seconds: float = 3600.0
+    # How long a response may be in flight before a redelivery responds again
+    idempotency_in_flight_seconds: float = 300.0
+    idempotency_max_entries: int = 10000
+    idempotency_path: Optional[str] = None
+    idempotency_redis_url: Optional[str] = None
+
+    # Acknowledge webhooks with a 202 as soon as they are validated, and generate and
+    # send the responses from a queue run by job_queue_workers threads. Responses are
+    # queued in memory unless job_queue_path is set to a sqlite file, which keeps them
+    # across restarts. Failed responses are retried up to job_queue_max_attempts
+    # times, after job_queue_retry_seconds doubling with each attempt.
+    async_responses: bool = False
+    job_queue_workers: int = 4
+    job_queue_path: Optional[str] = None
+    job_queue_max_attempts: int = 3
+    job_queue_retry_seconds: float = 5.0
+    # How long a response may run before it is assumed lost and run again
+    job_queue_lease_seconds: float = 600.0
+    # The priority of queued responses by the persona of the contact, higher first
+    job_queue_persona_priorities: Dict[str, int] = {}
+
+    # Admission control of response generations. At most max_concurrent_generations
+    # run at once, and up to max_waiting_generations more wait admission_wait_seconds
+    # for their turn before being rejected with a 429. Each tenant, an Intercom contact
+    # or workspace, can also be limited to tenant_rate_limit_per_minute requests, with
+    # bursts of up to tenant_rate_limit_burst.
+    max_concurrent_generations: Optional[int] = 16
+    max_waiting_generations: int = 64
+    admission_wait_seconds: float = 10.0
+    tenant_rate_limit_per_minute: Optional[float] = None
+    tenant_rate_limit_burst: int = 5
+    tenant_rate_limit_scope: RateLimitScope = RateLimitScope.Contact
+
+    # Token usage and estimated cost of each response, totalled by persona, integration
+    # and model. model_costs are in USD per 1000 tokens of each text generation model.
+    # Set usage_log_path to also log each response's usage, in a file rotated after
+    # usage_log_max_bytes keeping usage_log_backups old files.
+    model_costs: Dict[str, ModelCost] = {
+        "gpt-4": ModelCost(prompt=0.03, completion=0.06),
+        "gpt-3.5-turbo": ModelCost(prompt=0.0015, completion=0.002),
+    }
+    usage_log_path: Optional[str] = None
+    usage_log_max_bytes: int = 10_000_000
+    usage_log_backups: int = 5
+
+    # Health tracking of the LLM providers. A provider's circuit opens after
+    # circuit_breaker_failures consecutive failures, and it gets a trial request
+    # again after circuit_breaker_reset_seconds.
+    circuit_breaker_failures: int = 5
+    circuit_breaker_reset_seconds: float = 30.0
+    # Send the request to the fallback provider as well when no token has arrived
+    # from the primary after hedge_percentile of its recent times to first token
+    # (and at least hedge_min_delay seconds), keeping whichever stream starts first
+    hedge_requests: bool = False
+    hedge_percentile: float = 0.95
+    hedge_min_delay: float = 1.0
+
     # Determine which integrations will run
     response_decider_cls: List[str]  # TODO: Get a better name here
     user_context_creator_cls: List[str]
@@ -60,29 +193,124 @@ class Config(BaseModel):
     intercom_client_secret: Optional[str] = None
     intercom_include_response: bool = True
     intercom_include_context: bool = True
+    intercom_api_url: str = "https://api.intercom.io"
+    # Reply to users in parts as the response is generated, instead of once it is
+    # complete. Parts end on a sentence or paragraph boundary, and are sent at most
+    # every intercom_progressive_interval_seconds. If set, intercom_thinking_message
+    # is sent when no part was ready after intercom_thinking_seconds.
+    intercom_progressive_replies: bool = False
+    intercom_progressive_boundary: ReplyBoundary = ReplyBoundary.Paragraph
+    intercom_progressive_interval_seconds: float = 2.0
+    intercom_thinking_message: Optional[str] = None
+    intercom_thinking_seconds: float = 3.0
+
+    # Cache of the contacts fetched from Intercom. Contacts are fresh for
+    # contact_cache_ttl_seconds, then served for up to contact_cache_stale_seconds
+    # more while refreshed in the background. Contacts that don't exist are cached
+    # for contact_cache_negative_ttl_seconds.
+    contact_cache: bool = True
+    contact_cache_ttl_seconds: float = 300.0
+    contact_cache_stale_seconds: float = 3600.0
+    contact_cache_negative_ttl_seconds: float = 60.0
+    contact_cache_max_entries: int = 10000
 
     bugsnag_api_key: Optional[str] = None
 
     slack_webhook_url: Optional[str] = None
 
+    # The vector store holding the embedded documents. The local vector store is kept
+    # in local_vector_store_path, next to its ingestion manifest, and can optionally
+    # use an HNSW index (requires hnswlib) instead of exact search.
+    vector_store: VectorStoreBackend = VectorStoreBackend.Astra
+    local_vector_store_path: str = "vector_store"
+    local_vector_store_hnsw: bool = False
+    # Keep int8 (4x smaller) or binary (32x smaller) embeddings in memory for the
+    # local vector store's exact search, rescoring the top k * rescore_factor
+    # candidates with the full float32 embeddings
+    local_vector_store_quantization: Optional[Quantization] = None
+    local_vector_store_rescore_factor: int = 4
+
+    # Chunks ingested by data/compile_documents.py with a MinHash similarity of at
+    # least chunk_dedup_threshold to an earlier chunk are dropped, and the sources of
+    # both kept, see chatbot_api/dedup.py. None ingests every chunk.
+    chunk_dedup_threshold: Optional[float] = 0.9
+
+    # Ingest each re-index into a new version of the vector store, a new Astra DB
+    # collection or local folder, and only serve it once data/compile_documents.py
+    # has validated it and switched the collection alias to it. Running assistants
+    # check the alias every collection_alias_poll_seconds, and the newest
+    # collection_versions_kept versions are kept to roll back to.
+    versioned_collections: bool = False
+    collection_alias_poll_seconds: float = 30.0
+    collection_versions_kept: int = 2
+    # Labelled questions (see benchmarks/retrieval_benchmark.py) a new version must
+    # answer with a recall@reindex_k no more than reindex_max_recall_drop below the
+    # version being served
+    reindex_questions: Optional[str] = None
+    reindex_k: int = 4
+    reindex_max_recall_drop: float = 0.05
+
+    # Metadata filters applied to every retrieval, mapping a metadata key to a value
+    # or a list of accepted values, e.g. {"product": "astra", "version": ["6.8", "7"]}.
+    # persona_retrieval_filters adds filters per persona, to restrict each persona to
+    # its own set of docs. Filters are pushed down to the vector search.
+    retrieval_filters: Dict[str, Any] = {}
+    persona_retrieval_filters: Dict[str, Dict[str, Any]] = {}
+    # The metadata fields fetched with each retrieved chunk from Astra DB
+    retrieval_metadata_fields: List[str] = ["source", "title", "section"]
+    # List the sources cited by each response after it, see chatbot_api/citations.py
+    citations: bool = True
+
+    # Route each question to the retrieval it needs before searching: none for small
+    # talk and requests to rephrase the previous answer, retrieval_small_k documents
+    # for simple questions and retrieval_large_k for complex ones
+    adaptive_retrieval: bool = False
+    retrieval_small_k: int = 2
+    retrieval_large_k: int = 8
+
+    # The FAQ index built by data/build_faq_index.py. Questions whose embedding has
+    # a cosine similarity of at least faq_similarity_threshold to an FAQ are answered
+    # with its reviewed answer, skipping retrieval and generation
+    faq_index_path: Optional[str] = None
+    faq_similarity_threshold: float = 0.92
+
     # Credentials for Astra DB
-    astra_db_application_token: str
-    astra_db_api_endpoint: str
+    astra_db_application_token: Optional[str] = None
+    astra_db_api_endpoint: Optional[str] = None
     astra_db_table_name: str = "data"
 
     @model_validator(mode="after")
     def check_llm_creds(self):
-        if self.llm_provider == LLMProvider.OpenAI:
-            assert self.openai_api_key is not None, "openai_api_key must be included"
-        elif self.llm_provider == LLMProvider.Google:
+        llm_providers = [self.llm_provider]
+        if self.fallback_llm_provider is not None:
+            llm_providers.append(self.fallback_llm_provider)
+
+        for llm_provider in llm_providers:
+            if llm_provider == LLMProvider.OpenAI:
+                assert (
+                    self.openai_api_key is not None
+                ), "openai_api_key must be included"
+            elif llm_provider == LLMProvider.Google:
+                assert (
+                    self.google_credentials is not None
+                ), "google_credentials must be included"
+                assert (
+                    self.google_project_id is not None
+                ), "google_project_id must be included"
+            else:
+                raise ValueError(f"Unrecognized llm_provider {llm_provider}")
+
+        return self
+
+    @model_validator(mode="after")
+    def check_vector_store_creds(self):
+        if self.vector_store == VectorStoreBackend.Astra:
             assert (
-                self.google_credentials is not None
-            ), "google_credentials must be included"
+                self.astra_db_application_token is not None
+            ), "astra_db_application_token must be included"
             assert (
-                self.google_project_id is not None
-            ), "google_project_id must be included"
-        else:
-            raise ValueError(f"Unrecognized llm_provider {self.llm_provider}")
+                self.astra_db_api_endpoint is not None
+            ), "astra_db_api_endpoint must be included"
 
         return self
 
@@ -0,0 +1,19 @@
+"""
+JSON parsing of request bodies, using orjson when it is installed
+(`pip install orjson`), which parses bytes directly and several times faster than
+the standard library, and falling back to json otherwise.
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Parse a JSON document, raising ValueError if it is invalid"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
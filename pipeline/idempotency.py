@@ -0,0 +1,329 @@
+"""
+Idempotent handling of webhook deliveries. Webhooks can be delivered more than once,
+for example when the first delivery times out while its response is still streaming.
+Each delivery is keyed on the message it is for (see ResponseDecision.idempotency_key),
+and only the first delivery of a key generates a response. Duplicates share its
+in-flight stream when it is in the same process, or get its response once complete.
+
+Keys are kept for a bounded time in memory, or in sqlite or a Redis-compatible server
+to deduplicate across restarts and processes.
+"""
+import abc
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+from typing import Dict, Iterator, Optional, Tuple
+
+from chatbot_api.single_flight import TokenBroadcast
+from .config import Config
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyStatus(str, Enum):
+    InFlight = "in_flight"
+    Completed = "completed"
+
+
+@dataclass
+class IdempotencyRecord:
+    """The state of the response to a delivery"""
+
+    status: IdempotencyStatus
+    response: str = ""
+    created_at: float = field(default_factory=time.time)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data: str) -> "IdempotencyRecord":
+        record = json.loads(data)
+        record["status"] = IdempotencyStatus(record["status"])
+        return cls(**record)
+
+
+class IdempotencyBackend(metaclass=abc.ABCMeta):
+    """A store of records that expire after a time to live"""
+
+    @abc.abstractmethod
+    def add(self, key: str, record: IdempotencyRecord, ttl: float) -> bool:
+        """Atomically store the record unless the key exists, returning if it did"""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[IdempotencyRecord]:
+        pass
+
+    @abc.abstractmethod
+    def put(self, key: str, record: IdempotencyRecord, ttl: float) -> None:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+
+class MemoryIdempotencyBackend(IdempotencyBackend):
+    """Keeps at most `max_entries` records in memory, evicting the oldest first"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._records: "OrderedDict[str, Tuple[float, IdempotencyRecord]]" = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _get(self, key: str, now: float) -> Optional[IdempotencyRecord]:
+        # NOTE: Must be called with the lock held
+        entry = self._records.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._records[key]
+            return None
+        return entry[1]
+
+    def _put(self, key: str, record: IdempotencyRecord, expires_at: float) -> None:
+        # NOTE: Must be called with the lock held
+        self._records[key] = (expires_at, record)
+        self._records.move_to_end(key)
+        while len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+
+    def add(self, key: str, record: IdempotencyRecord, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._get(key, now) is not None:
+                return False
+            self._put(key, record, now + ttl)
+            return True
+
+    def get(self, key: str) -> Optional[IdempotencyRecord]:
+        with self._lock:
+            return self._get(key, time.time())
+
+    def put(self, key: str, record: IdempotencyRecord, ttl: float) -> None:
+        with self._lock:
+            self._put(key, record, time.time() + ttl)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._records.pop(key, None)
+
+
+class SqliteIdempotencyBackend(IdempotencyBackend):
+    """Stores records in a local sqlite database, shared by processes on one host"""
+
+    def __init__(self, path: str, prune_interval: float = 60.0):
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency ("
+                "key TEXT PRIMARY KEY, record TEXT, expires_at REAL)"
+            )
+
+    def add(self, key: str, record: IdempotencyRecord, ttl: float) -> bool:
+        now = time.time()
+        with self._lock, self._conn:
+            if now - self._last_prune > self.prune_interval:
+                self._last_prune = now
+                self._conn.execute(
+                    "DELETE FROM idempotency WHERE expires_at <= ?", (now,)
+                )
+            else:
+                self._conn.execute(
+                    "DELETE FROM idempotency WHERE key = ? AND expires_at <= ?",
+                    (key, now),
+                )
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO idempotency VALUES (?, ?, ?)",
+                (key, record.to_json(), now + ttl),
+            )
+            return cursor.rowcount == 1
+
+    def get(self, key: str) -> Optional[IdempotencyRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT record FROM idempotency WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return IdempotencyRecord.from_json(row[0]) if row else None
+
+    def put(self, key: str, record: IdempotencyRecord, ttl: float) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotency VALUES (?, ?, ?)",
+                (key, record.to_json(), time.time() + ttl),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+
+
+class RedisIdempotencyBackend(IdempotencyBackend):
+    """
+    Stores records in Redis, or any server speaking its protocol, shared by every
+    process. Requires `pip install redis`.
+    """
+
+    def __init__(self, url: str, prefix: str = "idempotency:"):
+        if redis is None:
+            raise ImportError("The Redis idempotency backend requires redis")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def add(self, key: str, record: IdempotencyRecord, ttl: float) -> bool:
+        return bool(
+            self._client.set(
+                self.prefix + key, record.to_json(), nx=True, px=int(ttl * 1000)
+            )
+        )
+
+    def get(self, key: str) -> Optional[IdempotencyRecord]:
+        data = self._client.get(self.prefix + key)
+        return IdempotencyRecord.from_json(data) if data else None
+
+    def put(self, key: str, record: IdempotencyRecord, ttl: float) -> None:
+        self._client.set(self.prefix + key, record.to_json(), px=int(ttl * 1000))
+
+    def delete(self, key: str) -> None:
+        self._client.delete(self.prefix + key)
+
+
+class _LocalResponse:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.attached = threading.Event()
+        self.broadcast: Optional[TokenBroadcast] = None
+
+
+class IdempotencyStore:
+    """
+    Tracks the response to each key. In-flight keys expire after `in_flight_ttl`
+    seconds, so a process dying mid-response doesn't block retries for long, and
+    completed responses are kept for `ttl` seconds. Duplicates of a response in flight
+    in this process wait up to `join_timeout` seconds for its stream to start.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600.0,
+        in_flight_ttl: float = 300.0,
+        join_timeout: float = 30.0,
+        backend: Optional[IdempotencyBackend] = None,
+    ):
+        self.ttl = ttl
+        self.in_flight_ttl = in_flight_ttl
+        self.join_timeout = join_timeout
+        self.backend = backend or MemoryIdempotencyBackend()
+
+        self._lock = threading.Lock()
+        self._responses: Dict[str, _LocalResponse] = {}
+
+    def begin(self, key: str) -> Optional[IdempotencyRecord]:
+        """
+        Start the response to key, unless it was already started.
+
+        :returns: None if the caller should respond, otherwise the existing record
+        """
+        while True:
+            if self.backend.add(
+                key, IdempotencyRecord(IdempotencyStatus.InFlight), self.in_flight_ttl
+            ):
+                with self._lock:
+                    # Drop the streams of responses that were abandoned unfinished
+                    now = time.monotonic()
+                    for stale_key, response in list(self._responses.items()):
+                        if now - response.started_at > self.in_flight_ttl:
+                            del self._responses[stale_key]
+                    self._responses[key] = _LocalResponse()
+                return None
+            record = self.backend.get(key)
+            # Otherwise the record expired in between, so try again
+            if record is not None:
+                return record
+
+    def attach(self, key: str, broadcast: TokenBroadcast) -> None:
+        """Share the stream of the in-flight response to key with duplicates"""
+        with self._lock:
+            response = self._responses.get(key)
+        if response is not None:
+            response.broadcast = broadcast
+            response.attached.set()
+
+    def subscribe(self, key: str) -> Optional[Iterator[str]]:
+        """The stream of the in-flight response to key, if it is in this process"""
+        with self._lock:
+            response = self._responses.get(key)
+        if response is None or not response.attached.wait(self.join_timeout):
+            return None
+        broadcast = response.broadcast
+        return broadcast.subscribe() if broadcast is not None else None
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            response = self._responses.pop(key, None)
+        if response is not None and not response.attached.is_set():
+            # Release any duplicates waiting for a stream that won't start
+            response.attached.set()
+
+    def complete(self, key: str, response: str) -> None:
+        """Record the full response to key, for any later duplicate"""
+        self.backend.put(
+            key, IdempotencyRecord(IdempotencyStatus.Completed, response), self.ttl
+        )
+        self._forget(key)
+
+    def fail(self, key: str) -> None:
+        """Forget key after a failed response, so that a retry responds again"""
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            logger.error(f"Unable to forget idempotency key {key}: {e}")
+        self._forget(key)
+
+
+def has_shared_idempotency(config: Config) -> bool:
+    """
+    Whether deliveries are deduplicated in a store outliving the process, so that a
+    redelivery is recognised after a restart or by another process
+    """
+    return config.idempotency and bool(
+        config.idempotency_path or config.idempotency_redis_url
+    )
+
+
+def build_idempotency_store(config: Config) -> Optional[IdempotencyStore]:
+    """The idempotency store configured, or None if disabled"""
+    if not config.idempotency:
+        return None
+
+    if config.idempotency_redis_url:
+        backend = RedisIdempotencyBackend(config.idempotency_redis_url)
+    elif config.idempotency_path:
+        backend = SqliteIdempotencyBackend(config.idempotency_path)
+    else:
+        backend = MemoryIdempotencyBackend(config.idempotency_max_entries)
+
+    return IdempotencyStore(
+        ttl=config.idempotency_ttl_seconds,
+        in_flight_ttl=config.idempotency_in_flight_seconds,
+        backend=backend,
+    )
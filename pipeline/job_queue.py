@@ -0,0 +1,329 @@
+"""
+A priority queue of jobs run by a pool of worker threads, used to respond to webhooks
+after acknowledging them instead of while holding their connection open.
+
+Jobs with a higher priority run first, and jobs of the same priority in the order they
+were queued. Failed jobs are retried with an increasing delay, up to a maximum number of
+attempts. A handler can instead raise JobDeferred to run its job again later without
+counting the attempt, or JobFailed to give up on it at once. Jobs are queued in memory,
+or in sqlite to survive restarts: a job claimed by a worker that dies is run again once
+its lease expires.
+"""
+import abc
+import heapq
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .config import Config
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class JobDeferred(Exception):
+    """Raised by a handler to run its job again after `delay` seconds"""
+
+    def __init__(self, reason: str, delay: float):
+        super().__init__(f"Job deferred: {reason}")
+        self.delay = delay
+
+
+class JobFailed(Exception):
+    """Raised by a handler whose job mustn't be retried, as it had effects to repeat"""
+
+
+@dataclass
+class Job:
+    """A unit of work, with a JSON-serializable payload"""
+
+    payload: Dict[str, Any]
+    priority: int = 0
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # The number of times the job was claimed by a worker, including this one
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.time)
+
+
+class JobQueueBackend(metaclass=abc.ABCMeta):
+    """Where queued jobs are kept until they are done"""
+
+    @abc.abstractmethod
+    def put(self, job: Job, delay: float = 0.0) -> None:
+        """Queue the job, to be claimed no sooner than `delay` seconds from now"""
+
+    @abc.abstractmethod
+    def claim(self, lease: float) -> Optional[Job]:
+        """
+        Claim the next job that is due, if any. The job is claimed for `lease` seconds,
+        after which it can be claimed again unless it was completed or put back.
+        """
+
+    @abc.abstractmethod
+    def complete(self, job: Job) -> None:
+        pass
+
+    @abc.abstractmethod
+    def size(self) -> int:
+        """The number of jobs queued or running"""
+
+
+class MemoryJobQueueBackend(JobQueueBackend):
+    """Keeps jobs in memory, so queued jobs are lost when the process exits"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+        self._queued: List[Tuple[int, int, Job]] = []
+        self._delayed: List[Tuple[float, int, Job]] = []
+        self._running: Dict[str, Job] = {}
+
+    def put(self, job: Job, delay: float = 0.0) -> None:
+        with self._lock:
+            self._running.pop(job.id, None)
+            if delay > 0:
+                heapq.heappush(
+                    self._delayed, (time.time() + delay, next(self._order), job)
+                )
+            else:
+                heapq.heappush(self._queued, (-job.priority, next(self._order), job))
+
+    def claim(self, lease: float) -> Optional[Job]:
+        # A worker of this process can't die without the process, so there are no
+        # leases to expire
+        now = time.time()
+        with self._lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                _, order, job = heapq.heappop(self._delayed)
+                heapq.heappush(self._queued, (-job.priority, order, job))
+            if not self._queued:
+                return None
+            job = heapq.heappop(self._queued)[2]
+            job.attempts += 1
+            self._running[job.id] = job
+            return job
+
+    def complete(self, job: Job) -> None:
+        with self._lock:
+            self._running.pop(job.id, None)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._queued) + len(self._delayed) + len(self._running)
+
+
+class SqliteJobQueueBackend(JobQueueBackend):
+    """Stores jobs in a local sqlite database, shared by processes on one host"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, payload TEXT, priority INTEGER, "
+                "attempts INTEGER, enqueued_at REAL, available_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_order "
+                "ON jobs (priority DESC, enqueued_at)"
+            )
+
+    def put(self, job: Job, delay: float = 0.0) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    job.id,
+                    json.dumps(job.payload),
+                    job.priority,
+                    job.attempts,
+                    job.enqueued_at,
+                    time.time() + delay,
+                ),
+            )
+
+    def claim(self, lease: float) -> Optional[Job]:
+        with self._lock:
+            while True:
+                now = time.time()
+                with self._conn:
+                    row = self._conn.execute(
+                        "SELECT id, payload, priority, attempts, enqueued_at, "
+                        "available_at FROM jobs WHERE available_at <= ? "
+                        "ORDER BY priority DESC, enqueued_at LIMIT 1",
+                        (now,),
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    # Claiming a job makes it unavailable until its lease expires.
+                    # Another process may have claimed it first, so only claim it if
+                    # it is unchanged.
+                    cursor = self._conn.execute(
+                        "UPDATE jobs SET attempts = attempts + 1, available_at = ? "
+                        "WHERE id = ? AND available_at = ?",
+                        (now + lease, row[0], row[5]),
+                    )
+                    if cursor.rowcount == 1:
+                        return Job(
+                            payload=json.loads(row[1]),
+                            priority=row[2],
+                            id=row[0],
+                            attempts=row[3] + 1,
+                            enqueued_at=row[4],
+                        )
+
+    def complete(self, job: Job) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+class JobQueue:
+    """
+    Runs each queued job with `handler` on one of `workers` threads. A job that raises
+    is retried after `retry_delay` seconds, doubling with each attempt, and given up on
+    after `max_attempts` attempts, calling `on_failure` with the job and its error.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Job], None],
+        backend: Optional[JobQueueBackend] = None,
+        workers: int = 4,
+        max_attempts: int = 3,
+        retry_delay: float = 5.0,
+        lease: float = 600.0,
+        on_failure: Optional[Callable[[Job, BaseException], None]] = None,
+        poll_interval: float = 1.0,
+    ):
+        self.handler = handler
+        self.backend = backend or MemoryJobQueueBackend()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.on_failure = on_failure
+        self.poll_interval = poll_interval
+
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def enqueue(self, payload: Dict[str, Any], priority: int = 0) -> Job:
+        job = Job(payload, priority)
+        self.backend.put(job)
+        metrics.set("job_queue_depth", self.backend.size())
+        with self._wakeup:
+            self._wakeup.notify()
+        return job
+
+    def start(self) -> None:
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"job-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the workers once they finish their current jobs"""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            if not self.run_next():
+                # Wait to be woken by a new job, or poll for delayed jobs and jobs
+                # queued by other processes
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+
+    def run_next(self) -> bool:
+        """Run the next job that is due in this thread, returning if there was one"""
+        try:
+            job = self.backend.claim(self.lease)
+        except Exception as e:
+            logger.error(f"Unable to claim a job: {e}")
+            return False
+        if job is None:
+            return False
+
+        if job.attempts == 1:
+            metrics.observe("job_queue_wait_seconds", time.time() - job.enqueued_at)
+
+        start_time = time.monotonic()
+        try:
+            # Jobs whose worker died can exceed their attempts when claimed again
+            if job.attempts > self.max_attempts:
+                raise RuntimeError(
+                    f"Job {job.id} exceeded {self.max_attempts} attempts"
+                )
+            self.handler(job)
+        except JobDeferred as e:
+            # The attempt didn't run, so it doesn't count towards max_attempts
+            logger.info(f"Job {job.id} deferred for {e.delay:.1f}s: {e}")
+            job.attempts -= 1
+            self.backend.put(job, delay=e.delay)
+            metrics.inc("jobs_total", status="deferred")
+        except Exception as e:
+            self._retry_or_fail(job, e)
+        else:
+            self.backend.complete(job)
+            metrics.inc("jobs_total", status="completed")
+        finally:
+            metrics.observe("job_run_seconds", time.monotonic() - start_time)
+            metrics.set("job_queue_depth", self.backend.size())
+        return True
+
+    def _retry_or_fail(self, job: Job, error: Exception) -> None:
+        if job.attempts < self.max_attempts and not isinstance(error, JobFailed):
+            logger.warning(f"Job {job.id} failed on attempt {job.attempts}: {error}")
+            self.backend.put(job, delay=self.retry_delay * 2 ** (job.attempts - 1))
+            metrics.inc("jobs_total", status="retried")
+            return
+
+        logger.error(f"Job {job.id} failed after {job.attempts} attempts: {error}")
+        self.backend.complete(job)
+        metrics.inc("jobs_total", status="failed")
+        if self.on_failure is not None:
+            self.on_failure(job, error)
+
+
+def build_job_queue(
+    config: Config,
+    handler: Callable[[Job], None],
+    on_failure: Optional[Callable[[Job, BaseException], None]] = None,
+) -> Optional[JobQueue]:
+    """The job queue configured for asynchronous responses, or None if disabled"""
+    if not config.async_responses:
+        return None
+
+    if config.job_queue_path:
+        backend = SqliteJobQueueBackend(config.job_queue_path)
+    else:
+        backend = MemoryJobQueueBackend()
+
+    return JobQueue(
+        handler,
+        backend=backend,
+        workers=config.job_queue_workers,
+        max_attempts=config.job_queue_max_attempts,
+        retry_delay=config.job_queue_retry_seconds,
+        lease=config.job_queue_lease_seconds,
+        on_failure=on_failure,
+    )
@@ -0,0 +1,122 @@
+"""
+A small, dependency-free, in-process metrics registry. Counters, gauges and summaries
+are keyed by name and labels, and can be rendered in the Prometheus text format.
+"""
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile of `samples`, with q in [0, 1]"""
+    if not samples:
+        return math.nan
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Summary:
+    """Tracks count and sum of observations, plus a window of recent samples"""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantile(self, q: float) -> float:
+        return percentile(list(self.samples), q)
+
+
+class MetricsRegistry:
+    """A thread-safe registry of counters, gauges and summaries"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._summaries: Dict[str, Dict[LabelKey, Summary]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._summaries.setdefault(name, {})
+            if key not in series:
+                series[key] = Summary()
+            series[key].observe(value)
+
+    def get(self, name: str, **labels) -> Optional[float]:
+        """Return the current value of a counter or gauge, if it exists"""
+        key = _label_key(labels)
+        with self._lock:
+            for store in (self._counters, self._gauges):
+                if key in store.get(name, {}):
+                    return store[name][key]
+        return None
+
+    def get_summary(self, name: str, **labels) -> Optional[Summary]:
+        with self._lock:
+            return self._summaries.get(name, {}).get(_label_key(labels))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+
+        def fmt(name: str, key: LabelKey, value: float, extra: LabelKey = ()) -> str:
+            labels = key + extra
+            if not labels:
+                return f"{name} {value}"
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+            return f"{name}{{{label_str}}} {value}"
+
+        lines = []
+        with self._lock:
+            for kind, store in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, series in sorted(store.items()):
+                    lines.append(f"# TYPE {name} {kind}")
+                    lines.extend(fmt(name, k, v) for k, v in sorted(series.items()))
+
+            for name, series in sorted(self._summaries.items()):
+                lines.append(f"# TYPE {name} summary")
+                for key, summary in sorted(series.items()):
+                    for q in SUMMARY_QUANTILES:
+                        lines.append(
+                            fmt(name, key, summary.quantile(q), (("quantile", str(q)),))
+                        )
+                    lines.append(fmt(f"{name}_sum", key, summary.total))
+                    lines.append(fmt(f"{name}_count", key, summary.count))
+
+        return "\n".join(lines) + "\n"
+
+
+# The registry shared by the whole application
+metrics = MetricsRegistry()
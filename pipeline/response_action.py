@@ -1,9 +1,13 @@
 import abc
-from typing import Any
+import logging
+import threading
+from typing import Any, Callable, Iterator, List
 
 from .base_integration import BaseIntegration, integrations_registry
 from .config import Config
 
+logger = logging.getLogger(__name__)
+
 
 class ResponseActor(BaseIntegration, metaclass=abc.ABCMeta):
     """
@@ -12,6 +16,22 @@ class ResponseActor(BaseIntegration, metaclass=abc.ABCMeta):
     until we find a valid response
     """
 
+    def streams_response(self, conv_info: Any) -> bool:
+        """Whether stream_action should be run while the response is generated"""
+        return False
+
+    def stream_action(self, conv_info: Any, tokens: Iterator[str]) -> None:
+        """
+        Act on the response while it is generated, for example to send it in parts.
+        Runs in its own thread, and take_action is still run once it is complete and
+        the thread has ended. Record what was done, and whether it finished, in
+        conv_info, so that take_action can do the rest if streaming failed.
+        """
+
+    def has_responded(self, conv_info: Any) -> bool:
+        """Whether any of the response was sent, so it mustn't be generated again"""
+        return False
+
     @abc.abstractmethod
     def take_action(
         self,
@@ -37,3 +57,47 @@ def take_all_actions(
             response_actor, ResponseActor
         ), f"Must only specify ResponseActor in response_actor_cls"
         response_actor.take_action(conv_info, text_response, responses_from_vs, context)
+
+
+def any_action_responded(config: Config, conv_info: Any) -> bool:
+    """Whether any ResponseActor specified in config sent any of the response"""
+    for cls_name in config.response_actor_cls:
+        response_actor = integrations_registry[cls_name](config)
+        assert isinstance(
+            response_actor, ResponseActor
+        ), f"Must only specify ResponseActor in response_actor_cls"
+        if response_actor.has_responded(conv_info):
+            return True
+    return False
+
+
+def stream_all_actions(
+    config: Config,
+    conv_info: Any,
+    subscribe: Callable[[], Iterator[str]],
+) -> List[threading.Thread]:
+    """
+    Runs the stream_action of any ResponseActors specified in config that stream
+    responses, each in a thread with its own subscription to the response tokens
+
+    :returns: The threads, which end once the response has been streamed
+    """
+    threads = []
+    for cls_name in config.response_actor_cls:
+        response_actor = integrations_registry[cls_name](config)
+        assert isinstance(
+            response_actor, ResponseActor
+        ), f"Must only specify ResponseActor in response_actor_cls"
+        if not response_actor.streams_response(conv_info):
+            continue
+
+        def run(actor: ResponseActor = response_actor) -> None:
+            try:
+                actor.stream_action(conv_info, subscribe())
+            except Exception as e:
+                logger.error(f"{type(actor).__name__} failed to stream: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
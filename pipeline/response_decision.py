@@ -18,6 +18,13 @@ class ResponseDecision:
     response_dict: Optional[Dict[str, Any]] = None
     response_code: Optional[int] = None
     conversation_info: Optional[Any] = None
+    # Identifies the message being responded to, so that repeat deliveries of the
+    # same message are only responded to once
+    idempotency_key: Optional[str] = None
+    # Responses with a higher priority are generated first when they are queued
+    priority: int = 0
+    # Who the request is from, to rate limit each tenant separately
+    tenant: Optional[str] = None
 
 
 class ResponseDecider(BaseIntegration, metaclass=abc.ABCMeta):
@@ -28,14 +35,19 @@ class ResponseDecider(BaseIntegration, metaclass=abc.ABCMeta):
         self,
         request_body: Mapping[str, Any],
         request_headers: Mapping[str, str],
+        raw_body: bytes = b"",
     ) -> ResponseDecision:
-        pass
+        """
+        :param raw_body: The request body exactly as received, for verifying the
+                         signatures of webhooks
+        """
 
 
 def make_all_response_decisions(
     config: Config,
     request_body: Mapping[str, Any],
     request_headers: Mapping[str, str],
+    raw_body: bytes = b"",
 ) -> ResponseDecision:
     """Runs all ResponseDeciders specified in config to return ResponseDecision's"""
     # TODO: Some aggregation strategy that allows for multiple response deciders present
@@ -44,7 +56,9 @@ def make_all_response_decisions(
         assert isinstance(
             response_actor, ResponseDecider
         ), f"Must only specify ResponseDecider in response_decider_cls"
-        return response_actor.make_response_decision(request_body, request_headers)
+        return response_actor.make_response_decision(
+            request_body, request_headers, raw_body
+        )
 
     # No response deciders present, so just keep going
     return ResponseDecision(should_return_early=False)
@@ -1,6 +1,6 @@
 import abc
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Optional
 
 from .base_integration import BaseIntegration, integrations_registry
 from .config import Config
@@ -15,6 +15,7 @@ class UserContext:
     user_question: str
     persona: str
     context_str: str
+    conversation_id: Optional[str] = None  # Used to keep per-conversation history
 
 
 class UserContextCreator(BaseIntegration, metaclass=abc.ABCMeta):
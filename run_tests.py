@@ -2,57 +2,272 @@
 Script that runs an automated test suite for Anthropic Claude.
 
 Testset and results use the Scorecard SDK.
+
+Testcases run concurrently on a bounded pool of workers, and records are uploaded in
+batches. Completed testcases are checkpointed per run, so an interrupted run can be
+resumed with --resume-run-id. Testcases that fail are neither recorded nor
+checkpointed, so resuming the run retries them. Responses are cached keyed on the
+question, the prompts, the model, the retrieval config and the FAQ index, so unchanged
+testcases aren't sent to the LLM again.
 """
 
+import argparse
+import glob
+import hashlib
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
 import httpx
 import scorecard
 
 from dotenv import load_dotenv
 from fastapi.testclient import TestClient
 
-from app import app
-
 load_dotenv(".env")
 
 
 SCORECARD_API_KEY = os.environ["SCORECARD_API_KEY"]
 
+CACHE_PATH = os.path.join(".eval_cache", "responses.jsonl")
+CHECKPOINT_DIR = os.path.join(".eval_cache", "checkpoints")
+
+
+class JsonlStore:
+    """An append-only JSON lines file, safe to append to from multiple threads"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def read(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def append(self, entries: Iterable[Dict[str, Any]]) -> None:
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+
+class ResponseCache:
+    """Model responses, keyed on everything that can change a response"""
+
+    def __init__(self, path: str = CACHE_PATH):
+        self._store = JsonlStore(path)
+        self._responses = {e["key"]: e["response"] for e in self._store.read()}
+
+    def get(self, key: str) -> Optional[str]:
+        return self._responses.get(key)
+
+    def put(self, key: str, response: str) -> None:
+        self._responses[key] = response
+        self._store.append([{"key": key, "response": response}])
+
+
+def get_fingerprint(
+    config, k: int, collection_version: Optional[str] = None
+) -> Dict[str, Any]:
+    """Describe the prompts, model and retrieval config that responses depend on"""
+    prompt_hash = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join("prompts", "*.yaml"))):
+        with open(path, "rb") as f:
+            prompt_hash.update(f.read())
+    prompt_hash.update(
+        json.dumps([config.company, config.custom_rules or []]).encode("utf-8")
+    )
+
+    from chatbot_api.faq_index import FAQ_ENTRIES_FILE
+
+    # FAQ answers are served instead of generated responses
+    faq_hash = hashlib.sha256()
+    if config.faq_index_path:
+        entries_path = os.path.join(config.faq_index_path, FAQ_ENTRIES_FILE)
+        if os.path.exists(entries_path):
+            with open(entries_path, "rb") as f:
+                faq_hash.update(f.read())
+
+    return {
+        "prompt_hash": prompt_hash.hexdigest(),
+        "citations": config.citations,
+        "model": [
+            config.llm_provider.value,
+            config.openai_textgen_model,
+            config.google_textgen_model,
+        ],
+        "retrieval": {
+            "k": k,
+            "embeddings_model": [
+                config.openai_embeddings_model,
+                config.google_embeddings_model,
+            ],
+            "collection": [config.astra_db_table_name, collection_version],
+            "adaptive": [
+                config.adaptive_retrieval,
+                config.retrieval_small_k,
+                config.retrieval_large_k,
+            ],
+            "filters": [config.retrieval_filters, config.persona_retrieval_filters],
+        },
+        "faq": [
+            config.faq_index_path,
+            config.faq_similarity_threshold,
+            faq_hash.hexdigest(),
+        ],
+    }
+
+
+def get_cache_key(user_query: str, fingerprint: Dict[str, Any]) -> str:
+    return hashlib.sha256(
+        json.dumps([user_query, fingerprint], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def query_ai_chatbot_starter(
+    user_query, client: Optional[TestClient] = None
+) -> Tuple[bool, str]:
+    """
+    :returns: A tuple of (whether the request succeeded, the response or error text)
+    """
+    if client is None:
+        from app import app
+
+        client = TestClient(app)
 
-def query_ai_chatbot_starter(user_query):
     # Set the request appropriately
     headers = {}
     request_body = {"question": user_query}
 
-    response = TestClient(app).post("/chat", json=request_body, headers=headers)
+    response = client.post("/chat", json=request_body, headers=headers)
 
     # Check if the request was successful
     if response.status_code == httpx.codes.created:
-        return response.content.decode()
+        return True, response.content.decode()
     else:
-        return f"Request failed with status code {response.status_code}: {response.text}"
+        return (
+            False,
+            f"Request failed with status code {response.status_code}: {response.text}",
+        )
+
 
+def run_all_tests(
+    input_testset_id: int,
+    scoring_config_id: int,
+    workers: int = 8,
+    batch_size: int = 20,
+    resume_run_id: Optional[int] = None,
+    cache_path: Optional[str] = CACHE_PATH,
+    checkpoint_dir: str = CHECKPOINT_DIR,
+):
+    # Imported here so the app is only loaded when actually running tests
+    from app import app, assistant, config
 
-def run_all_tests(input_testset_id: int, scoring_config_id: int):
-    run_id = scorecard.create_run(input_testset_id, scoring_config_id)
+    run_id = resume_run_id or scorecard.create_run(input_testset_id, scoring_config_id)
     testcases = scorecard.get_testset(input_testset_id)
 
-    for testcase in testcases:
+    # Skip testcases that were already recorded for this run
+    checkpoint = JsonlStore(os.path.join(checkpoint_dir, f"run_{run_id}.jsonl"))
+    completed: Set[Any] = {entry["testcase_id"] for entry in checkpoint.read()}
+    pending = [testcase for testcase in testcases if testcase["id"] not in completed]
+    print(f"Running {len(pending)} of {len(testcases)} testcases for run {run_id}...")
+
+    cache = ResponseCache(cache_path) if cache_path else None
+    fingerprint = get_fingerprint(config, assistant.k, assistant.version)
+    client = TestClient(app)
+
+    def run_testcase(testcase: Dict[str, Any]) -> Tuple[bool, str]:
+        key = get_cache_key(testcase["user_query"], fingerprint)
+        cached_response = cache.get(key) if cache is not None else None
+        if cached_response is not None:
+            print(f"Testcase {testcase['id']} unchanged, using cached response")
+            return True, cached_response
+
         print(f"Running testcase {testcase['id']}...")
-        print(f"User query: {testcase['user_query']}")
+        ok, model_response = query_ai_chatbot_starter(testcase["user_query"], client)
+        if ok and cache is not None:
+            cache.put(key, model_response)
+        return ok, model_response
 
-        # Get the model's response using the helper function
-        model_response = query_ai_chatbot_starter(testcase["user_query"])
+    def flush(records: List[Dict[str, Any]]) -> None:
+        uploaded = scorecard.log_records(run_id, records)
+        checkpoint.append({"testcase_id": testcase_id} for testcase_id in uploaded)
 
-        scorecard.log_record(
-            run_id, testcase["id"], model_response, # TODO: Add PROMPT_TEMPLATE
-        )
+    batch: List[Dict[str, Any]] = []
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(run_testcase, testcase): testcase for testcase in pending
+        }
+        for future in as_completed(futures):
+            testcase = futures[future]
+            try:
+                ok, model_response = future.result()
+            except Exception as e:
+                ok, model_response = False, f"{type(e).__name__}: {e}"
+            if not ok:
+                # Left out of the run, to be retried by resuming it
+                print(f"Testcase {testcase['id']} failed: {model_response}")
+                failed += 1
+                continue
 
+            batch.append(
+                {
+                    "testcase_id": testcase["id"],
+                    "model_response": model_response,
+                    # TODO: Add PROMPT_TEMPLATE
+                }
+            )
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+
+    if batch:
+        flush(batch)
+
+    if failed:
+        print(
+            f"{failed} testcases failed, resume with --resume-run-id {run_id} to "
+            "retry them"
+        )
+        return
     scorecard.update_run_status(run_id)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a Scorecard testset")
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("EVAL_WORKERS", "8"))
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=int(os.getenv("EVAL_BATCH_SIZE", "20"))
+    )
+    parser.add_argument(
+        "--resume-run-id",
+        type=int,
+        default=os.getenv("RESUME_RUN_ID"),
+        help="Resume a run, skipping testcases that were already recorded",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Query the chatbot for every testcase, ignoring cached responses",
+    )
+    args = parser.parse_args()
+
     INPUT_TESTSET_ID = int(os.environ["INPUT_TESTSET_ID"])
     SCORING_CONFIG_ID = int(os.environ["SCORING_CONFIG_ID"])
 
-    run_all_tests(INPUT_TESTSET_ID, SCORING_CONFIG_ID)
+    run_all_tests(
+        INPUT_TESTSET_ID,
+        SCORING_CONFIG_ID,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        resume_run_id=args.resume_run_id,
+        cache_path=None if args.no_cache else CACHE_PATH,
+    )
@@ -5,6 +5,9 @@ Testset and results use the Scorecard SDK.
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
 import requests
 
 from dotenv import load_dotenv
@@ -13,8 +16,8 @@ load_dotenv(".env")
 
 SCORECARD_API_KEY = os.environ["SCORECARD_API_KEY"]
 
-# Endpoint definitions
-BASE_URL = "https://api.getscorecard.ai/"
+# Endpoint definitions, the base URL can be overridden to point at a local stand-in
+BASE_URL = os.getenv("SCORECARD_BASE_URL", "https://api.getscorecard.ai/")
 POST_CREATE_RUN_URL = BASE_URL + "create-run"
 GET_TESTSET_BASE_URL = BASE_URL + "testset"
 POST_CREATE_TESTRECORD_URL = BASE_URL + "create-testrecord"
@@ -26,13 +29,17 @@ REQUEST_HEADERS = {
     "X-API-Key": SCORECARD_API_KEY,
 }
 
+# Reuse connections across requests
+session = requests.Session()
+session.headers.update(REQUEST_HEADERS)
+
 
 def create_run(
     input_testset_id: int, scoring_config_id: int, model_params: dict() = {}
 ):
     print("Creating new run...")
     create_run_url = POST_CREATE_RUN_URL
-    response = requests.post(
+    response = session.post(
         create_run_url,
         json={
             "testset_id": input_testset_id,
@@ -40,7 +47,6 @@ def create_run(
             "status": "running_execution",
             "model_params": model_params,
         },
-        headers=REQUEST_HEADERS,
         timeout=30,
     )
     if response.status_code != 200:
@@ -52,9 +58,7 @@ def create_run(
 def get_testset(testset_id: int):
     print("Retrieving testset...")
     get_testset_url = GET_TESTSET_BASE_URL + "/" + str(testset_id)
-    testset_response = requests.get(
-        get_testset_url, headers=REQUEST_HEADERS, timeout=30
-    )
+    testset_response = session.get(get_testset_url, timeout=30)
     if testset_response.status_code != 200:
         print(f"ERROR: {testset_response.status_code} {testset_response.text}")
         return []
@@ -63,7 +67,7 @@ def get_testset(testset_id: int):
 
 def update_run_status(run_id: int, status: str = "awaiting_scoring"):
     update_run_url = PATCH_UPDATE_RUN_BASE_URL + "/" + str(run_id) + "?status=" + status
-    response = requests.patch(update_run_url, headers=REQUEST_HEADERS, timeout=30)
+    response = session.patch(update_run_url, timeout=30)
     if response.status_code != 200:
         print(f"ERROR: {response.status_code} {response.text}")
     return response.json()
@@ -89,11 +93,43 @@ def log_record(
     for key, value in testrecord.items():
         print(f"\t{key}: {str(value)[:100]}")
 
-    response = requests.post(
+    _post_testrecord(testrecord)
+
+
+def log_records(run_id: int, records: List[Dict[str, Any]], max_workers: int = 8):
+    """
+    Upload a batch of testrecords concurrently over pooled connections. Each record
+    needs a testcase_id and model_response, and may have a prompt and model_params.
+
+    :returns: The testcase ids of the records that were uploaded successfully
+    """
+    print(f"Writing {len(records)} testrecords for run_id {run_id}...")
+    testrecords = [
+        {
+            "run_id": run_id,
+            "prompt": "",
+            "model_params": {},
+            **record,
+        }
+        for record in records
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        uploaded = list(executor.map(_post_testrecord, testrecords))
+
+    return [
+        testrecord["testcase_id"]
+        for testrecord, ok in zip(testrecords, uploaded)
+        if ok
+    ]
+
+
+def _post_testrecord(testrecord: Dict[str, Any]) -> bool:
+    response = session.post(
         POST_CREATE_TESTRECORD_URL,
         json=testrecord,
-        headers=REQUEST_HEADERS,
         timeout=30,
     )
     if response.status_code != 200:
         print(f"ERROR: {response.status_code} {response.text}")
+        return False
+    return True
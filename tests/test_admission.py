@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from pipeline.admission import AdmissionController, AdmissionRejected
+
+
+def test_tenants_are_rate_limited_separately():
+    controller = AdmissionController(tenant_rate=1, tenant_burst=2)
+    controller.check_tenant("a")
+    controller.check_tenant("a")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.check_tenant("a")
+
+    assert rejected.value.reason == "rate_limited"
+    assert 0 < rejected.value.retry_after <= 1
+    controller.check_tenant("b")
+    controller.check_tenant(None)
+
+
+def test_generations_wait_for_a_turn():
+    controller = AdmissionController(max_concurrent=1, wait_timeout=5)
+    generation = controller.acquire()
+    admitted = threading.Event()
+
+    def wait_for_turn():
+        controller.acquire()
+        admitted.set()
+
+    threading.Thread(target=wait_for_turn).start()
+    assert not admitted.wait(0.1)
+    assert controller.waiting == 1
+
+    generation.release()
+    generation.release()
+    assert admitted.wait(5)
+    assert controller.running == 1
+
+
+def test_generations_are_rejected_when_the_wait_is_too_long():
+    controller = AdmissionController(max_concurrent=1, max_waiting=0)
+    controller.acquire()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire()
+    assert rejected.value.reason == "queue_full"
+
+    controller = AdmissionController(max_concurrent=1, wait_timeout=0.1)
+    controller.acquire()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire()
+    assert rejected.value.reason == "timeout"
+    assert controller.waiting == 0
@@ -11,19 +11,18 @@ import pytest
 import requests
 
 
-def get_headers(body):
-    """Helper to get necessary request headers for successful POST
-
-    NOTE: Keys in `body` must be specified (recursively) in alphabetical order
+def get_headers(content):
+    """Helper to get necessary request headers for successful POST of `content`,
+    the raw bytes of the request body
     """
     intercom_secret = os.getenv("INTERCOM_CLIENT_SECRET")
 
     digest = hmac.new(
         intercom_secret.encode("utf-8"),
-        msg=json.dumps(body).encode("utf-8"),
-        digestmod=hashlib.sha1,
+        msg=content,
+        digestmod=hashlib.sha256,
     ).hexdigest()
-    return {"X-Hub-Signature": f"sha1={digest}"}
+    return {"X-Hub-Signature-256": f"sha256={digest}"}
 
 
 def load_test_request(filename):
@@ -58,9 +57,9 @@ def mock_assistant():
         yield mock_bison
 
 
-def get_text_response(client, data, headers, assert_created=True):
-    # r = httpx.post("http://127.0.0.1:5010/chat", json=user_data, headers=headers)
-    response = client.post("/chat", json=data, headers=headers)
+def get_text_response(client, content, headers, assert_created=True):
+    # r = httpx.post("http://127.0.0.1:5010/chat", content=content, headers=headers)
+    response = client.post("/chat", content=content, headers=headers)
 
     if assert_created:
         assert (
@@ -79,8 +78,9 @@ def test_get_root_route(client):
 
 
 def test_standard_case(standard_request, client):
-    headers = get_headers(standard_request)
-    text = get_text_response(client, standard_request, headers)
+    content = json.dumps(standard_request).encode("utf-8")
+    headers = get_headers(content)
+    text = get_text_response(client, content, headers)
     assert len(text) > 0
 
 
@@ -91,13 +91,13 @@ def test_broad_case(standard_request, client):
 
     for line in lines:
         # Set the request appropriately
-        standard_request = {"question": line}
+        content = json.dumps({"question": line}).encode("utf-8")
 
         # Create the digest and headers for the POST request
-        headers = get_headers(standard_request)
+        headers = get_headers(content)
 
         # Make the post request
-        text_response = get_text_response(client, standard_request, headers)
+        text_response = get_text_response(client, content, headers)
 
         # Log the results to a file for manual inspection
         logging.info("###")
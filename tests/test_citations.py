@@ -0,0 +1,88 @@
+from bs4 import BeautifulSoup
+from llama_index.schema import NodeWithScore, TextNode
+
+from chatbot_api.assistant import format_relevant_docs
+from chatbot_api.citations import SourceIndex, with_citations, without_sources
+from chatbot_api.crawl_scrape_docs import split_sections
+
+
+def node(text, **metadata):
+    return NodeWithScore(node=TextNode(text=text, metadata=metadata), score=1.0)
+
+
+def test_chunks_of_the_same_source_share_an_id():
+    sources = SourceIndex()
+    context = format_relevant_docs(
+        [
+            node("First", source="https://a.com", title="A"),
+            node("Second", source="https://b.com", title="B", section="Setup"),
+            node("Third", source="https://a.com", title="A"),
+            node("No source"),
+        ],
+        sources,
+    )
+
+    assert "- [1] First\n\n- [2] Second\n\n- [1] Third\n\n- No source" in context
+    assert "https://" not in context
+    assert len(sources) == 2
+
+
+def test_only_cited_sources_are_rendered_once():
+    sources = SourceIndex()
+    sources.add({"source": "https://a.com", "title": "A"})
+    sources.add({"source": "https://b.com", "title": "B", "section": "Setup"})
+    sources.add({"source": "https://c.com"})
+
+    tokens = ["Use B [2]", " and again [2], then C [3]. ", "Not [9]."]
+    response = "".join(with_citations(iter(tokens), sources))
+
+    assert response.endswith(
+        "\n\nSources:\n[2] [B - Setup](https://b.com)"
+        "\n[3] [https://c.com](https://c.com)"
+    )
+
+
+def test_sources_are_removed_from_responses():
+    sources = SourceIndex()
+    sources.add({"source": "https://a.com", "title": "A"})
+
+    response = "".join(with_citations(iter(["Use A [1]."]), sources))
+
+    assert without_sources(response) == "Use A [1]."
+    assert without_sources("No citations.") == "No citations."
+
+
+def test_nothing_is_rendered_without_citations():
+    sources = SourceIndex()
+    sources.add({"source": "https://a.com"})
+
+    assert list(with_citations(iter(["No ", "citations."]), sources)) == [
+        "No ",
+        "citations.",
+    ]
+
+
+def test_pages_are_split_into_sections():
+    body = BeautifulSoup(
+        "<main><p>Intro</p><h2 id='install'>Install</h2><p>Run pip</p>"
+        "<h3>Next</h3><p>Done</p></main>",
+        "html.parser",
+    ).find("main")
+
+    records = split_sections("https://a.com/docs", "Docs", body)
+
+    assert records == [
+        {"url": "https://a.com/docs", "title": "Docs", "section": "", "text": "Intro"},
+        {
+            "url": "https://a.com/docs#install",
+            "title": "Docs",
+            "section": "Install",
+            "text": "InstallRun pip",
+        },
+        {
+            "url": "https://a.com/docs",
+            "title": "Docs",
+            "section": "Next",
+            "text": "NextDone",
+        },
+    ]
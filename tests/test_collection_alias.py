@@ -0,0 +1,45 @@
+import os
+
+from chatbot_api.collection_alias import LocalCollectionAlias, collect_old_versions
+from chatbot_api.vector_store import build_vector_store, versioned_path
+from pipeline.config import Config
+
+
+def make_config(path):
+    return Config(
+        company="DataStax",
+        doc_pages=[],
+        response_decider_cls=["ExampleResponseDecider"],
+        user_context_creator_cls=["ExampleUserContextCreator"],
+        response_actor_cls=["ExampleResponseActor"],
+        openai_api_key="fake-openai-key",
+        vector_store="local",
+        local_vector_store_path=str(path),
+        versioned_collections=True,
+    )
+
+
+def test_alias_points_at_a_version(tmp_path):
+    config = make_config(tmp_path)
+    alias = LocalCollectionAlias(config)
+    assert alias.get() is None
+
+    store = build_vector_store(config, embedding_dimension=3, version="v1")
+    assert store.path == os.path.join(str(tmp_path), "versions", "v1")
+
+    alias.set("v1")
+    assert alias.get() == "v1"
+    assert alias.versions() == ["v1"]
+
+
+def test_old_versions_are_dropped_except_the_served_one(tmp_path):
+    config = make_config(tmp_path)
+    alias = LocalCollectionAlias(config)
+    for version in ["v1", "v2", "v3", "v4"]:
+        build_vector_store(config, embedding_dimension=3, version=version)
+    # Rolled back to an old version
+    alias.set("v1")
+
+    assert collect_old_versions(alias, keep=2) == ["v2"]
+    assert alias.versions() == ["v1", "v3", "v4"]
+    assert not os.path.exists(versioned_path(config, "v2"))
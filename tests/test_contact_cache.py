@@ -0,0 +1,85 @@
+import threading
+import time
+
+from integrations.contact_cache import ContactCache
+
+
+class FakeContacts:
+    def __init__(self, status_code=200, delay=0.0):
+        self.status_code = status_code
+        self.delay = delay
+        self.calls = 0
+        self.refreshed = threading.Event()
+
+    def __call__(self, contact_id):
+        self.calls += 1
+        time.sleep(self.delay)
+        self.refreshed.set()
+        return {"id": contact_id, "version": self.calls}, self.status_code
+
+
+def test_contacts_are_cached_until_they_expire():
+    cache = ContactCache("test", ttl=0.2, stale_ttl=0)
+    fetch = FakeContacts()
+
+    assert cache.get("1", fetch)["version"] == 1
+    assert cache.get("1", fetch)["version"] == 1
+    assert fetch.calls == 1
+    assert cache.hit_rate == 0.5
+
+    time.sleep(0.3)
+    assert cache.get("1", fetch)["version"] == 2
+
+
+def test_stale_contacts_are_served_while_refreshed():
+    cache = ContactCache("test", ttl=0.1, stale_ttl=60)
+    fetch = FakeContacts()
+    cache.get("1", fetch)
+
+    time.sleep(0.2)
+    fetch.refreshed.clear()
+    assert cache.get("1", fetch)["version"] == 1
+    assert fetch.refreshed.wait(1)
+    time.sleep(0.05)
+    assert cache.get("1", fetch)["version"] == 2
+
+
+def test_missing_contacts_are_cached_but_errors_are_not():
+    cache = ContactCache("test", negative_ttl=60)
+    missing = FakeContacts(status_code=404)
+    cache.get("1", missing)
+    cache.get("1", missing)
+    assert missing.calls == 1
+
+    failing = FakeContacts(status_code=429)
+    cache.get("2", failing)
+    cache.get("2", failing)
+    assert failing.calls == 2
+
+
+def test_concurrent_misses_share_one_fetch():
+    cache = ContactCache("test")
+    fetch = FakeContacts(delay=0.2)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get("1", fetch)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.calls == 1
+    assert len(results) == 4
+
+
+def test_least_recently_used_contacts_are_evicted():
+    cache = ContactCache("test", max_entries=2)
+    fetch = FakeContacts()
+    for contact_id in ["1", "2", "1", "3"]:
+        cache.get(contact_id, fetch)
+
+    assert len(cache) == 2
+    cache.get("1", fetch)
+    assert fetch.calls == 3
@@ -0,0 +1,73 @@
+from unittest.mock import MagicMock, patch
+
+from llama_index.schema import MetadataMode, TextNode
+
+from chatbot_api.dedup import dedup_nodes, node_sources
+from chatbot_api.vector_store import ProjectedAstraDBVectorStore
+
+SNIPPET = (
+    "Note: your application token must have the Database Administrator role to "
+    "create keyspaces, tables and indexes in your database. Tokens can be created "
+    "in the Astra Portal under Organization Settings and Token Management."
+)
+
+
+def node(text, source):
+    return TextNode(text=text, metadata={"source": source})
+
+
+def test_near_duplicates_are_collapsed_with_their_sources():
+    nodes = [
+        node(SNIPPET, "https://docs.example.com/a"),
+        node("How to connect with the Python driver.", "https://docs.example.com/a"),
+        node(SNIPPET.replace("Note:", "NOTE"), "https://docs.example.com/b"),
+        node(SNIPPET + " ", "https://docs.example.com/c"),
+    ]
+
+    kept = dedup_nodes(nodes)
+
+    assert [n.get_content() for n in kept] == [
+        SNIPPET,
+        "How to connect with the Python driver.",
+    ]
+    assert node_sources(kept[0]) == [
+        "https://docs.example.com/a",
+        "https://docs.example.com/b",
+        "https://docs.example.com/c",
+    ]
+    assert kept[0].metadata["source"] == "https://docs.example.com/a"
+    assert "sources" not in kept[0].get_content(MetadataMode.EMBED)
+    assert node_sources(kept[1]) == ["https://docs.example.com/a"]
+
+
+def test_different_chunks_are_kept():
+    nodes = [
+        node(SNIPPET, "a"),
+        node(SNIPPET.replace("keyspaces, tables and indexes", "nothing"), "b"),
+    ]
+
+    assert len(dedup_nodes(nodes)) == 2
+
+
+def test_sources_can_be_stored_in_astra():
+    kept = dedup_nodes(
+        [node(SNIPPET, "https://docs.example.com/a"), node(SNIPPET, "https://b.com")]
+    )
+    for kept_node in kept:
+        kept_node.embedding = [1.0, 0.0]
+
+    collection = MagicMock()
+    with patch("astrapy.db.AstraDB") as astra_db:
+        astra_db.return_value.create_collection.return_value = collection
+        store = ProjectedAstraDBVectorStore(
+            metadata_fields=["source", "sources"],
+            token="token",
+            api_endpoint="http://localhost",
+            collection_name="data",
+            embedding_dimension=2,
+        )
+    store.add(kept)
+
+    (documents,) = collection.insert_many.call_args.args
+    stored = TextNode(metadata=documents[0]["metadata"])
+    assert node_sources(stored) == ["https://docs.example.com/a", "https://b.com"]
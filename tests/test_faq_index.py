@@ -0,0 +1,125 @@
+import json
+import os
+
+from chatbot_api.faq_index import FAQ_ENTRIES_FILE, FaqEntry, FaqIndex, save_faq_index
+
+VECTORS = {
+    "How do I reset my password?": [1.0, 0.0, 0.0],
+    "I forgot my password": [0.9, 0.1, 0.0],
+    "What is Astra DB?": [0.0, 1.0, 0.0],
+}
+
+
+class FakeEmbedding:
+    def get_text_embedding_batch(self, texts):
+        return [VECTORS[text] for text in texts]
+
+
+def build_index(path, entries):
+    save_faq_index(str(path), entries, FakeEmbedding(), "fake-embeddings")
+    return FaqIndex(str(path), threshold=0.9, embeddings_model="fake-embeddings")
+
+
+def test_match_returns_the_most_similar_phrasing(tmp_path):
+    index = build_index(
+        tmp_path,
+        [
+            FaqEntry(
+                question="How do I reset my password?",
+                answer="Use the reset link.",
+                alternates=["I forgot my password"],
+            ),
+            FaqEntry(question="What is Astra DB?", answer="A vector database."),
+        ],
+    )
+
+    match = index.match([0.9, 0.12, 0.0], "default")
+    assert match.entry.answer == "Use the reset link."
+    assert match.question == "I forgot my password"
+    assert match.similarity > 0.99
+
+    assert index.match([0.7, 0.7, 0.0], "default") is None
+
+
+def test_match_respects_personas(tmp_path):
+    index = build_index(
+        tmp_path,
+        [
+            FaqEntry(
+                question="What is Astra DB?",
+                answer="A vector database.",
+                personas=["sales"],
+            ),
+        ],
+    )
+
+    assert index.match([0.0, 1.0, 0.0], "sales").entry.answer == "A vector database."
+    assert index.match([0.0, 1.0, 0.0], "default") is None
+
+
+def test_rebuilt_index_is_reloaded(tmp_path):
+    index = build_index(
+        tmp_path, [FaqEntry(question="What is Astra DB?", answer="A database.")]
+    )
+    index.reload_interval = 0.0
+
+    save_faq_index(
+        str(tmp_path),
+        [FaqEntry(question="What is Astra DB?", answer="A vector database.")],
+        FakeEmbedding(),
+        "fake-embeddings",
+    )
+    # Make sure the rebuild is seen on filesystems with coarse modification times
+    entries_path = os.path.join(tmp_path, FAQ_ENTRIES_FILE)
+    os.utime(entries_path, (0, os.path.getmtime(entries_path) + 1))
+
+    assert index.match([0.0, 1.0, 0.0], "default").entry.answer == "A vector database."
+
+
+def test_index_from_another_embeddings_model_is_rejected(tmp_path):
+    save_faq_index(
+        str(tmp_path),
+        [FaqEntry(question="What is Astra DB?", answer="A vector database.")],
+        FakeEmbedding(),
+        "other-embeddings",
+    )
+    index = FaqIndex(str(tmp_path), embeddings_model="fake-embeddings")
+
+    assert len(index) == 0
+    assert index.match([0.0, 1.0, 0.0], "default") is None
+    with open(os.path.join(tmp_path, FAQ_ENTRIES_FILE)) as f:
+        assert json.load(f)["embeddings_model"] == "other-embeddings"
+
+
+def test_find_matches_canonical_questions_without_embedding(tmp_path):
+    index = build_index(
+        tmp_path,
+        [
+            FaqEntry(
+                question="How do I reset my password?",
+                answer="Use the reset link.",
+                alternates=["I forgot my password"],
+            ),
+        ],
+    )
+
+    match = index.find("  i FORGOT my password!", "default")
+    assert match.entry.answer == "Use the reset link."
+    assert match.question == "I forgot my password"
+    assert index.find("What is Astra DB?", "default") is None
+
+
+def test_index_without_entries_replaces_the_previous_one(tmp_path):
+    index = build_index(
+        tmp_path, [FaqEntry(question="What is Astra DB?", answer="A vector database.")]
+    )
+    assert len(index) == 1
+
+    save_faq_index(str(tmp_path), [], FakeEmbedding(), "fake-embeddings")
+    entries_path = os.path.join(tmp_path, FAQ_ENTRIES_FILE)
+    os.utime(entries_path, (0, os.path.getmtime(entries_path) + 1))
+    index.reload()
+
+    assert len(index) == 0
+    assert index.match([0.0, 1.0, 0.0], "default") is None
+    assert index.find("What is Astra DB?", "default") is None
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from chatbot_api.single_flight import TokenBroadcast
+from pipeline.idempotency import (
+    IdempotencyRecord,
+    IdempotencyStatus,
+    IdempotencyStore,
+    MemoryIdempotencyBackend,
+    SqliteIdempotencyBackend,
+)
+
+
+@pytest.fixture(scope="function", params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryIdempotencyBackend()
+    return SqliteIdempotencyBackend(str(tmp_path / "idempotency.db"))
+
+
+def test_backend_adds_each_key_once_until_it_expires(backend):
+    record = IdempotencyRecord(IdempotencyStatus.InFlight)
+
+    assert backend.add("key", record, ttl=0.2)
+    assert not backend.add("key", record, ttl=0.2)
+    assert backend.get("key").status == IdempotencyStatus.InFlight
+
+    time.sleep(0.3)
+    assert backend.get("key") is None
+    assert backend.add("key", record, ttl=0.2)
+
+
+def test_backend_put_and_delete(backend):
+    backend.put("key", IdempotencyRecord(IdempotencyStatus.Completed, "Hi"), ttl=60)
+    assert backend.get("key").response == "Hi"
+
+    backend.delete("key")
+    assert backend.get("key") is None
+
+
+def test_memory_backend_is_bounded():
+    backend = MemoryIdempotencyBackend(max_entries=2)
+    for key in ["a", "b", "c"]:
+        backend.add(key, IdempotencyRecord(IdempotencyStatus.InFlight), ttl=60)
+
+    assert len(backend) == 2
+    assert backend.get("a") is None
+
+
+def test_duplicates_share_the_in_flight_and_completed_response():
+    store = IdempotencyStore()
+    assert store.begin("key") is None
+
+    broadcast = TokenBroadcast(iter(["Hello", " there"]))
+    store.attach("key", broadcast)
+    duplicate = store.begin("key")
+    assert duplicate.status == IdempotencyStatus.InFlight
+    assert list(store.subscribe("key")) == ["Hello", " there"]
+
+    store.complete("key", broadcast.text)
+    duplicate = store.begin("key")
+    assert duplicate.status == IdempotencyStatus.Completed
+    assert duplicate.response == "Hello there"
+    assert store.subscribe("key") is None
+
+
+def test_failed_responses_can_be_retried():
+    store = IdempotencyStore()
+    assert store.begin("key") is None
+
+    store.fail("key")
+    assert store.begin("key") is None
+
+
+def test_duplicates_wait_for_the_stream_to_start():
+    store = IdempotencyStore()
+    assert store.begin("key") is None
+
+    timer = threading.Timer(
+        0.1, lambda: store.attach("key", TokenBroadcast(iter(["Hello"])))
+    )
+    timer.start()
+    assert list(store.subscribe("key")) == ["Hello"]
@@ -0,0 +1,143 @@
+from unittest.mock import patch
+
+from llama_index.token_counter.mock_embed_model import MockEmbedding
+from llama_index.node_parser import SimpleNodeParser
+
+from chatbot_api.crawl_scrape_docs import output_file_name
+from chatbot_api.dedup import node_sources
+from chatbot_api.ingestion import IngestCheckpoint, IngestPipeline
+from chatbot_api.vector_store import LocalVectorStore
+from pipeline.config import DocSite
+
+SITE = "https://docs.example.com/"
+LINKS = {
+    SITE: {SITE + "a", SITE + "b"},
+    SITE + "a": {SITE + "a/deep"},
+    SITE + "b": set(),
+    SITE + "a/deep": set(),
+}
+
+
+class FakeSite:
+    """Serves the pages in LINKS, recording each fetch"""
+
+    SHARED = "A note repeated on pages of the docs."
+
+    def __init__(self):
+        self.fetched = []
+        self.failing = set()
+        self.version = "1"
+        self.shared = set()
+
+    def fetch_page(self, url):
+        self.fetched.append(url)
+        if url in self.failing:
+            raise ConnectionError(url)
+        records = [
+            {
+                "url": url,
+                "title": "Docs",
+                "section": "",
+                "text": f"The page at {url}, version {self.version}.",
+            }
+        ]
+        if url in self.shared:
+            records.append(
+                {"url": url, "title": "Docs", "section": "Note", "text": self.SHARED}
+            )
+        return records, LINKS[url]
+
+
+def make_pipeline(tmp_path):
+    return IngestPipeline(
+        LocalVectorStore(str(tmp_path / "store"), embedding_dimension=3),
+        MockEmbedding(embed_dim=3),
+        SimpleNodeParser.from_defaults(chunk_size=250, chunk_overlap=0),
+        IngestCheckpoint(str(tmp_path / "checkpoint.sqlite")),
+        batch_size=2,
+    )
+
+
+def test_sites_are_crawled_to_their_depth_and_resumed(tmp_path):
+    site = FakeSite()
+    site.failing = {SITE + "a"}
+    pipeline = make_pipeline(tmp_path)
+    with patch("chatbot_api.ingestion.fetch_page", site.fetch_page):
+        stats = pipeline.run([DocSite(url=SITE, depth=2)])
+
+        assert sorted(site.fetched) == [SITE, SITE + "a", SITE + "b"]
+        assert stats.failed_urls == [SITE + "a"]
+        assert pipeline.vector_store.count == 2
+
+        # Only the page that failed, and the pages linked from it, are fetched
+        site.fetched = []
+        site.failing = set()
+        pipeline.run([DocSite(url=SITE, depth=2)])
+
+        assert site.fetched == [SITE + "a", SITE + "a/deep"]
+        assert pipeline.vector_store.count == 4
+
+
+def test_only_changed_pages_are_reingested_on_refresh(tmp_path):
+    site = FakeSite()
+    pipeline = make_pipeline(tmp_path)
+    sites = [DocSite(url=SITE, depth=1, refresh_hours=0)]
+    with patch("chatbot_api.ingestion.fetch_page", site.fetch_page):
+        pipeline.run(sites)
+        stats = pipeline.run(sites)
+        assert stats.pages_fetched == 3
+        assert stats.pages_unchanged == 3
+        assert stats.chunks == 0
+
+        site.version = "2"
+        stats = pipeline.run(sites)
+
+    assert stats.chunks == 3
+    texts = {node.get_content() for node in pipeline.vector_store._nodes}
+    assert texts == {
+        f"The page at {url}, version 2." for url in [SITE, SITE + "a", SITE + "b"]
+    }
+
+
+def shared_chunks(pipeline):
+    return [
+        node for node in pipeline.vector_store._nodes if node.text == FakeSite.SHARED
+    ]
+
+
+def test_chunks_shared_by_pages_are_stored_once_until_no_page_has_them(tmp_path):
+    site = FakeSite()
+    site.shared = set(LINKS)
+    pipeline = make_pipeline(tmp_path)
+    sites = [DocSite(url=SITE, depth=1, refresh_hours=0)]
+    pages = [SITE, SITE + "a", SITE + "b"]
+    with patch("chatbot_api.ingestion.fetch_page", site.fetch_page):
+        stats = pipeline.run(sites)
+        assert stats.duplicate_chunks == 2
+        assert pipeline.vector_store.count == 4
+        (shared,) = shared_chunks(pipeline)
+        assert sorted(node_sources(shared)) == pages
+
+        # The shared chunk is kept while any page still has it
+        site.version = "2"
+        site.shared = {SITE + "b"}
+        pipeline.run(sites)
+        assert pipeline.vector_store.count == 4
+        (shared,) = shared_chunks(pipeline)
+        assert node_sources(shared) == [SITE + "b"]
+
+        site.version = "3"
+        site.shared = set()
+        pipeline.run(sites)
+
+    assert pipeline.vector_store.count == 3
+    assert shared_chunks(pipeline) == []
+
+
+def test_output_file_names_are_unique():
+    assert output_file_name("https://a.com/docs/index.html") != output_file_name(
+        "https://b.com/docs/index.html"
+    )
+    assert output_file_name("https://a.com/docs/index.html").startswith(
+        "a.com_docs_index.html-"
+    )
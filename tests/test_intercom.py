@@ -0,0 +1,158 @@
+import hashlib
+import hmac
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from integrations.intercom import (
+    IntercomConversationInfo,
+    IntercomResponseActor,
+    IntercomResponseDecider,
+    validate_signature,
+)
+from pipeline import fast_json
+
+SECRET = "intercom-secret"
+
+
+def sign(content, digestmod=hashlib.sha256):
+    return hmac.new(SECRET.encode("utf-8"), msg=content, digestmod=digestmod)
+
+
+@pytest.fixture(scope="function")
+def intercom_content():
+    with open(os.path.join("tests", "test_request_intercom.json"), "rb") as f:
+        # Exactly as Intercom would send it, not in the order json.dumps would give
+        return f.read()
+
+
+def test_signature_is_checked_against_the_raw_body(intercom_content):
+    sha256 = sign(intercom_content).hexdigest()
+    sha1 = sign(intercom_content, hashlib.sha1).hexdigest()
+
+    assert validate_signature(
+        {"X-Hub-Signature-256": f"sha256={sha256}"}, intercom_content, SECRET
+    )
+    assert validate_signature(
+        {"X-Hub-Signature": f"sha1={sha1}"}, intercom_content, SECRET
+    )
+    reencoded = json.dumps(json.loads(intercom_content)).encode("utf-8")
+    assert not validate_signature(
+        {"X-Hub-Signature-256": f"sha256={sha256}"}, reencoded, SECRET
+    )
+    assert not validate_signature(
+        {"X-Hub-Signature": f"md5={sha1}"}, intercom_content, SECRET
+    )
+    assert not validate_signature({}, intercom_content, SECRET)
+
+
+def test_decider_accepts_signed_webhooks(init_config, intercom_content):
+    config = init_config.model_copy(
+        update={"intercom_client_secret": SECRET, "intercom_token": "token"}
+    )
+    decider = IntercomResponseDecider(config)
+    headers = {"X-Hub-Signature-256": f"sha256={sign(intercom_content).hexdigest()}"}
+
+    with patch.object(decider, "get_intercom_contact_by_id", return_value={}):
+        decision = decider.make_response_decision(
+            fast_json.loads(intercom_content), headers, intercom_content
+        )
+    assert not decision.should_return_early
+    assert decision.conversation_info.user_question == "This is a test question"
+    assert decision.idempotency_key.startswith("intercom:181643600711471:")
+
+    decision = decider.make_response_decision(
+        fast_json.loads(intercom_content), headers, intercom_content + b" "
+    )
+    assert decision.response_code == 401
+
+
+@pytest.mark.parametrize(
+    "idempotency_path,responds", [(None, False), ("idempotency.db", True)]
+)
+def test_redeliveries_need_a_shared_idempotency_store(
+    init_config, intercom_content, idempotency_path, responds
+):
+    config = init_config.model_copy(
+        update={
+            "intercom_client_secret": SECRET,
+            "intercom_token": "token",
+            "idempotency_path": idempotency_path,
+        }
+    )
+    decider = IntercomResponseDecider(config)
+    content = intercom_content.replace(
+        b'"delivery_attempts": 1', b'"delivery_attempts": 2'
+    )
+    headers = {"X-Hub-Signature-256": f"sha256={sign(content).hexdigest()}"}
+
+    with patch.object(decider, "get_intercom_contact_by_id", return_value={}):
+        decision = decider.make_response_decision(
+            fast_json.loads(content), headers, content
+        )
+    assert decision.should_return_early != responds
+
+
+def test_replies_are_sent_in_parts(init_config):
+    config = init_config.model_copy(
+        update={
+            "intercom_token": "token",
+            "intercom_progressive_replies": True,
+            "intercom_progressive_interval_seconds": 0,
+        }
+    )
+    actor = IntercomResponseActor(config)
+    conv_info = IntercomConversationInfo(
+        conversation_id="1",
+        contact={},
+        user_question="Question",
+        is_user=True,
+        debug_mode=False,
+        source_url="",
+    )
+
+    with patch.object(actor, "send_intercom_message") as send_message:
+        assert actor.streams_response(conv_info)
+        actor.stream_action(conv_info, iter(["First part.\n", "\nSecond part."]))
+        actor.take_action(conv_info, "First part.\n\nSecond part.", "", "")
+
+    assert [c.args[1] for c in send_message.call_args_list] == [
+        "First part.",
+        "Second part.",
+    ]
+
+
+def test_rest_of_reply_is_sent_if_streaming_fails(init_config):
+    config = init_config.model_copy(
+        update={
+            "intercom_token": "token",
+            "intercom_progressive_replies": True,
+            "intercom_progressive_interval_seconds": 0,
+        }
+    )
+    actor = IntercomResponseActor(config)
+    conv_info = IntercomConversationInfo(
+        conversation_id="1",
+        contact={},
+        user_question="Question",
+        is_user=True,
+        debug_mode=False,
+        source_url="",
+    )
+
+    def tokens():
+        yield "First part.\n"
+        yield "\nSecond"
+        raise ConnectionError()
+
+    with patch.object(actor, "send_intercom_message") as send_message:
+        with pytest.raises(ConnectionError):
+            actor.stream_action(conv_info, tokens())
+        actor.take_action(conv_info, "First part.\n\nSecond part.", "", "")
+
+    assert [c.args[1] for c in send_message.call_args_list] == [
+        "First part.",
+        "Second part.",
+    ]
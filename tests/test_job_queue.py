@@ -0,0 +1,121 @@
+import threading
+
+import pytest
+
+from pipeline.job_queue import (
+    Job,
+    JobDeferred,
+    JobFailed,
+    JobQueue,
+    MemoryJobQueueBackend,
+    SqliteJobQueueBackend,
+)
+
+
+@pytest.fixture(scope="function", params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobQueueBackend()
+    return SqliteJobQueueBackend(str(tmp_path / "jobs.db"))
+
+
+def test_jobs_are_claimed_by_priority_then_order(backend):
+    for name, priority in [("a", 0), ("b", 1), ("c", 0)]:
+        backend.put(Job({"name": name}, priority))
+
+    names = [backend.claim(lease=60).payload["name"] for _ in range(3)]
+    assert names == ["b", "a", "c"]
+    assert backend.claim(lease=60) is None
+    assert backend.size() == 3
+
+
+def test_delayed_jobs_wait(backend):
+    backend.put(Job({}), delay=60)
+    assert backend.claim(lease=60) is None
+
+
+def test_sqlite_jobs_survive_restarts_and_lost_workers(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    SqliteJobQueueBackend(path).put(Job({"name": "a"}))
+
+    backend = SqliteJobQueueBackend(path)
+    job = backend.claim(lease=0)
+    assert job.payload == {"name": "a"}
+    assert job.attempts == 1
+
+    # The lease expired without the job completing, so it runs again
+    job = SqliteJobQueueBackend(path).claim(lease=60)
+    assert job.attempts == 2
+    backend.complete(job)
+    assert backend.size() == 0
+
+
+def test_failed_jobs_are_retried_then_given_up_on():
+    attempts = []
+    failures = []
+
+    def handler(job):
+        attempts.append(job.attempts)
+        raise ValueError("Failed")
+
+    queue = JobQueue(
+        handler,
+        max_attempts=2,
+        retry_delay=0,
+        on_failure=lambda job, e: failures.append(e),
+    )
+    queue.enqueue({})
+
+    assert queue.run_next()
+    assert queue.run_next()
+    assert not queue.run_next()
+    assert attempts == [1, 2]
+    assert len(failures) == 1
+    assert queue.backend.size() == 0
+
+
+def test_deferred_jobs_run_again_without_counting_the_attempt(backend):
+    attempts = []
+
+    def handler(job):
+        attempts.append(job.attempts)
+        if len(attempts) < 3:
+            raise JobDeferred("busy", delay=0)
+
+    queue = JobQueue(handler, backend=backend, max_attempts=1)
+    queue.enqueue({})
+
+    for _ in range(3):
+        assert queue.run_next()
+    assert attempts == [1, 1, 1]
+    assert queue.backend.size() == 0
+
+
+def test_jobs_that_failed_for_good_are_not_retried():
+    failures = []
+
+    def handler(job):
+        raise JobFailed("Sent part of the response")
+
+    queue = JobQueue(
+        handler,
+        max_attempts=3,
+        retry_delay=0,
+        on_failure=lambda job, e: failures.append(e),
+    )
+    queue.enqueue({})
+
+    assert queue.run_next()
+    assert not queue.run_next()
+    assert len(failures) == 1
+
+
+def test_workers_run_queued_jobs():
+    done = threading.Event()
+    queue = JobQueue(lambda job: done.set(), workers=2)
+    queue.start()
+    try:
+        queue.enqueue({})
+        assert done.wait(5)
+    finally:
+        queue.stop(timeout=5)
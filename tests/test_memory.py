@@ -0,0 +1,61 @@
+import os
+import time
+
+from chatbot_api.memory import ConversationMemoryStore, SqliteMemoryBackend
+
+
+def wait_for_summaries(memory):
+    # Summaries are produced in the background
+    memory._executor.submit(lambda: None).result()
+
+
+def test_conversations_are_isolated():
+    memory = ConversationMemoryStore()
+    memory.add_turn("conv-1", "What is Astra?", "A database.")
+
+    assert [t.content for t in memory.get_history("conv-1").turns] == [
+        "What is Astra?",
+        "A database.",
+    ]
+    assert memory.get_history("conv-2").turns == []
+
+
+def test_old_turns_are_summarized_within_budget():
+    folded = []
+
+    def summarizer(summary, turns):
+        folded.extend(turns)
+        return summary + f"[{len(turns)} turns]"
+
+    memory = ConversationMemoryStore(token_budget=40, summarizer=summarizer)
+    for i in range(10):
+        memory.add_turn("conv", f"Question number {i} " * 3, f"Answer {i} " * 3)
+        wait_for_summaries(memory)
+
+    history = memory.get_history("conv")
+    assert history.summary.startswith("[")
+    assert folded[0].content.startswith("Question number 0")
+    assert history.turn_tokens <= 40
+    assert history.turns[-1].content.startswith("Answer 9")
+
+
+def test_idle_and_least_recently_used_conversations_are_evicted():
+    memory = ConversationMemoryStore(max_conversations=3, idle_seconds=0.05)
+    for i in range(5):
+        memory.add_turn(f"conv-{i}", "question", "answer")
+    assert len(memory) == 3
+
+    time.sleep(0.1)
+    memory.add_turn("conv-new", "question", "answer")
+    assert len(memory) == 1
+
+
+def test_external_store_survives_eviction(tmp_path):
+    backend = SqliteMemoryBackend(os.path.join(tmp_path, "memory.db"))
+    memory = ConversationMemoryStore(max_conversations=1, backend=backend)
+
+    memory.add_turn("conv-1", "What is Astra?", "A database.")
+    memory.add_turn("conv-2", "What is Cassandra?", "Also a database.")
+    assert len(memory) == 1
+
+    assert memory.get_history("conv-1").turns[1].content == "A database."
@@ -0,0 +1,35 @@
+import pytest
+
+from chatbot_api.normalize import canonical_question, html_to_text
+
+
+@pytest.mark.parametrize(
+    "body, text",
+    [
+        ("<p>How do I create a database?</p>", "How do I create a database?"),
+        ("<p>First line<br>second line</p>", "First line\nsecond line"),
+        ("<p>One</p><p>Two</p>", "One\n\nTwo"),
+        ("Use <b>vector</b>&nbsp;search", "Use vector search"),
+        ("Is 1 &lt; 2 &amp;&amp; 3 &gt; 2?", "Is 1 < 2 && 3 > 2?"),
+        ("Escaped &lt;b&gt;markup&lt;/b&gt;", "Escaped <b>markup</b>"),
+        ("  lots \t of\n\n\n\n space  ", "lots of\n\nspace"),
+        ("<p>   </p><br/>", ""),
+        ("a < b and c > d", "a < b and c > d"),
+    ],
+)
+def test_html_to_text(body, text):
+    assert html_to_text(body) == text
+
+
+def test_canonical_question_ignores_trivial_differences():
+    assert canonical_question("How do I create a DATABASE?") == canonical_question(
+        "  how do i\ncreate a database ?! "
+    )
+    assert canonical_question("ﬁle limits") == "file limits"
+    assert canonical_question("What is Astra?") != canonical_question("What is CQL?")
+
+
+def test_normalizing_is_fast_on_pathological_input():
+    body = "<a" * 100_000
+    assert html_to_text(body) == body
+    assert canonical_question("?" * 100_000 + "x") == "?" * 100_000 + "x"
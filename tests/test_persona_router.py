@@ -0,0 +1,64 @@
+import os
+import time
+
+from chatbot_api.persona_router import CompiledRules, PersonaRouter
+
+RULES = [
+    {
+        "persona": "developer",
+        "match": {"custom_attributes.role": ["Developer", "engineer"]},
+    },
+    {
+        "persona": "enterprise",
+        "match": {"custom_attributes.plan": "enterprise", "role": "user"},
+    },
+    {"persona": "lead", "match": {"role": "lead"}},
+]
+
+
+def test_first_matching_rule_wins():
+    rules = CompiledRules(RULES)
+
+    developer = {
+        "role": "user",
+        "custom_attributes": {"role": "developer", "plan": "enterprise"},
+    }
+    assert rules.classify(developer) == "developer"
+
+    enterprise = {
+        "role": "user",
+        "custom_attributes": {"role": "pm", "plan": "Enterprise"},
+    }
+    assert rules.classify(enterprise) == "enterprise"
+
+    assert rules.classify({"role": "lead"}) == "lead"
+
+
+def test_unmatched_contacts_use_default():
+    rules = CompiledRules(RULES, default="fallback")
+
+    # Only one of the two enterprise conditions holds
+    partial_match = {"role": "lead", "custom_attributes": {"plan": "enterprise"}}
+    assert rules.classify(partial_match) == "lead"
+    assert rules.classify({"role": "user"}) == "fallback"
+    assert rules.classify({}) == "fallback"
+    assert rules.classify(None) == "fallback"
+
+
+def test_router_reloads_changed_rules(tmp_path):
+    rules_path = os.path.join(tmp_path, "persona_rules.yml")
+    router = PersonaRouter(rules_path, reload_interval=0)
+
+    # No rules file yet
+    assert router.get_persona({"role": "lead"}) == "default"
+
+    with open(rules_path, "w") as f:
+        f.write("rules:\n  - persona: lead\n    match:\n      role: lead\n")
+    assert router.get_persona({"role": "lead"}) == "lead"
+
+    # Make sure the modification time changes on coarse-grained filesystems
+    time.sleep(0.01)
+    with open(rules_path, "w") as f:
+        f.write("default: other\nrules: []\n")
+    os.utime(rules_path, (time.time() + 1, time.time() + 1))
+    assert router.get_persona({"role": "lead"}) == "other"
@@ -0,0 +1,45 @@
+import time
+
+from chatbot_api.progressive import split_on_boundaries
+from pipeline.config import ReplyBoundary
+
+
+def tokenize(text):
+    return [text[i : i + 3] for i in range(0, len(text), 3)]
+
+
+def test_parts_end_on_paragraphs():
+    text = "First paragraph. Still first.\n\nSecond paragraph.\n\nThird"
+    parts = list(split_on_boundaries(tokenize(text), min_interval=0))
+
+    assert parts == ["First paragraph. Still first.", "Second paragraph.", "Third"]
+
+
+def test_parts_end_on_sentences():
+    text = "One sentence. Another one! A third?"
+    parts = list(
+        split_on_boundaries(tokenize(text), ReplyBoundary.Sentence, min_interval=0)
+    )
+
+    assert parts == ["One sentence.", "Another one!", "A third?"]
+
+
+def test_code_blocks_are_not_split():
+    text = "Run this:\n\n```\nfirst\n\nsecond\n```\n\nDone."
+    parts = list(split_on_boundaries(tokenize(text), min_interval=0))
+
+    assert parts == ["Run this:", "```\nfirst\n\nsecond\n```", "Done."]
+
+
+def test_parts_are_rate_limited():
+    def slow_tokens():
+        for token in tokenize("One. Two. Three. Four."):
+            time.sleep(0.01)
+            yield token
+
+    parts = list(
+        split_on_boundaries(slow_tokens(), ReplyBoundary.Sentence, min_interval=60)
+    )
+
+    # The first part is sent straight away, and the rest once the stream ends
+    assert parts == ["One.", "Two. Three. Four."]
@@ -0,0 +1,84 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from chatbot_api.providers import CircuitBreaker, Provider, ProviderPool
+
+
+class StubLLM:
+    """Streams fixed tokens after a delay, optionally failing before the first"""
+
+    def __init__(self, tokens, delay=0.0, fail=False):
+        self.tokens = tokens
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def stream_chat(self, messages):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("provider unavailable")
+        for token in self.tokens:
+            yield SimpleNamespace(delta=token)
+
+
+def make_pool(*llms, **kwargs):
+    providers = [
+        Provider(f"provider-{i}", llm, CircuitBreaker(failure_threshold=2))
+        for i, llm in enumerate(llms)
+    ]
+    return ProviderPool(providers, **kwargs)
+
+
+def test_fails_over_before_first_token():
+    primary = StubLLM(["primary"], fail=True)
+    fallback = StubLLM(["fallback", " response"])
+    pool = make_pool(primary, fallback)
+
+    assert "".join(pool.stream_tokens([])) == "fallback response"
+
+
+def test_open_circuit_skips_provider():
+    primary = StubLLM(["primary"], fail=True)
+    fallback = StubLLM(["fallback"])
+    pool = make_pool(primary, fallback)
+
+    for _ in range(3):
+        assert "".join(pool.stream_tokens([])) == "fallback"
+
+    # The circuit opened after two failures, so the third request skipped it
+    assert primary.calls == 2
+    assert pool.providers[0].breaker.state == CircuitBreaker.OPEN
+
+
+def test_all_providers_failing_raises():
+    pool = make_pool(StubLLM([], fail=True), StubLLM([], fail=True))
+    with pytest.raises(RuntimeError):
+        list(pool.stream_tokens([]))
+
+
+def test_slow_primary_is_hedged():
+    primary = StubLLM(["slow"], delay=0.5)
+    fallback = StubLLM(["fast"])
+    pool = make_pool(primary, fallback, hedge=True, hedge_min_delay=0.05)
+
+    start = time.monotonic()
+    assert "".join(pool.stream_tokens([])) == "fast"
+    assert time.monotonic() - start < 0.4
+    assert fallback.calls == 1
+
+    # The time to the first token of the attempt that lost is still sampled
+    time.sleep(0.6)
+    assert pool.providers[0].time_to_first_token.count == 1
+    assert pool.providers[0].time_to_first_token.quantile(0.5) >= 0.5
+
+
+def test_fast_primary_is_not_hedged():
+    primary = StubLLM(["fast"])
+    fallback = StubLLM(["unused"])
+    pool = make_pool(primary, fallback, hedge=True, hedge_min_delay=0.5)
+
+    assert "".join(pool.stream_tokens([])) == "fast"
+    assert fallback.calls == 0
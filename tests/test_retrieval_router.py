@@ -0,0 +1,29 @@
+import pytest
+
+from chatbot_api.retrieval_router import RetrievalRoute, route_question
+
+
+@pytest.mark.parametrize(
+    "question",
+    ["Hi!", "thanks so much", "OK, got it", "Thank you very much.", "[NO CONTEXT] hi"],
+)
+def test_small_talk_skips_retrieval(question):
+    assert route_question(question) == RetrievalRoute.Skip
+
+
+def test_rephrasing_skips_retrieval_only_in_a_conversation():
+    question = "Can you explain that more simply?"
+    assert route_question(question, in_conversation=True) == RetrievalRoute.Skip
+    assert route_question(question) != RetrievalRoute.Skip
+
+
+def test_simple_questions_get_fewer_documents_than_complex_ones():
+    assert route_question("How do I create a database?") == RetrievalRoute.Small
+    assert route_question("Hi, how do I create a database?") == RetrievalRoute.Small
+    assert (
+        route_question(
+            "My `session.execute()` call fails with a timeout error on driver 4.17, "
+            "what is the difference between the sync and async drivers?"
+        )
+        == RetrievalRoute.Large
+    )
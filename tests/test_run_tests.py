@@ -0,0 +1,111 @@
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+import pytest
+
+os.environ.setdefault("SCORECARD_API_KEY", "test-key")
+
+import run_tests
+import scorecard
+from benchmarks.scorecard_stub import make_stub_scorecard_app
+
+
+@pytest.fixture(scope="function")
+def stub_scorecard():
+    """Routes Scorecard API calls to the local stand-in"""
+    stub_app = make_stub_scorecard_app(testset_size=25)
+    with patch.object(scorecard, "session", TestClient(stub_app)):
+        yield stub_app
+
+
+@pytest.fixture(scope="function")
+def chatbot_queries(init_config):
+    """Replaces the chatbot app with one that answers instantly"""
+    queries = []
+    chat_app = FastAPI()
+    chat_app.state.failing = set()
+
+    @chat_app.post("/chat")
+    async def chat(request: Request):
+        question = (await request.json())["question"]
+        queries.append(question)
+        if question in chat_app.state.failing:
+            raise RuntimeError(f"Failed to answer {question}")
+        return PlainTextResponse(f"Answer to {question}", status_code=201)
+
+    app_module = SimpleNamespace(
+        app=chat_app, assistant=SimpleNamespace(k=4, version=None), config=init_config
+    )
+    with patch.dict(sys.modules, {"app": app_module}):
+        yield queries, chat_app.state.failing
+
+
+def test_runs_every_testcase(stub_scorecard, chatbot_queries, tmp_path):
+    run_tests.run_all_tests(
+        1,
+        1,
+        workers=4,
+        batch_size=7,
+        cache_path=os.path.join(tmp_path, "cache.jsonl"),
+        checkpoint_dir=tmp_path,
+    )
+
+    records = stub_scorecard.state.testrecords
+    assert sorted(record["testcase_id"] for record in records) == list(range(25))
+    assert all(record["model_response"].startswith("Answer") for record in records)
+    assert stub_scorecard.state.runs[1]["status"] == "awaiting_scoring"
+    assert len(chatbot_queries[0]) == 25
+
+
+def test_unchanged_testcases_use_cache(stub_scorecard, chatbot_queries, tmp_path):
+    for _ in range(2):
+        run_tests.run_all_tests(
+            1,
+            1,
+            cache_path=os.path.join(tmp_path, "cache.jsonl"),
+            checkpoint_dir=tmp_path,
+        )
+
+    # Both runs are recorded, but the chatbot was only queried for the first
+    assert len(stub_scorecard.state.testrecords) == 50
+    assert len(chatbot_queries[0]) == 25
+
+
+def test_resume_skips_recorded_testcases(stub_scorecard, chatbot_queries, tmp_path):
+    run_tests.run_all_tests(1, 1, cache_path=None, checkpoint_dir=tmp_path)
+    run_tests.run_all_tests(
+        1, 1, resume_run_id=1, cache_path=None, checkpoint_dir=tmp_path
+    )
+
+    assert len(stub_scorecard.state.testrecords) == 25
+    assert len(chatbot_queries[0]) == 25
+
+
+def test_failed_testcases_are_retried_on_resume(
+    stub_scorecard, chatbot_queries, tmp_path
+):
+    queries, failing = chatbot_queries
+    failing.add("What are the benefits of vector search? (case 3)")
+    run_tests.run_all_tests(
+        1, 1, batch_size=4, cache_path=None, checkpoint_dir=tmp_path
+    )
+
+    records = stub_scorecard.state.testrecords
+    assert sorted(record["testcase_id"] for record in records) == [
+        i for i in range(25) if i != 3
+    ]
+    assert stub_scorecard.state.runs[1]["status"] == "running_execution"
+
+    failing.clear()
+    run_tests.run_all_tests(
+        1, 1, resume_run_id=1, cache_path=None, checkpoint_dir=tmp_path
+    )
+
+    assert sorted(record["testcase_id"] for record in records) == list(range(25))
+    assert stub_scorecard.state.runs[1]["status"] == "awaiting_scoring"
+    assert len(queries) == 26
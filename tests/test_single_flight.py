@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from chatbot_api.single_flight import SingleFlight, TokenBroadcast
+
+
+def slow_tokens(tokens, delay=0.01):
+    for token in tokens:
+        time.sleep(delay)
+        yield token
+
+
+def test_broadcast_replays_to_late_subscribers():
+    broadcast = TokenBroadcast(iter(["a", "b", "c"]))
+
+    first = broadcast.subscribe()
+    assert next(first) == "a"
+
+    # A subscriber joining mid-stream still sees every token
+    assert list(broadcast.subscribe()) == ["a", "b", "c"]
+    assert list(first) == ["b", "c"]
+    assert broadcast.done
+
+
+def test_broadcast_propagates_errors():
+    def failing():
+        yield "a"
+        raise RuntimeError("upstream failed")
+
+    broadcast = TokenBroadcast(failing())
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            list(broadcast.subscribe())
+
+
+def test_buffered_tokens_are_read_while_the_source_is_waited_on():
+    release = threading.Event()
+
+    def blocking():
+        yield "a"
+        release.wait()
+        yield "b"
+
+    broadcast = TokenBroadcast(blocking())
+    first = broadcast.subscribe()
+    assert next(first) == "a"
+    waiting = threading.Thread(target=lambda: list(first))
+    waiting.start()
+    time.sleep(0.05)
+
+    # Doesn't wait for the subscriber pulling the next token
+    second = broadcast.subscribe()
+    read = []
+    reader = threading.Thread(target=lambda: read.append(next(second)))
+    reader.start()
+    reader.join(timeout=1)
+    release.set()
+    assert read == ["a"]
+    assert list(second) == ["b"]
+    waiting.join()
+
+
+def test_concurrent_calls_are_coalesced():
+    single_flight = SingleFlight()
+    calls = []
+    results = []
+
+    def generate():
+        calls.append(1)
+        time.sleep(0.05)
+        return slow_tokens(["Mocked", " ", "response"]), "context"
+
+    def worker():
+        response_gen, extra, _ = single_flight.do("question", generate)
+        results.append(("".join(response_gen), extra))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [("Mocked response", "context")] * 8
+
+    # Once the stream has finished, the next call goes upstream again
+    assert len(single_flight) == 0
+    response_gen, _, shared = single_flight.do("question", generate)
+    assert "".join(response_gen) == "Mocked response"
+    assert not shared
+    assert len(calls) == 2
+
+
+def test_leader_errors_are_shared_and_forgotten():
+    single_flight = SingleFlight()
+
+    def failing():
+        raise ValueError("retrieval failed")
+
+    with pytest.raises(ValueError):
+        single_flight.do("question", failing)
+    assert len(single_flight) == 0
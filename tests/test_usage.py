@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from chatbot_api.usage import UsageTracker
+from pipeline.config import ModelCost
+
+
+def test_usage_is_totalled_priced_and_logged(tmp_path):
+    log_path = tmp_path / "usage.log"
+    tracker = UsageTracker(
+        "gpt-4",
+        integration="Intercom",
+        model_costs={"gpt-4": ModelCost(prompt=0.03, completion=0.06)},
+        log_path=str(log_path),
+    )
+
+    for _ in range(2):
+        usage = tracker.record(
+            "default", "Answer using: the docs", "the docs", "An answer"
+        )
+    assert 0 < usage.context_tokens < usage.prompt_tokens
+    assert usage.cost == pytest.approx(
+        (usage.prompt_tokens * 0.03 + usage.completion_tokens * 0.06) / 1000
+    )
+
+    [totals] = tracker.summary()
+    assert totals["persona"] == "default"
+    assert totals["integration"] == "Intercom"
+    assert totals["requests"] == 2
+    assert totals["prompt_tokens"] == 2 * usage.prompt_tokens
+    assert totals["cost"] == pytest.approx(2 * usage.cost)
+
+    lines = log_path.read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])["completion_tokens"] == usage.completion_tokens
+
+
+def test_models_without_a_cost_are_still_counted():
+    tracker = UsageTracker("unpriced-model")
+    usage = tracker.record("default", "Prompt", "", "Completion")
+
+    assert usage.prompt_tokens > 0
+    assert usage.context_tokens == 0
+    assert usage.cost == 0
+
+
+def test_responses_not_generated_cost_nothing():
+    tracker = UsageTracker(
+        "gpt-4", model_costs={"gpt-4": ModelCost(prompt=0.03, completion=0.06)}
+    )
+    tracker.record("default", "Prompt", "", "Completion")
+    usage = tracker.record("default", generated=False)
+
+    assert not usage.generated
+    assert usage.prompt_tokens == usage.completion_tokens == 0
+    assert usage.cost == 0
+    [totals] = tracker.summary()
+    assert totals["requests"] == 2
+    assert totals["generations"] == 1
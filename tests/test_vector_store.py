@@ -0,0 +1,201 @@
+from unittest.mock import MagicMock, patch
+
+from llama_index.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.vector_stores.types import (
+    ExactMatchFilter,
+    MetadataFilters,
+    VectorStoreQuery,
+)
+import numpy as np
+import pytest
+
+from chatbot_api.vector_store import (
+    LocalVectorStore,
+    ProjectedAstraDBVectorStore,
+    read_manifest,
+)
+from pipeline.config import Quantization
+
+
+def make_node(node_id, embedding, doc_id="doc", **metadata):
+    return TextNode(
+        id_=node_id,
+        text=f"Text of {node_id}",
+        embedding=embedding,
+        metadata=metadata,
+        relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=doc_id)},
+    )
+
+
+@pytest.fixture(scope="function")
+def store(tmp_path):
+    store = LocalVectorStore(str(tmp_path), embedding_dimension=3)
+    store.add(
+        [
+            make_node("x", [1.0, 0.0, 0.0], product="astra"),
+            make_node("y", [0.0, 2.0, 0.0], product="cassandra"),
+            make_node("xy", [1.0, 1.0, 0.0], product="astra"),
+        ]
+    )
+    return store
+
+
+def test_query_returns_nearest_by_cosine(store):
+    result = store.query(
+        VectorStoreQuery(query_embedding=[0.1, 1.0, 0.0], similarity_top_k=2)
+    )
+
+    assert result.ids == ["y", "xy"]
+    assert result.nodes[0].get_content() == "Text of y"
+    assert result.similarities[0] > result.similarities[1]
+
+
+def test_query_applies_filters(store):
+    filters = MetadataFilters(filters=[ExactMatchFilter(key="product", value="astra")])
+    result = store.query(
+        VectorStoreQuery(
+            query_embedding=[0.0, 1.0, 0.0], similarity_top_k=5, filters=filters
+        )
+    )
+
+    assert result.ids == ["xy", "x"]
+
+
+def test_store_is_persisted(store, tmp_path):
+    reopened = LocalVectorStore(str(tmp_path), embedding_dimension=3)
+    result = reopened.query(
+        VectorStoreQuery(query_embedding=[1.0, 0.0, 0.0], similarity_top_k=1)
+    )
+
+    assert result.ids == ["x"]
+    assert read_manifest(str(tmp_path))["count"] == 3
+    with pytest.raises(ValueError):
+        LocalVectorStore(str(tmp_path), embedding_dimension=4)
+
+
+def test_delete_removes_document_nodes(tmp_path):
+    store = LocalVectorStore(str(tmp_path), embedding_dimension=2)
+    store.add(
+        [
+            make_node("a", [1.0, 0.0], doc_id="doc1"),
+            make_node("b", [0.0, 1.0], doc_id="doc2"),
+        ]
+    )
+    store.delete("doc1")
+
+    reopened = LocalVectorStore(str(tmp_path), embedding_dimension=2)
+    result = reopened.query(
+        VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=2)
+    )
+    assert result.ids == ["b"]
+
+
+@pytest.mark.parametrize("quantization", [Quantization.Int8, Quantization.Binary])
+def test_quantized_search_rescores_exactly(tmp_path, quantization):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 16))
+    nodes = [make_node(str(i), vector.tolist()) for i, vector in enumerate(vectors)]
+    exact = LocalVectorStore(str(tmp_path / "exact"), embedding_dimension=16)
+    exact.add(nodes)
+    quantized = LocalVectorStore(
+        str(tmp_path / "quantized"),
+        embedding_dimension=16,
+        quantization=quantization,
+        rescore_factor=10,
+    )
+    quantized.add(nodes)
+
+    for query_vector in rng.normal(size=(5, 16)).tolist():
+        query = VectorStoreQuery(query_embedding=query_vector, similarity_top_k=5)
+        exact_result = exact.query(query)
+        quantized_result = quantized.query(query)
+        # With every candidate rescored, only the similarities' precision can differ
+        assert quantized_result.ids == exact_result.ids
+        assert quantized_result.similarities == pytest.approx(
+            exact_result.similarities, abs=1e-5
+        )
+
+    assert quantized.index_bytes < exact.index_bytes
+
+
+def test_metadata_filter_accepts_any_of_a_list(tmp_path):
+    store = LocalVectorStore(str(tmp_path), embedding_dimension=2)
+    store.add(
+        [
+            make_node("v6", [1.0, 0.0], version="6.8"),
+            make_node("v7", [1.0, 0.1], version="7.0"),
+            make_node("v5", [1.0, 0.0], version="5.1"),
+        ]
+    )
+    query = VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=3)
+
+    result = store.query(query, metadata_filter={"version": ["6.8", "7.0"]})
+    assert result.ids == ["v6", "v7"]
+    result = store.query(query, metadata_filter={"version": "4.0"})
+    assert result.ids == []
+
+
+def test_astra_query_is_projected_and_filtered():
+    collection = MagicMock()
+    collection.vector_find.return_value = [
+        {
+            "_id": "node-1",
+            "content": "Text of node-1",
+            "metadata": {"source": "https://docs.example.com"},
+            "$similarity": 0.9,
+        }
+    ]
+    with patch("astrapy.db.AstraDB") as astra_db:
+        astra_db.return_value.create_collection.return_value = collection
+        store = ProjectedAstraDBVectorStore(
+            metadata_fields=["source"],
+            token="token",
+            api_endpoint="http://localhost",
+            collection_name="data",
+            embedding_dimension=2,
+        )
+
+    result = store.query(
+        VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=1),
+        metadata_filter={"product": "astra", "version": ["6.8", "7.0"]},
+    )
+
+    kwargs = collection.vector_find.call_args.kwargs
+    assert kwargs["fields"] == ["content", "metadata.source"]
+    assert kwargs["filter"] == {
+        "metadata.product": "astra",
+        "metadata.version": {"$in": ["6.8", "7.0"]},
+    }
+    assert result.nodes[0].get_content() == "Text of node-1"
+    assert result.nodes[0].metadata == {"source": "https://docs.example.com"}
+    assert result.similarities == [0.9]
+
+
+def test_astra_deletes_are_batched_until_all_are_deleted():
+    node_ids = [f"node-{i}" for i in range(130)]
+    stored = set(node_ids) | {"other"}
+
+    def delete_many(filter):
+        # Deletes at most 20 documents per request, as the Data API does
+        assert len(filter["_id"]["$in"]) <= 100
+        matches = sorted(stored & set(filter["_id"]["$in"]))
+        stored.difference_update(matches[:20])
+        return {
+            "status": {"deletedCount": len(matches[:20]), "moreData": len(matches) > 20}
+        }
+
+    collection = MagicMock()
+    collection.delete_many.side_effect = delete_many
+    with patch("astrapy.db.AstraDB") as astra_db:
+        astra_db.return_value.create_collection.return_value = collection
+        store = ProjectedAstraDBVectorStore(
+            metadata_fields=["source"],
+            token="token",
+            api_endpoint="http://localhost",
+            collection_name="data",
+            embedding_dimension=2,
+        )
+
+    store.delete_nodes(node_ids)
+
+    assert stored == {"other"}